@@ -0,0 +1,181 @@
+import gzip
+import hashlib
+import os
+import threading
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from drf_yasg.codecs import OpenAPICodecJson, OpenAPICodecYaml
+
+from rest_framework import permissions, renderers
+from rest_framework.views import APIView
+
+
+FORMATS = {
+    'openapi': ('openapi.json', 'application/openapi+json; charset=utf-8'),
+    'json': ('openapi.json', 'application/json; charset=utf-8'),
+    'yaml': ('openapi.yaml', 'application/yaml; charset=utf-8'),
+}
+
+_artifacts = {}
+_lock = threading.Lock()
+
+
+def get_schema_dir():
+    default = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'openapi')
+    return getattr(settings, 'OPENAPI_SCHEMA_DIR', default)
+
+
+def generate():
+    """
+    Генерирует схему так же, как `schema_view`, но один раз и без запроса. Возвращает {имя файла: байты}.
+    """
+    from MaDaDevAPI.urls import api_info, api_patterns, schema_view
+
+    generator = schema_view.generator_class(api_info, patterns=api_patterns)
+    schema = generator.get_schema(request=None, public=True)
+
+    return {
+        'openapi.json': OpenAPICodecJson(validators=[]).encode(schema),
+        'openapi.yaml': OpenAPICodecYaml(validators=[]).encode(schema),
+    }
+
+
+def write(documents, directory=None):
+    directory = directory or get_schema_dir()
+    os.makedirs(directory, exist_ok=True)
+
+    for name, content in documents.items():
+        with open(os.path.join(directory, name), 'wb') as file:
+            file.write(content)
+        with open(os.path.join(directory, name + '.gz'), 'wb') as file:
+            file.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+
+def stale_files(documents, directory=None):
+    """
+    Список файлов артефакта, которые отсутствуют или отличаются от только что сгенерированной схемы.
+    """
+    directory = directory or get_schema_dir()
+    stale = []
+
+    for name, content in documents.items():
+        try:
+            if read(os.path.join(directory, name)) != content:
+                stale.append(name)
+        except FileNotFoundError:
+            stale.append(name)
+
+    return stale
+
+
+def read(path):
+    with open(path, 'rb') as file:
+        return file.read()
+
+
+def load(name):
+    """
+    Артефакт из памяти процесса: с диска, если `build_schema` уже его записал, иначе генерируется один раз.
+    """
+    artifact = _artifacts.get(name)
+    if artifact is not None:
+        return artifact
+
+    with _lock:
+        if name not in _artifacts:
+            path = os.path.join(get_schema_dir(), name)
+            if os.path.exists(path):
+                documents = {name: read(path)}
+            else:
+                documents = generate()
+
+            for document, content in documents.items():
+                compressed = os.path.join(get_schema_dir(), document + '.gz')
+                _artifacts[document] = {
+                    'content': content,
+                    'gzip': read(compressed) if os.path.exists(compressed)
+                    else gzip.compress(content, compresslevel=9, mtime=0),
+                    'etag': '"%s"' % hashlib.sha256(content).hexdigest(),
+                }
+
+    return _artifacts[name]
+
+
+def reset():
+    with _lock:
+        _artifacts.clear()
+
+
+def accepts_gzip(accept_encoding):
+    """
+    Разрешает ли заголовок `Accept-Encoding` ответ в gzip. Учитываются q-значения: `gzip;q=0` — отказ,
+    `*` действует, если `gzip` не указан явно.
+    """
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = item.split(';')
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    quality = qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0.0)))
+    return quality > 0
+
+
+class SchemaArtifactView(APIView):
+    """
+    Отдаёт заранее собранную схему OpenAPI (JSON или YAML), сжатую gzip, если клиент это поддерживает.
+    """
+    permission_classes = (permissions.IsAuthenticated,)
+    schema = None
+    swagger_schema = None
+
+    def perform_content_negotiation(self, request, force=False):
+        # Формат выбирается параметром `format` по FORMATS, а не рендерерами DRF
+        return renderers.JSONRenderer(), renderers.JSONRenderer.media_type
+
+    def get(self, request, *args, **kwargs):
+        name, content_type = FORMATS[request.query_params.get('format', 'openapi')]
+        artifact = load(name)
+
+        if accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            response = HttpResponse(artifact['gzip'], content_type=content_type)
+            response['Content-Encoding'] = 'gzip'
+            # Сжатое представление — другие байты, поэтому ETag слабый, как у `GZipMiddleware`
+            etag = 'W/' + artifact['etag']
+        else:
+            response = HttpResponse(artifact['content'], content_type=content_type)
+            etag = artifact['etag']
+
+        response['ETag'] = etag
+        patch_vary_headers(response, ('Accept-Encoding',))
+        patch_cache_control(response, private=True, max_age=getattr(settings, 'OPENAPI_CACHE_TIMEOUT', 3600))
+
+        return get_conditional_response(request, etag=etag, response=response)
+
+
+def docs_view(ui_view):
+    """
+    `api/docs/` отдаёт страницу ReDoc, а запросы схемы (`?format=openapi`) — из артефакта. Ответ зависит от
+    `Accept-Encoding`, поэтому `Vary` выставляется для обоих.
+    """
+    spec_view = SchemaArtifactView.as_view()
+
+    def view(request, *args, **kwargs):
+        if request.GET.get('format') in FORMATS:
+            response = spec_view(request, *args, **kwargs)
+        else:
+            response = ui_view(request, *args, **kwargs)
+        patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+    return view
@@ -1,6 +1,9 @@
+import re
+
 from main.views import *
 from activation.views import *
-from MaDaDevAPI import settings
+from main import media
+from MaDaDevAPI import settings, openapi as openapi_artifact
 
 from rest_framework import routers, permissions
 
@@ -11,8 +14,7 @@ from drf_yasg import openapi
 from rest_framework_simplejwt.views import TokenRefreshView
 
 from django.contrib import admin
-from django.urls import path, include
-from django.conf.urls.static import static
+from django.urls import path, re_path, include
 
 
 router = routers.DefaultRouter()
@@ -27,17 +29,22 @@ activation_router = routers.DefaultRouter()
 activation_router.register('token', TokenConfirmView, basename="TokenConfirm")
 
 
+api_info = openapi.Info(
+    title="MaDaDev API",
+    default_version='v0.3.1',
+    description="MaDaDev API предоставляет доступ к всем необходимым ресурсам сервисов MaDaDev",
+    terms_of_service="https://madadev.ru",
+    contact=openapi.Contact(url="https://madadev.ru", email="testsystemmadadev@mail.ru"),
+    license=openapi.License(name="MaDaDev License")
+)
+
+api_patterns = [path('api/v1/', include(router.urls)),
+                path('user/', include(activation_router.urls)), ]
+
+
 schema_view = get_schema_view(
-    openapi.Info(
-        title="MaDaDev API",
-        default_version='v0.3.1',
-        description="MaDaDev API предоставляет доступ к всем необходимым ресурсам сервисов MaDaDev",
-        terms_of_service="https://madadev.ru",
-        contact=openapi.Contact(url="https://madadev.ru", email="testsystemmadadev@mail.ru"),
-        license=openapi.License(name="MaDaDev License")
-    ),
-    patterns=[path('api/v1/', include(router.urls)),
-              path('user/', include(activation_router.urls)), ],
+    api_info,
+    patterns=api_patterns,
     public=True,
     permission_classes=(permissions.IsAuthenticated,),
 )
@@ -52,6 +59,9 @@ urlpatterns = [
     path('user/', include(activation_router.urls)),
 
     path('api/v1/user/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('api/v1/metrics/', MetricsAPIView.as_view(), name='metrics'),
+
+    path('api/docs/', openapi_artifact.docs_view(schema_view.with_ui('redoc', cache_timeout=0)), name='schema-redoc'),
 
-    path('api/docs/', schema_view.with_ui('redoc', cache_timeout=0), name='schema-redoc'),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), media.serve, name='media'),
+]
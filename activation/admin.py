@@ -1,3 +1,8 @@
 from django.contrib import admin
+from activation.models import EmailOutbox
 
-# Register your models here.
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ['id', 'email_class', 'status', 'priority', 'attempts', 'created_at', 'sent_at']
+    list_filter = ['status', 'email_class']
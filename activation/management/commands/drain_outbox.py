@@ -0,0 +1,53 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from activation import outbox
+import activation.views  # noqa: регистрирует классы писем в outbox.registry
+
+
+class Command(BaseCommand):
+    help = "Отправляет письма из EmailOutbox пулом воркеров через переиспользуемое SMTP-соединение"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Количество воркеров")
+        parser.add_argument('--batch-size', type=int, default=None, help="Размер пачки писем")
+        parser.add_argument('--interval', type=float, default=1.0, help="Пауза при пустой очереди, сек")
+        parser.add_argument('--once', action='store_true', help="Отправить всё, что готово, и выйти")
+        parser.add_argument('--stats', action='store_true', help="Вывести глубину очереди и выйти")
+
+    def handle(self, *args, **options):
+        if options['stats']:
+            self.stdout.write(f"outbox_queue_depth {outbox.queue_depth()}")
+            return
+
+        outbox.release_stale()
+
+        if options['once']:
+            sent = 0
+            while True:
+                batch = outbox.drain(options['batch_size'])
+                if not batch:
+                    break
+                sent += batch
+            self.stdout.write(f"sent {sent}, outbox_queue_depth {outbox.queue_depth()}")
+            return
+
+        stop_event = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+        signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+
+        workers = [threading.Thread(target=outbox.run_worker,
+                                    args=(stop_event, options['batch_size'], options['interval']),
+                                    name=f"outbox-worker-{number}")
+                   for number in range(options['workers'])]
+        for worker in workers:
+            worker.start()
+
+        while not stop_event.wait(60):
+            outbox.release_stale()
+            self.stdout.write(f"outbox_queue_depth {outbox.queue_depth()}")
+
+        for worker in workers:
+            worker.join()
@@ -1,3 +1,49 @@
 from django.db import models
+from django.utils import timezone
 
-# Create your models here.
+
+class EmailOutboxQuerySet(models.QuerySet):
+    def ready(self):
+        return self.filter(status=EmailOutbox.STATUS_PENDING,
+                           next_attempt_at__lte=timezone.now()).order_by('priority', 'id')
+
+    def depth(self):
+        return self.filter(status__in=[EmailOutbox.STATUS_PENDING, EmailOutbox.STATUS_SENDING]).count()
+
+
+# Очередь писем, которые отправляет воркер `drain_outbox` вместо view
+class EmailOutbox(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    email_class = models.CharField(max_length=64, null=False)
+    to = models.JSONField(null=False, default=list)
+    user_id = models.BigIntegerField(null=True)
+    context = models.JSONField(null=False, default=dict)
+    priority = models.PositiveSmallIntegerField(null=False, default=100)
+    status = models.CharField(max_length=16, null=False, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    attempts = models.PositiveSmallIntegerField(null=False, default=0)
+    claim = models.CharField(max_length=32, null=True, blank=True)
+    last_error = models.TextField(null=False, blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(null=False, default=timezone.now)
+    claimed_at = models.DateTimeField(null=True)
+    sent_at = models.DateTimeField(null=True)
+
+    objects = EmailOutboxQuerySet.as_manager()
+
+    class Meta:
+        db_table = 'email_outbox'
+        indexes = [
+            models.Index(fields=['status', 'priority', 'next_attempt_at'], name='email_outbox_ready_idx'),
+            models.Index(fields=['claim'], name='email_outbox_claim_idx'),
+        ]
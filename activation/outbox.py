@@ -0,0 +1,210 @@
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sites.shortcuts import get_current_site
+from django.core.mail import get_connection
+from django.db import close_old_connections, connections
+from django.utils import timezone
+
+from activation.models import EmailOutbox
+from main import metrics
+from main.models import User
+
+
+logger = logging.getLogger(__name__)
+
+PRIORITY_RECOVERY = 10
+PRIORITY_CONFIRM = 20
+PRIORITY_NOTIFY = 30
+PRIORITY_RECONFIRM = 40
+
+registry = {}
+
+email_queue_latency = metrics.get_or_create(metrics.Histogram, 'email_queue_seconds',
+                                            "Время постановки письма в очередь из запроса")
+email_send_latency = metrics.get_or_create(metrics.Histogram, 'email_send_seconds',
+                                           "Время сборки и отправки одного письма воркером")
+emails_processed = metrics.get_or_create(metrics.Counter, 'emails_processed_total',
+                                         "Письма, обработанные воркером, status=sent|retry|failed")
+outbox_depth = metrics.get_or_create(metrics.Gauge, 'email_outbox_depth',
+                                     "Письма в очереди на момент сбора метрик")
+
+
+def get_setting(name, default):
+    return getattr(settings, name, default)
+
+
+def site_context(request):
+    """
+    Снимок `domain`, `protocol` и `site_name` на момент запроса: воркер рендерит письмо без request.
+    """
+    if request is None:
+        return {}
+
+    site = get_current_site(request)
+    return {
+        'domain': getattr(settings, 'DOMAIN', '') or site.domain,
+        'protocol': 'https' if request.is_secure() else 'http',
+        'site_name': getattr(settings, 'SITE_NAME', '') or site.name,
+    }
+
+
+class OutboxEmailMixin:
+    """
+    Примесь к `BaseEmailMessage`: вместо `send()` письмо кладётся в `EmailOutbox` через `queue()`.
+    """
+    outbox_priority = PRIORITY_NOTIFY
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        registry[cls.__name__] = cls
+
+    def queue(self, to):
+        user = self.context.get('user')
+
+        with email_queue_latency.time(email_class=type(self).__name__):
+            return EmailOutbox.objects.create(email_class=type(self).__name__,
+                                              to=list(to),
+                                              user_id=user.pk if user is not None else None,
+                                              context=site_context(self.request),
+                                              priority=self.outbox_priority)
+
+
+def retry_delay(attempts):
+    base = get_setting('EMAIL_OUTBOX_RETRY_DELAY', 30)
+    limit = get_setting('EMAIL_OUTBOX_MAX_RETRY_DELAY', 3600)
+    return timedelta(seconds=min(base * 2 ** max(attempts - 1, 0), limit))
+
+
+def release_stale():
+    """
+    Возвращает в очередь письма, которые воркер взял и не отправил (например, процесс упал).
+    """
+    timeout = get_setting('EMAIL_OUTBOX_CLAIM_TIMEOUT', 300)
+    return EmailOutbox.objects.filter(status=EmailOutbox.STATUS_SENDING,
+                                      claimed_at__lt=timezone.now() - timedelta(seconds=timeout)) \
+        .update(status=EmailOutbox.STATUS_PENDING, claim=None)
+
+
+def claim(batch_size):
+    """
+    Забирает пачку писем под уникальный `claim`, чтобы несколько воркеров не отправили одно письмо дважды.
+    """
+    token = uuid.uuid4().hex
+    ids = list(EmailOutbox.objects.ready().values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return []
+
+    EmailOutbox.objects.filter(id__in=ids, status=EmailOutbox.STATUS_PENDING) \
+        .update(status=EmailOutbox.STATUS_SENDING, claim=token, claimed_at=timezone.now())
+
+    return list(EmailOutbox.objects.filter(claim=token).order_by('priority', 'id'))
+
+
+def build_message(entry, users):
+    email_class = registry[entry.email_class]
+
+    context = dict(entry.context)
+    if entry.user_id is not None:
+        context['user'] = users[entry.user_id]
+
+    message = email_class(None, context)
+    message.render()
+    message.to = entry.to
+    message.from_email = settings.DEFAULT_FROM_EMAIL
+    return message
+
+
+def record_failure(entry, error, max_attempts):
+    """
+    Возвращает письмо в очередь с задержкой `retry_delay` или, после `max_attempts` попыток, помечает
+    неотправленным.
+    """
+    entry.last_error = f"{type(error).__name__}: {error}"
+    entry.claim = None
+
+    if entry.attempts >= max_attempts or isinstance(error, LookupError):
+        entry.status = EmailOutbox.STATUS_FAILED
+        emails_processed.inc(status='failed')
+    else:
+        entry.status = EmailOutbox.STATUS_PENDING
+        entry.next_attempt_at = timezone.now() + retry_delay(entry.attempts)
+        emails_processed.inc(status='retry')
+
+
+def drain(batch_size=None, connection=None):
+    """
+    Отправляет одну пачку писем через одно SMTP-соединение. Возвращает число отправленных писем. Если
+    соединение не открылось, вся пачка возвращается в очередь с задержкой.
+    """
+    batch_size = batch_size or get_setting('EMAIL_OUTBOX_BATCH_SIZE', 50)
+    max_attempts = get_setting('EMAIL_OUTBOX_MAX_ATTEMPTS', 5)
+
+    entries = claim(batch_size)
+    if not entries:
+        return 0
+
+    users = User.objects.in_bulk({entry.user_id for entry in entries if entry.user_id is not None})
+    connection = connection or get_connection()
+    sent = 0
+
+    try:
+        connection.open()
+    except Exception as error:  # noqa
+        logger.warning("Email connection failed, %d emails deferred: %s", len(entries), error)
+        for entry in entries:
+            entry.attempts += 1
+            record_failure(entry, error, max_attempts)
+        EmailOutbox.objects.bulk_update(entries, ['status', 'attempts', 'claim', 'last_error', 'next_attempt_at'])
+        return 0
+
+    try:
+        for entry in entries:
+            entry.attempts += 1
+            try:
+                if entry.user_id is not None and entry.user_id not in users:
+                    raise LookupError(f"user {entry.user_id} does not exist")
+
+                with email_send_latency.time(email_class=entry.email_class):
+                    connection.send_messages([build_message(entry, users)])
+            except Exception as error:  # noqa
+                record_failure(entry, error, max_attempts)
+            else:
+                entry.status = EmailOutbox.STATUS_SENT
+                entry.sent_at = timezone.now()
+                entry.last_error = ""
+                sent += 1
+                emails_processed.inc(status='sent')
+
+        EmailOutbox.objects.bulk_update(entries, ['status', 'attempts', 'claim', 'last_error',
+                                                  'next_attempt_at', 'sent_at'])
+    finally:
+        connection.close()
+
+    return sent
+
+
+def run_worker(stop_event, batch_size=None, interval=1.0):
+    """
+    Цикл одного воркера: отправляет пачки, пока очередь не пуста, затем ждёт `interval` секунд. Ошибка
+    пачки (база, SMTP) пишется в лог, воркер продолжает работу; взятые и не отправленные письма вернёт
+    `release_stale`.
+    """
+    try:
+        while not stop_event.is_set():
+            try:
+                close_old_connections()
+                sent = drain(batch_size)
+            except Exception:  # noqa
+                logger.exception("Email outbox batch failed")
+                sent = 0
+            if not sent:
+                stop_event.wait(interval)
+    finally:
+        connections.close_all()
+
+
+def queue_depth():
+    return EmailOutbox.objects.depth()
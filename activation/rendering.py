@@ -0,0 +1,211 @@
+import functools
+import threading
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.template.base import TextNode, VariableNode
+from django.template.context import make_context
+from django.template.loader import get_template
+from django.template.loader_tags import BlockNode
+from django.template.defaulttags import LoadNode
+
+from templated_mail.mail import BaseEmailMessage
+
+from main import metrics
+
+
+# Переменные, общие для всех писем сайта: части блоков с ними рендерятся один раз на сайт
+SHARED_CONTEXT = ('domain', 'protocol', 'site_name')
+
+emails_rendered = metrics.get_or_create(metrics.Counter, 'emails_rendered_total',
+                                        "Письма, собранные из шаблона, compiled=yes|no")
+
+_compiled = {}
+_compiled_lock = threading.Lock()
+
+
+def is_shared(node):
+    """
+    Текст и переменные из `SHARED_CONTEXT` (с фильтрами без аргументов-переменных) не зависят от письма.
+    """
+    if isinstance(node, TextNode):
+        return True
+    if not isinstance(node, VariableNode):
+        return False
+
+    expression = node.filter_expression
+    lookups = getattr(expression.var, 'lookups', None)
+    if not lookups or lookups[0] not in SHARED_CONTEXT:
+        return False
+    return not any(lookup for _, arguments in expression.filters for lookup, _ in arguments)
+
+
+class CompiledEmailTemplate:
+    """
+    Шаблон письма, разобранный на блоки `subject`, `text_body`, `html_body`. Подряд идущие текст и общие
+    переменные блока склеиваются в одну строку при первом письме для сайта, на каждое письмо рендерятся
+    только узлы с его контекстом (`code`, `user`).
+    """
+
+    def __init__(self, template, node_map):
+        self.template = template
+        self.blocks = {}
+        names = set()
+
+        for node in template.template.nodelist:
+            if isinstance(node, BlockNode) and node.name in node_map:
+                self.blocks[node_map[node.name]] = list(node.nodelist)
+                names.update(child.filter_expression.var.lookups[0] for child in node.nodelist
+                             if isinstance(child, VariableNode) and is_shared(child))
+
+        self.names = tuple(sorted(names))
+        self.prepared = functools.lru_cache(maxsize=16)(self.prepare)
+
+    @staticmethod
+    def compilable(template):
+        """
+        Только плоские шаблоны из текста, `{% load %}` и блоков: наследование и теги вне блоков рендерятся
+        обычным способом.
+        """
+        return all(isinstance(node, (TextNode, LoadNode, BlockNode)) for node in template.template.nodelist)
+
+    def prepare(self, shared):
+        """
+        Части блоков для значений общих переменных `shared`: строки и узлы, которые рендерятся на письмо.
+        """
+        context = make_context(dict(zip(self.names, shared)))
+        parts = {}
+
+        with context.bind_template(self.template.template):
+            for attr, nodes in self.blocks.items():
+                block = []
+                for node in nodes:
+                    if not is_shared(node):
+                        block.append(node)
+                    elif block and isinstance(block[-1], str):
+                        block[-1] += node.render(context)
+                    else:
+                        block.append(node.render(context))
+                parts[attr] = block
+        return parts
+
+    def parts(self, context_data):
+        """
+        Подготовленные части блоков для значений общих переменных из `context_data`.
+        """
+        shared = tuple(context_data.get(name) for name in self.names)
+        try:
+            return self.prepared(shared)
+        except TypeError:
+            # Значение общей переменной не хешируется, части для него не кэшируются
+            return self.prepare(shared)
+
+    def render(self, context_data, request=None, parts=None):
+        """
+        Текст блоков для контекста письма: {атрибут письма: текст}. `parts` — уже подготовленные части.
+        """
+        if parts is None:
+            parts = self.parts(context_data)
+
+        context = make_context(context_data, request=request)
+        with context.bind_template(self.template.template):
+            return {attr: "".join(part if isinstance(part, str) else part.render(context) for part in block).strip()
+                    for attr, block in parts.items()}
+
+
+def get_compiled(template_name, node_map):
+    """
+    Скомпилированный шаблон процесса или None, если шаблон нельзя разобрать на блоки.
+    """
+    key = (template_name, tuple(sorted(node_map.items())))
+    compiled = _compiled.get(key)
+    if compiled is None and key not in _compiled:
+        with _compiled_lock:
+            if key not in _compiled:
+                template = get_template(template_name)
+                _compiled[key] = CompiledEmailTemplate(template, node_map) \
+                    if CompiledEmailTemplate.compilable(template) else None
+            compiled = _compiled[key]
+    return compiled
+
+
+@receiver(setting_changed)
+def reset_compiled(setting, **kwargs):
+    if setting == 'TEMPLATES':
+        with _compiled_lock:
+            _compiled.clear()
+
+
+class CompiledTemplateMixin:
+    """
+    Примесь к `BaseEmailMessage`: шаблон компилируется один раз на процесс (`get_compiled`), письмо
+    собирается из готовых частей. Шаблоны, которые нельзя разобрать, рендерятся как в `BaseEmailMessage`.
+    """
+
+    def render(self):
+        compiled = get_compiled(self.template_name, self._node_map)
+        if compiled is None:
+            emails_rendered.inc(compiled='no')
+            return super().render()
+
+        for attr, text in compiled.render(self.get_context_data(), self.request).items():
+            setattr(self, attr, text)
+        self._attach_body()
+        emails_rendered.inc(compiled='yes')
+
+
+def render_many(email_class, contexts, request=None):
+    """
+    Собирает письма `email_class` для списка контекстов. Скомпилированный шаблон берётся один раз на пачку,
+    значения `SHARED_CONTEXT` по умолчанию (сайт из запроса или настроек) вычисляются один раз и
+    подставляются в контексты без своих, общие части блоков готовятся один раз на каждый сайт пачки.
+    """
+    compiled = get_compiled(email_class.template_name, email_class._node_map)
+    if compiled is None:
+        messages = [email_class(request, context) for context in contexts]
+        for message in messages:
+            message.render()
+        emails_rendered.inc(len(messages), compiled='no')
+        return messages
+
+    defaults = BaseEmailMessage(request).get_context_data()
+    site = {name: defaults[name] for name in SHARED_CONTEXT}
+    prepared = {}
+    messages = []
+
+    for context in contexts:
+        message = email_class(request, dict(site, **context))
+        context_data = message.get_context_data()
+
+        shared = tuple(context_data.get(name) for name in compiled.names)
+        try:
+            parts = prepared.get(shared)
+            if parts is None:
+                parts = prepared[shared] = compiled.parts(context_data)
+        except TypeError:
+            parts = compiled.parts(context_data)
+
+        for attr, text in compiled.render(context_data, request, parts).items():
+            setattr(message, attr, text)
+        message._attach_body()
+        messages.append(message)
+
+    emails_rendered.inc(len(messages), compiled='yes')
+    return messages
+
+
+def send_many(email_class, recipients, request=None, connection=None):
+    """
+    Отправляет письма `email_class` пачкой через одно соединение. `recipients` — пары (адреса, контекст).
+    Возвращает число отправленных писем.
+    """
+    recipients = list(recipients)
+    messages = render_many(email_class, [context for _, context in recipients], request)
+    for message, (to, _) in zip(messages, recipients):
+        message.to = list(to)
+        message.from_email = settings.DEFAULT_FROM_EMAIL
+
+    connection = connection or get_connection()
+    return connection.send_messages(messages)
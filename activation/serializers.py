@@ -1,3 +1,5 @@
+from main import hashing
+from main.metrics import TimedValidationMixin
 from main.models import User
 from activation import encoding
 
@@ -6,7 +8,7 @@ from rest_framework import serializers
 from django.contrib.auth.tokens import default_token_generator
 
 
-class UidAndTokenSerializer(serializers.Serializer): # noqa
+class UidAndTokenSerializer(TimedValidationMixin, serializers.Serializer): # noqa
     default_error_messages = {
         "invalid_token": "Invalid token",
         "invalid_uid": "Invalid UID",
@@ -50,7 +52,7 @@ class RecoveryPasswordSerializer(UidAndTokenSerializer): # noqa
     def validate(self, attrs):
         attrs = super().validate(attrs)
 
-        self.user.set_password(attrs['password'])
+        hashing.set_password(self.user, attrs['password'])
         self.user.save()
 
         return attrs
@@ -1,3 +1,183 @@
-from django.test import TestCase
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.tokens import default_token_generator
+from django.core import mail
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+
+from templated_mail.mail import BaseEmailMessage
+
+from activation import encoding, outbox, rendering
+from activation.models import EmailOutbox
+from activation.views import ConfirmEmail, PasswordChangedEmail, PasswordRecoveryEmail, ReConfirmEmail
+from main.models import User
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+        self.user.is_email_verified = True
+        self.user.save()
+
+    def test_queue_does_not_send(self):
+        ConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(outbox.queue_depth(), 1)
+
+    def test_drain_sends_by_priority(self):
+        ReConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+        PasswordRecoveryEmail(None, {'user': self.user}).queue(self.user)
+
+        self.assertEqual(outbox.drain(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(mail.outbox[0].to, [self.user.email])
+        self.assertIn("/", mail.outbox[0].body)
+        self.assertEqual(
+            [entry.email_class for entry in EmailOutbox.objects.order_by('sent_at', 'id')],
+            ['PasswordRecoveryEmail', 'ReConfirmEmail']
+        )
+        self.assertEqual(outbox.queue_depth(), 0)
+
+    def test_failed_send_is_retried_with_backoff(self):
+        ConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError("down")):
+            self.assertEqual(outbox.drain(), 0)
+
+        entry = EmailOutbox.objects.get()
+        self.assertEqual(entry.status, EmailOutbox.STATUS_PENDING)
+        self.assertEqual(entry.attempts, 1)
+        self.assertIn("down", entry.last_error)
+        self.assertFalse(EmailOutbox.objects.ready().exists())
+
+    @override_settings(EMAIL_OUTBOX_MAX_ATTEMPTS=1)
+    def test_failed_send_gives_up(self):
+        ConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.send_messages', side_effect=OSError("down")):
+            outbox.drain()
+
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_FAILED)
+        self.assertEqual(outbox.queue_depth(), 0)
+
+    def test_connection_failure_defers_batch(self):
+        ConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+
+        with mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=OSError("smtp down")), \
+                self.assertLogs('activation.outbox', level='WARNING'):
+            self.assertEqual(outbox.drain(), 0)
+
+        entry = EmailOutbox.objects.get()
+        self.assertEqual((entry.status, entry.attempts, entry.claim), (EmailOutbox.STATUS_PENDING, 1, None))
+        self.assertIn("smtp down", entry.last_error)
+        self.assertFalse(EmailOutbox.objects.ready().exists())
+
+    @override_settings(EMAIL_OUTBOX_RETRY_DELAY=0)
+    def test_worker_survives_errors(self):
+        ConfirmEmail(None, {'user': self.user}).queue([self.user.email])
+        stop_event = threading.Event()
+        claim = outbox.claim
+        calls = []
+
+        def flaky_claim(batch_size):
+            calls.append(batch_size)
+            if len(calls) == 1:
+                raise DatabaseError("database is locked")
+            if len(calls) == 3:
+                stop_event.set()
+            return claim(batch_size)
+
+        with mock.patch.object(outbox, 'claim', side_effect=flaky_claim), \
+                mock.patch('django.core.mail.backends.locmem.EmailBackend.open', side_effect=[OSError("down"), None]), \
+                self.assertLogs('activation.outbox', level='WARNING'):
+            outbox.run_worker(stop_event, interval=0)
+
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(EmailOutbox.objects.get().status, EmailOutbox.STATUS_SENT)
+
+    def test_unverified_user_gets_no_recovery_email(self):
+        self.user.is_email_verified = False
+        self.user.save()
+
+        self.assertIsNone(PasswordRecoveryEmail(None, {'user': self.user}).queue(self.user))
+        self.assertEqual(outbox.queue_depth(), 0)
+
+
+class PlainEmail(BaseEmailMessage):
+    pass
+
+
+class TaggedEmail(rendering.CompiledTemplateMixin, BaseEmailMessage):
+    template_name = 'email/tagged.html'
+
+
+@override_settings(EMAIL_BACKEND='django.core.mail.backends.locmem.EmailBackend')
+class CompiledEmailTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+        self.other = User.objects.create_user(username="other", email="other@madadev.ru", password="password")
+
+    @mock.patch.object(default_token_generator, 'make_token', return_value="token")
+    def test_compiled_render_matches_template(self, make_token):
+        for email_class in (ConfirmEmail, ReConfirmEmail, PasswordChangedEmail, PasswordRecoveryEmail):
+            with self.subTest(email_class=email_class.__name__):
+                context = {'user': self.user, 'site_name': "MaDaDev"}
+                compiled = email_class(None, dict(context))
+                compiled.render()
+                plain = PlainEmail(None, dict(compiled.get_context_data(), view=None),
+                                   template_name=email_class.template_name)
+                plain.render()
+
+                self.assertEqual((compiled.subject, compiled.body, compiled.html),
+                                 (plain.subject, plain.body, plain.html))
+                self.assertIn("MaDaDev", compiled.subject)
+
+    def test_shared_parts_are_prepared_once_per_site(self):
+        compiled = rendering.get_compiled(ConfirmEmail.template_name, ConfirmEmail._node_map)
+        compiled.prepared.cache_clear()
+
+        messages = rendering.render_many(ConfirmEmail, [{'user': user, 'site_name': "MaDaDev"}
+                                                        for user in (self.user, self.other, self.user)])
+        ConfirmEmail(None, {'user': self.user, 'site_name': "Other"}).render()
+
+        self.assertEqual(compiled.prepared.cache_info().misses, 2)
+        self.assertEqual(compiled.prepared.cache_info().hits, 0)
+        self.assertNotEqual(messages[0].body, messages[1].body)
+        self.assertIn(encoding.encode_uid(self.other.pk), messages[1].html)
+
+    @override_settings(SITE_NAME="MaDaDev")
+    def test_batch_matches_single_render(self):
+        contexts = [{'user': self.user}, {'user': self.other, 'site_name': "Other"}]
+
+        messages = rendering.render_many(PasswordChangedEmail, [dict(context) for context in contexts])
+
+        for message, context in zip(messages, contexts):
+            single = PasswordChangedEmail(None, dict(context))
+            single.render()
+            self.assertEqual((message.subject, message.body, message.html),
+                             (single.subject, single.body, single.html))
+        self.assertIn("Other", messages[1].subject)
+
+    def test_send_many_uses_one_connection(self):
+        sent = rendering.send_many(PasswordChangedEmail, [([user.email], {'user': user})
+                                                          for user in (self.user, self.other)])
+
+        self.assertEqual(sent, 2)
+        self.assertEqual([message.to for message in mail.outbox], [[self.user.email], [self.other.email]])
+        self.assertEqual(mail.outbox[0].alternatives[0][1], 'text/html')
+
+    @override_settings(TEMPLATES=[{
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'OPTIONS': {'loaders': [('django.template.loaders.locmem.Loader', {
+            'email/tagged.html': "{% if user %}{% endif %}{% block subject %}Hi {{ user.username }}{% endblock %}"
+        })]}}])
+    def test_template_with_tags_outside_blocks_falls_back(self):
+        message = TaggedEmail(None, {'user': self.user})
+        message.render()
+
+        self.assertIsNone(rendering.get_compiled(TaggedEmail.template_name, TaggedEmail._node_map))
+        self.assertEqual(message.subject, "Hi user")
@@ -1,5 +1,6 @@
 from main.models import User
-from activation import encoding, schemas
+from main.ratelimit import TokenBucketThrottle
+from activation import encoding, schemas, outbox, rendering
 from activation.serializers import *
 
 from django.contrib.auth.tokens import default_token_generator
@@ -13,8 +14,9 @@ from templated_mail.mail import BaseEmailMessage
 from drf_yasg.utils import swagger_auto_schema
 
 
-class ConfirmEmail(BaseEmailMessage):
+class ConfirmEmail(outbox.OutboxEmailMixin, rendering.CompiledTemplateMixin, BaseEmailMessage):
     template_name = "email/activate_email.html"
+    outbox_priority = outbox.PRIORITY_CONFIRM
 
     def get_context_data(self):
         context = super().get_context_data()
@@ -24,8 +26,9 @@ class ConfirmEmail(BaseEmailMessage):
         return context
 
 
-class ReConfirmEmail(BaseEmailMessage):
+class ReConfirmEmail(outbox.OutboxEmailMixin, rendering.CompiledTemplateMixin, BaseEmailMessage):
     template_name = "email/reactivate_email.html"
+    outbox_priority = outbox.PRIORITY_RECONFIRM
 
     def get_context_data(self):
         context = super().get_context_data()
@@ -35,8 +38,9 @@ class ReConfirmEmail(BaseEmailMessage):
         return context
 
 
-class PasswordChangedEmail(BaseEmailMessage):
+class PasswordChangedEmail(outbox.OutboxEmailMixin, rendering.CompiledTemplateMixin, BaseEmailMessage):
     template_name = "email/password_change_email.html"
+    outbox_priority = outbox.PRIORITY_NOTIFY
 
     def send(self, to, *args, **kwargs):
         if to.is_email_verified:
@@ -44,9 +48,16 @@ class PasswordChangedEmail(BaseEmailMessage):
         else:
             return None
 
+    def queue(self, to):
+        if to.is_email_verified:
+            return super(PasswordChangedEmail, self).queue([to.email])
+        else:
+            return None
 
-class PasswordRecoveryEmail(BaseEmailMessage):
+
+class PasswordRecoveryEmail(outbox.OutboxEmailMixin, rendering.CompiledTemplateMixin, BaseEmailMessage):
     template_name = "email/recovery_password_email.html"
+    outbox_priority = outbox.PRIORITY_RECOVERY
 
     def get_context_data(self):
         context = super().get_context_data()
@@ -62,8 +73,17 @@ class PasswordRecoveryEmail(BaseEmailMessage):
         else:
             return None
 
+    def queue(self, to):
+        if to.is_email_verified:
+            return super(PasswordRecoveryEmail, self).queue([to.email])
+        else:
+            return None
+
 
 class TokenConfirmView(viewsets.ViewSet):
+    throttle_classes = (TokenBucketThrottle,)
+    query_budgets = {'activate': 2}
+
     @action(detail=False, methods=['post'])
     @swagger_auto_schema(tags=['token'],
                          request_body=schemas.TokensSchemas().token_request(),
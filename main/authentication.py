@@ -0,0 +1,109 @@
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.db.models import FileField
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.utils import get_md5_hash_password
+
+from main import metrics
+from main.caching import get_versions
+
+
+user_cache_requests = metrics.get_or_create(metrics.Counter, 'user_cache_requests_total',
+                                            "Поиски пользователя по токену в кэше, result=hit|miss")
+user_cache_latency = metrics.get_or_create(metrics.Histogram, 'user_cache_lookup_seconds',
+                                           "Время получения пользователя по токену, включая запрос к базе при промахе")
+
+
+def get_cache():
+    return caches[getattr(settings, 'USER_CACHE', 'default')]
+
+
+def version_key(user_id):
+    return f"users:version:{user_id}"
+
+
+def invalidate_user(user_id):
+    """
+    Меняет версию пользователя, и следующий запрос с его токеном загрузит пользователя из базы заново.
+    Вызывается сигналами `post_save`/`post_delete` пользователя, а после `QuerySet.update()` по
+    пользователям — вручную.
+    """
+    get_cache().set(version_key(user_id), time.time_ns(), None)
+
+
+def make_snapshot(user):
+    """
+    Поля пользователя для кэша без хеша пароля: вместо него хранится только отпечаток из токена
+    (`REVOKE_TOKEN_CLAIM`), если включена проверка отзыва.
+    """
+    fields = {}
+    for field in user._meta.concrete_fields:
+        if field.attname == 'password':
+            continue
+        value = getattr(user, field.attname)
+        fields[field.attname] = value.name if isinstance(field, FileField) else value
+
+    return {
+        'db': user._state.db,
+        'fields': fields,
+        'password_hash': get_md5_hash_password(user.password) if api_settings.CHECK_REVOKE_TOKEN else None,
+    }
+
+
+def restore_snapshot(snapshot):
+    """
+    Несохранённая копия пользователя из `make_snapshot`. Пароль отложен, как при `.defer('password')`:
+    читается из базы при обращении, а `save()` записывает только загруженные поля.
+    """
+    names = list(snapshot['fields'])
+    return get_user_model().from_db(snapshot['db'], names, [snapshot['fields'][name] for name in names])
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    `JWTAuthentication`, который держит снимок пользователя без хеша пароля в кэше по id и версии из
+    `invalidate_user`, а не читает пользователя из базы на каждый запрос. Проверки активности и отзыва
+    токена выполняются и для пользователя из кэша.
+    """
+
+    @staticmethod
+    def check_user(user, validated_token, password_hash):
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        if api_settings.CHECK_REVOKE_TOKEN:
+            if validated_token.get(api_settings.REVOKE_TOKEN_CLAIM) != password_hash:
+                raise AuthenticationFailed(_("The user's password has been changed."), code="password_changed")
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError as e:
+            raise InvalidToken(_("Token contained no recognizable user identification")) from e
+
+        started = time.perf_counter()
+        cache = get_cache()
+        version, = get_versions([version_key(user_id)], cache=cache)
+        key = f"users:user:{user_id}:{version}"
+
+        snapshot = cache.get(key)
+        if snapshot is None:
+            result = 'miss'
+            user = super().get_user(validated_token)
+            cache.set(key, make_snapshot(user), getattr(settings, 'USER_CACHE_TIMEOUT', 300))
+        else:
+            result = 'hit'
+            user = restore_snapshot(snapshot)
+            self.check_user(user, validated_token, snapshot['password_hash'])
+
+        user_cache_requests.inc(result=result)
+        user_cache_latency.observe(time.perf_counter() - started, result=result)
+
+        return user
@@ -0,0 +1,61 @@
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.contrib.auth.hashers import identify_hasher
+
+from main import hashing
+
+
+UserModel = get_user_model()
+
+
+class PooledModelBackend(ModelBackend):
+    """
+    `ModelBackend`, который проверяет пароль в пуле процессов `main.hashing`, а не в воркере запроса.
+    Подключается через `AUTHENTICATION_BACKENDS = ['main.backends.PooledModelBackend']`.
+    """
+
+    @staticmethod
+    def must_update(user):
+        try:
+            return identify_hasher(user.password).must_update(user.password)
+        except ValueError:
+            return False
+
+    def upgrade_password(self, user, password):
+        if self.must_update(user):
+            hashing.set_password(user, password)
+            user.save(update_fields=['password'])
+
+    async def aupgrade_password(self, user, password):
+        if self.must_update(user):
+            await hashing.aset_password(user, password)
+            await user.asave(update_fields=['password'])
+
+    def authenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = UserModel._default_manager.get_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            # Хешируем пароль и для несуществующего пользователя, чтобы не выдавать его отсутствие по времени
+            hashing.make_password(password)
+        else:
+            if hashing.check_password(password, user.password) and self.user_can_authenticate(user):
+                self.upgrade_password(user, password)
+                return user
+
+    async def aauthenticate(self, request, username=None, password=None, **kwargs):
+        if username is None:
+            username = kwargs.get(UserModel.USERNAME_FIELD)
+        if username is None or password is None:
+            return
+        try:
+            user = await UserModel._default_manager.aget_by_natural_key(username)
+        except UserModel.DoesNotExist:
+            await hashing.amake_password(password)
+        else:
+            if await hashing.acheck_password(password, user.password) and self.user_can_authenticate(user):
+                await self.aupgrade_password(user, password)
+                return user
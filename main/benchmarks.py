@@ -0,0 +1,888 @@
+import asyncio
+import contextlib
+import importlib
+import io
+import itertools
+import json
+import logging
+import re
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from PIL import Image
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.tokens import default_token_generator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.servers.basehttp import ThreadedWSGIServer
+from django.db import DEFAULT_DB_ALIAS, connection, connections, reset_queries
+from django.db.backends.sqlite3 import base as sqlite_base
+from django.db.utils import load_backend
+from django.db.models import Count
+from django.test import AsyncClient, Client, modify_settings, override_settings
+from django.test.client import MULTIPART_CONTENT, encode_multipart, BOUNDARY
+from django.test.testcases import QuietWSGIRequestHandler
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, URLPattern
+
+from rest_framework.pagination import Cursor
+from rest_framework.test import APIClient, APIRequestFactory
+
+from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
+
+from templated_mail.mail import BaseEmailMessage
+
+from activation import encoding, rendering
+from activation.views import ConfirmEmail, PasswordChangedEmail
+from main import dbpool, facets, hashing, media, ratelimit, search
+from main.backends import PooledModelBackend
+from main.models import Product, ProductTag, TypeProduct, MiniNews, User
+from main.fastread import compile_serializer
+from main.pagination import KeysetPagination
+from main.serializers import ProductSerializer, ProductTypeSerializer, MiniNewsSerializer, CreateUserSerializer, \
+    UpdateUserSerializer, PasswordRecoverySerializer
+
+
+registry = {}
+
+
+def benchmark(name, http=False):
+    """
+    Регистрирует бенчмарк. `http=True` — бенчмарк умеет слать запросы по сети (`--http`, `--url`).
+    """
+    def decorator(function):
+        function.http = http
+        registry[name] = function
+        return function
+    return decorator
+
+
+def measure(function, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))]
+
+
+def summary(samples):
+    return {
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Регрессии относительно сохранённого базового прогона: больше запросов к базе, чем было, или `p95`
+    хуже больше чем на `tolerance` (доля). Замеры, которых нет в базовом прогоне, не сравниваются.
+    """
+    regressions = []
+
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+
+        if result.get('queries', 0) > expected.get('queries', 0):
+            regressions.append(f"{name}: {result['queries']} queries, baseline {expected['queries']}")
+        if result['p95_ms'] > expected['p95_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {result['p95_ms']:.2f} ms, baseline {expected['p95_ms']:.2f} ms")
+
+    return regressions
+
+
+def seed_catalog(products, types=20, news=0, batch_size=5000):
+    TypeProduct.objects.bulk_create([TypeProduct(product_type_name=f"Type {number}") for number in range(types)],
+                                    batch_size=batch_size)
+    type_ids = list(TypeProduct.objects.values_list('product_type_id', flat=True))
+
+    Product.objects.bulk_create([Product(product_title=f"Product {number}",
+                                         product_tag=f"tag{number % 50}",
+                                         product_desc=f"Description of product {number} " * 20,
+                                         product_type_id=type_ids[number % len(type_ids)])
+                                 for number in range(products)], batch_size=batch_size)
+
+    MiniNews.objects.bulk_create([MiniNews(mn_title=f"News {number}", mn_desc=f"Description of news {number}")
+                                  for number in range(news)], batch_size=batch_size)
+
+
+def seed_users(count, password, batch_size=5000):
+    encoded = make_password(password)
+    User.objects.bulk_create([User(username=f"user{number}", email=f"user{number}@madadev.ru", password=encoded,
+                                   is_email_verified=True, ip=f"10.{number // 65536 % 256}.{number // 256 % 256}."
+                                                               f"{number % 256}")
+                              for number in range(count)], batch_size=batch_size)
+    return encoded
+
+
+def png_upload(name="image.png"):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 64)).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@benchmark('pagination')
+def pagination(options, write):
+    """
+    Задержка страницы `/api/v1/products/` на разной глубине: `offset` против курсора.
+    """
+    rows = options['rows']
+    repeat = options['repeat']
+    seed_catalog(rows)
+
+    client = APIClient()
+    paginator = KeysetPagination()
+    paginator.base_url = "/api/v1/products/"
+    positions = list(Product.objects.order_by('product_id').values_list('product_id', flat=True))
+
+    write(f"{'depth':>10} {'offset p50 ms':>14} {'cursor p50 ms':>14}")
+    for depth in (0, rows // 10, rows // 2, rows - 100):
+        keyset_url = "/api/v1/products/?limit=20"
+        if depth:
+            keyset_url = paginator.encode_cursor(Cursor(offset=0, reverse=False, position=str(positions[depth - 1])))
+            keyset_url += "&limit=20"
+
+        offset = summary(measure(lambda: client.get("/api/v1/products/", {"offset": depth, "limit": 20}), repeat))
+        keyset = summary(measure(lambda: client.get(keyset_url), repeat))
+        write(f"{depth:>10} {offset['p50_ms']:>14.2f} {keyset['p50_ms']:>14.2f}")
+
+
+@benchmark('serialization')
+def serialization(options, write):
+    """
+    Строк в секунду: `ProductSerializer(many=True)` по моделям против `CompiledSerializer` по `.values()`.
+    """
+    seed_catalog(options['rows'])
+    request = APIRequestFactory().get("/api/v1/products/")
+
+    def classic():
+        queryset = Product.objects.all()
+        return ProductSerializer(queryset, many=True, context={'request': request}).data
+
+    def compiled():
+        serializer = ProductSerializer(context={'request': request})
+        reader = compile_serializer(serializer)
+        return reader.many(Product.objects.values(*reader.columns), request)
+
+    write(f"{'path':>10} {'p50 ms':>10} {'rows/s':>12}")
+    for name, function in (('serializer', classic), ('compiled', compiled)):
+        result = summary(measure(function, options['repeat']))
+        write(f"{name:>10} {result['p50_ms']:>10.2f} {options['rows'] / result['p50_ms'] * 1000:>12.0f}")
+
+
+@benchmark('hashing')
+def password_hashing(options, write):
+    """
+    Входов в секунду через `PooledModelBackend` при разных размерах пула хеширования, `--rows` — число
+    одновременных клиентов.
+    """
+    User.objects.create_user(username="benchmark", email="benchmark@madadev.ru", password="password")
+    backend = PooledModelBackend()
+    clients = max(1, min(options['rows'], 64))
+
+    def login():
+        try:
+            backend.authenticate(None, username="benchmark", password="password")
+        except hashing.HashingQueueFull:
+            pass
+
+    def concurrent_logins():
+        threads = [threading.Thread(target=login) for _ in range(clients)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    write(f"{'workers':>8} {'p50 ms':>10} {'logins/s':>10} {'rejected':>9}")
+    for workers in (0, 1, 2, 4, 8):
+        hashing.configure(workers, clients)
+        rejected = hashing.hash_rejected.get()
+        result = summary(measure(concurrent_logins, options['repeat']))
+        write(f"{workers:>8} {result['p50_ms']:>10.2f} {clients / result['p50_ms'] * 1000:>10.1f} "
+              f"{hashing.hash_rejected.get() - rejected:>9}")
+    hashing.configure(0, 0)
+
+
+@benchmark('asgi')
+def asgi(options, write):
+    """
+    Запросов в секунду к `/api/v1/products/` через WSGI (пул из 32 потоков), ASGI с синхронными видами и
+    ASGI с асинхронными при 10, 100 и 1000 одновременных клиентах. Кэш каталога отключён.
+    """
+    seed_catalog(options['rows'])
+    path = "/api/v1/products/?limit=20"
+    repeat = options['repeat']
+
+    def wsgi_round(clients):
+        def client_session():
+            client = Client()
+            for _ in range(repeat):
+                client.get(path)
+
+        with ThreadPoolExecutor(max_workers=min(clients, 32)) as executor:
+            list(executor.map(lambda _: client_session(), range(clients)))
+
+    async def asgi_round(clients):
+        async def client_session():
+            client = AsyncClient()
+            for _ in range(repeat):
+                await client.get(path)
+
+        await asyncio.gather(*(client_session() for _ in range(clients)))
+
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+              'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+    modes = (('wsgi', False, wsgi_round),
+             ('asgi-sync', False, lambda clients: asyncio.run(asgi_round(clients))),
+             ('asgi-async', True, lambda clients: asyncio.run(asgi_round(clients))))
+
+    write(f"{'mode':>11} {'clients':>8} {'requests/s':>11}")
+    for mode, use_async, run_round in modes:
+        with override_settings(CATALOG_ASYNC_VIEWS=use_async, CACHES=caches, CATALOG_CACHE='benchmark'):
+            importlib.reload(importlib.import_module('MaDaDevAPI.urls'))
+            clear_url_caches()
+
+            for clients in (10, 100, 1000):
+                started = time.perf_counter()
+                run_round(clients)
+                elapsed = time.perf_counter() - started
+                write(f"{mode:>11} {clients:>8} {clients * repeat / elapsed:>11.0f}")
+
+    importlib.reload(importlib.import_module('MaDaDevAPI.urls'))
+    clear_url_caches()
+
+
+def routes():
+    """
+    Все маршруты `router`, `activation_router`, обновления токена, метрик и медиафайлов в виде `"METHOD /path/{pk}/"`.
+    """
+    from MaDaDevAPI import urls
+
+    found = []
+    for prefix, patterns in (('/api/v1/', urls.router.urls), ('/user/', urls.activation_router.urls)):
+        for pattern in patterns:
+            if not isinstance(pattern, URLPattern) or 'format' in str(pattern.pattern):
+                continue
+
+            path = prefix + re.sub(r'\(\?P<(\w+)>[^)]*\)', r'{\1}', str(pattern.pattern).strip('^$'))
+            actions = getattr(pattern.callback, 'actions', None) or {'get': 'root'}
+            # DRF дописывает `head` в `actions` при первом запросе к виду, он повторяет `get`
+            found.extend(f"{method.upper()} {path}" for method in actions if method != 'head')
+
+    return found + ["POST /api/v1/user/token/refresh/", "GET /api/v1/metrics/", "GET /media/{path}"]
+
+
+class EndpointContext:
+    """
+    Данные для сценариев эндпоинтов: засеянный каталог и пользователи, администратор и свежие объекты для
+    запросов, которые их меняют или удаляют.
+    """
+    password = "benchmark-password"
+
+    def __init__(self, rows):
+        seed_catalog(rows, news=max(rows // 10, 1))
+        self.encoded = seed_users(max(rows // 10, 1), self.password)
+        self.admin = User.objects.create_superuser(username="benchmark-admin", email="admin@madadev.ru",
+                                                   password=self.password)
+        self.reader = User.objects.filter(is_superuser=False).first()
+        self.product_id = Product.objects.values_list('product_id', flat=True).first()
+        self.product_type_id = TypeProduct.objects.values_list('product_type_id', flat=True).first()
+        self.mini_news_id = MiniNews.objects.values_list('mini_news_id', flat=True).first()
+        self.image = media.storage.save("images/products/benchmark.png", png_upload())
+        self.counter = itertools.count()
+
+    def unique(self):
+        return next(self.counter)
+
+    def new_user(self, verified=True):
+        number = self.unique()
+        return User.objects.create(username=f"bench{number}", email=f"bench{number}@madadev.ru",
+                                   password=self.encoded, is_email_verified=verified,
+                                   ip=f"172.16.{number // 256 % 256}.{number % 256}")
+
+    @staticmethod
+    def bearer(user):
+        return {'HTTP_AUTHORIZATION': f"Bearer {AccessToken.for_user(user)}"}
+
+    def new_product(self):
+        return Product.objects.create(product_title="Benchmark", product_type_id=self.product_type_id).pk
+
+    @staticmethod
+    def new_rows(model, count, **fields):
+        return [item.pk for item in model.objects.bulk_create([model(**fields) for _ in range(count)])]
+
+
+def bulk_rows(resource, count, product_type_id):
+    """
+    Строки для `POST /api/v1/{resource}/bulk/`.
+    """
+    if resource == 'products':
+        return [{"product_title": f"Bulk {number}", "product_tag": f"tag{number % 50}",
+                 "product_desc": f"Description of product {number}", "product_type_id": product_type_id,
+                 "tags": [f"tag{number % 50}", f"group{number % 7}"]}
+                for number in range(count)]
+    if resource == 'product_types':
+        return [{"product_type_name": f"Bulk {number}"} for number in range(count)]
+    return [{"mn_title": f"Bulk {number}", "mn_desc": f"Description of news {number}", "mn_date": "2024-01-01"}
+            for number in range(count)]
+
+
+def endpoint_scenarios(context):
+    """
+    Запрос для каждого маршрута: функция без аргументов возвращает (путь, данные, формат, заголовки).
+    Подготовка объектов выполняется в ней же, до начала замера.
+    """
+    c = context
+
+    return {
+        "GET /api/v1/": lambda: ("/api/v1/", None, None, {}),
+        "GET /user/": lambda: ("/user/", None, None, {}),
+        "GET /api/v1/users/": lambda: ("/api/v1/users/?limit=20", None, None, c.bearer(c.admin)),
+        "POST /api/v1/users/": lambda: ("/api/v1/users/", {
+            "username": f"new{c.unique()}", "email": f"new{c.unique()}@madadev.ru", "password": c.password,
+            "image": png_upload()}, 'multipart', {'REMOTE_ADDR': f"192.168.{c.unique() % 256}.{c.unique() % 256}"}),
+        "GET /api/v1/users/export/": lambda: ("/api/v1/users/export/?format=csv", None, None, c.bearer(c.admin)),
+        "GET /api/v1/users/{pk}/": lambda: (f"/api/v1/users/{c.reader.pk}/", None, None, c.bearer(c.reader)),
+        "PUT /api/v1/users/{pk}/": lambda: (lambda user: (f"/api/v1/users/{user.pk}/", {
+            "username": f"renamed{c.unique()}"}, 'json', c.bearer(user)))(c.new_user()),
+        "DELETE /api/v1/users/{pk}/": lambda: (f"/api/v1/users/{c.new_user().pk}/", None, None, c.bearer(c.admin)),
+        "GET /api/v1/auth/login/": lambda: ("/api/v1/auth/login/", {"username": c.reader.username,
+                                                                    "password": c.password}, 'json', {}),
+        "GET /api/v1/auth/logout/": lambda: ("/api/v1/auth/logout/", None, None, c.bearer(c.reader)),
+        "POST /api/v1/auth/change_password/": lambda: (lambda user: ("/api/v1/auth/change_password/", {
+            "old_password": c.password, "new_password": "changed-password"}, 'json', c.bearer(user)))(c.new_user()),
+        "GET /api/v1/auth/send_mail_recovery_password/": lambda: ("/api/v1/auth/send_mail_recovery_password/", {
+            "username": c.reader.username}, 'json', {}),
+        "GET /api/v1/auth/confirm_email/": lambda: ("/api/v1/auth/confirm_email/", None, None,
+                                                    c.bearer(c.new_user(verified=False))),
+        "GET /api/v1/products/": lambda: ("/api/v1/products/?limit=20", None, None, {}),
+        "POST /api/v1/products/": lambda: ("/api/v1/products/", {
+            "product_title": "Benchmark", "product_tag": "tag", "product_desc": "Description",
+            "product_type_id": c.product_type_id, "product_image": png_upload()}, 'multipart', c.bearer(c.admin)),
+        "GET /api/v1/products/facets/": lambda: ("/api/v1/products/facets/", None, None, {}),
+        "GET /api/v1/products/{pk}/": lambda: (f"/api/v1/products/{c.product_id}/", None, None, {}),
+        "POST /api/v1/products/bulk/": lambda: ("/api/v1/products/bulk/", bulk_rows(
+            'products', 100, c.product_type_id), 'json', c.bearer(c.admin)),
+        "DELETE /api/v1/products/bulk/": lambda: ("/api/v1/products/bulk/", {"ids": c.new_rows(
+            Product, 10, product_title="Bulk", product_type_id=c.product_type_id)}, 'json', c.bearer(c.admin)),
+        "DELETE /api/v1/products/{pk}/": lambda: (f"/api/v1/products/{c.new_product()}/", None, None,
+                                                  c.bearer(c.admin)),
+        "GET /api/v1/product_types/": lambda: ("/api/v1/product_types/?limit=20", None, None, {}),
+        "POST /api/v1/product_types/": lambda: ("/api/v1/product_types/", {"product_type_name": "Benchmark"},
+                                                'json', c.bearer(c.admin)),
+        "GET /api/v1/product_types/{pk}/": lambda: (f"/api/v1/product_types/{c.product_type_id}/", None, None, {}),
+        "POST /api/v1/product_types/bulk/": lambda: ("/api/v1/product_types/bulk/", bulk_rows(
+            'product_types', 100, None), 'ndjson', c.bearer(c.admin)),
+        "DELETE /api/v1/product_types/bulk/": lambda: ("/api/v1/product_types/bulk/", {"ids": c.new_rows(
+            TypeProduct, 10, product_type_name="Bulk")}, 'json', c.bearer(c.admin)),
+        "DELETE /api/v1/product_types/{pk}/": lambda: (f"/api/v1/product_types/"
+                                                       f"{TypeProduct.objects.create(product_type_name='Bench').pk}/",
+                                                       None, None, c.bearer(c.admin)),
+        "GET /api/v1/mini_news/": lambda: ("/api/v1/mini_news/?limit=20", None, None, {}),
+        "POST /api/v1/mini_news/": lambda: ("/api/v1/mini_news/", {"mn_title": "Benchmark", "mn_desc": "Description",
+                                                                    "mn_date": "2024-01-01"}, 'json',
+                                            c.bearer(c.admin)),
+        "GET /api/v1/mini_news/latest/": lambda: ("/api/v1/mini_news/latest/?n=20&format=rss", None, None, {}),
+        "GET /api/v1/mini_news/{pk}/": lambda: (f"/api/v1/mini_news/{c.mini_news_id}/", None, None, {}),
+        "POST /api/v1/mini_news/bulk/": lambda: ("/api/v1/mini_news/bulk/", bulk_rows(
+            'mini_news', 100, None), 'json', c.bearer(c.admin)),
+        "DELETE /api/v1/mini_news/bulk/": lambda: ("/api/v1/mini_news/bulk/", {"ids": c.new_rows(
+            MiniNews, 10, mn_title="Bulk", mn_desc="Bulk")}, 'json', c.bearer(c.admin)),
+        "DELETE /api/v1/mini_news/{pk}/": lambda: (f"/api/v1/mini_news/"
+                                                   f"{MiniNews.objects.create(mn_title='Bench', mn_desc='Bench').pk}/",
+                                                   None, None, c.bearer(c.admin)),
+        "POST /user/token/activate/": lambda: (lambda user: ("/user/token/activate/", {
+            "status": "confirm",
+            "code": f"{encoding.encode_uid(user.pk)}/{default_token_generator.make_token(user)}"},
+            'multipart', {}))(c.new_user(verified=False)),
+        "POST /api/v1/user/token/refresh/": lambda: ("/api/v1/user/token/refresh/", {
+            "refresh": str(RefreshToken.for_user(c.reader))}, 'json', {}),
+        "GET /api/v1/metrics/": lambda: ("/api/v1/metrics/", None, None, c.bearer(c.admin)),
+        "GET /media/{path}": lambda: (f"/media/{c.image}", None, None, {'HTTP_RANGE': "bytes=0-1023"}),
+    }
+
+
+def encode_body(data, data_format):
+    if data is None:
+        return b"", None
+    if data_format == 'multipart':
+        return encode_multipart(BOUNDARY, data), MULTIPART_CONTENT
+    if data_format == 'ndjson':
+        return b"".join(json.dumps(row).encode() + b"\n" for row in data), 'application/x-ndjson'
+    return json.dumps(data).encode(), 'application/json'
+
+
+def send(client, method, path, data, data_format, headers):
+    body, content_type = encode_body(data, data_format)
+    return client.generic(method, path, body, content_type=content_type or 'application/octet-stream', **headers)
+
+
+def http_headers(headers):
+    """
+    Заголовки сценария в виде `META` как заголовки HTTP. `REMOTE_ADDR` передаётся в `X-Forwarded-For`:
+    сервер учитывает его, только если адрес бенчмарка есть в `TRUSTED_PROXIES`.
+    """
+    result = {}
+    for name, value in headers.items():
+        if name == 'REMOTE_ADDR':
+            result['X-Forwarded-For'] = value
+        elif name.startswith('HTTP_'):
+            result[name[5:].replace('_', '-').title()] = value
+    return result
+
+
+def send_http(base_url, method, path, data, data_format, headers):
+    """
+    Запрос сценария по сети. Возвращает (статус ответа, секунды до конца тела ответа).
+    """
+    body, content_type = encode_body(data, data_format)
+    request = urllib.request.Request(base_url.rstrip('/') + path, data=body if data is not None else None,
+                                     method=method, headers=http_headers(headers))
+    if content_type:
+        request.add_header('Content-Type', content_type)
+
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            response.read()
+            status = response.status
+    except urllib.error.HTTPError as exc:
+        exc.read()
+        status = exc.code
+    return status, time.perf_counter() - started
+
+
+@contextlib.contextmanager
+def http_server():
+    """
+    Проект на `ThreadedWSGIServer` на свободном порту 127.0.0.1 в фоновом потоке, с текущими настройками
+    и базой. Отдаёт базовый URL сервера.
+    """
+    server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler, allow_reuse_address=False)
+    server.set_app(WSGIHandler())
+    thread = threading.Thread(target=server.serve_forever, name='benchmark-http', daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_port}"
+    finally:
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+@benchmark('endpoints', http=True)
+def endpoints(options, write):
+    """
+    Каждый маршрут API на засеянной базе: p50/p95/p99, запросов в секунду и запросов к базе на запрос.
+    Маршрут без сценария считается ошибкой, чтобы новые эндпоинты не выпадали из замеров.
+
+    По умолчанию запросы идут тестовым клиентом в этом же процессе: без сокетов, разбора HTTP и очереди
+    веб-сервера. С `--http` проект поднимается на `ThreadedWSGIServer`, с `--url` запросы уходят на уже
+    запущенный сервер, который должен работать с той же базой (например, `--keepdb` с PostgreSQL). По сети
+    подготовленные запросы маршрута отправляются в `--concurrency` потоков, а запросы к базе не считаются.
+    Тестовая SQLite в памяти не выдерживает одновременной записи, для неё нужна база на диске или PostgreSQL.
+    """
+    media_root = tempfile.mkdtemp()
+    limits = {action: {} for action in ratelimit.DEFAULT_RATE_LIMITS}
+    loggers = {name: logging.getLogger(name).level for name in ('django.request', 'main.bulk')}
+    # Ошибки 5xx и несохранённые пакеты попадают в таблицу статусов, трассировки в выводе не нужны
+    for name in loggers:
+        logging.getLogger(name).setLevel(logging.CRITICAL)
+
+    url = options.get('url')
+    server = http_server() if options.get('http') and not url else contextlib.nullcontext(url)
+    concurrency = max(options.get('concurrency') or 1, 1)
+
+    try:
+        # Адреса регистрации передаются локальному серверу через `X-Forwarded-For`
+        with override_settings(MEDIA_ROOT=media_root, RATE_LIMITS=limits,
+                               TRUSTED_PROXIES=['127.0.0.1/32']), server as base_url:
+            context = EndpointContext(options['rows'])
+            scenarios = endpoint_scenarios(context)
+
+            missing = [route for route in routes() if route not in scenarios]
+            if missing:
+                raise ValueError(f"No benchmark scenario for: {', '.join(missing)}")
+
+            client = APIClient(raise_request_exception=False)
+            results = {}
+
+            write(f"{'endpoint':<48} {'status':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} "
+                  f"{'queries':>7}")
+            for route, scenario in scenarios.items():
+                method = route.split()[0]
+
+                if base_url:
+                    requests = [scenario() for _ in range(options['repeat'])]
+                    started = time.perf_counter()
+                    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                        responses = list(executor.map(lambda request: send_http(base_url, method, *request),
+                                                      requests))
+                    elapsed = time.perf_counter() - started
+
+                    result = summary([seconds for _, seconds in responses])
+                    result['rps'] = len(responses) / elapsed
+                    result['status'] = sorted({status_code for status_code, _ in responses})
+                else:
+                    samples, queries, statuses = [], [], set()
+                    for _ in range(options['repeat']):
+                        path, data, data_format, headers = scenario()
+                        with CaptureQueriesContext(connection) as captured:
+                            started = time.perf_counter()
+                            response = send(client, method, path, data, data_format, headers)
+                            samples.append(time.perf_counter() - started)
+                        queries.append(len(captured))
+                        statuses.add(response.status_code)
+
+                    result = summary(samples)
+                    result['rps'] = len(samples) / sum(samples)
+                    result['queries'] = max(queries)
+                    result['status'] = sorted(statuses)
+                results[route] = result
+
+                write(f"{route:<48} {'/'.join(map(str, result['status'])):>6} {result['p50_ms']:>8.2f} "
+                      f"{result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} {result['rps']:>8.0f} "
+                      f"{result.get('queries', '-'):>7}")
+    finally:
+        for name, level in loggers.items():
+            logging.getLogger(name).setLevel(level)
+        shutil.rmtree(media_root, ignore_errors=True)
+
+    return results
+
+
+@benchmark('serializers')
+def serializer_benchmarks(options, write):
+    """
+    Микробенчмарки сериализаторов `main/serializers.py`: представление страницы из 100 объектов и проверка
+    входных данных.
+    """
+    seed_catalog(max(options['rows'], 100), news=100)
+    seed_users(100, "benchmark-password")
+    request = APIRequestFactory().get("/")
+    context = {'request': request}
+
+    products = list(Product.objects.select_related('product_type')[:100])
+    product_types = list(TypeProduct.objects.all()[:100])
+    news = list(MiniNews.objects.all()[:100])
+    users = list(User.objects.all()[:100])
+    product_type_id = product_types[0].pk
+    counter = itertools.count()
+
+    def validate(serializer_class, data, **kwargs):
+        return lambda: serializer_class(data=data() if callable(data) else data, **kwargs).is_valid()
+
+    cases = {
+        'ProductSerializer.to_representation': lambda: ProductSerializer(products, many=True, context=context).data,
+        'ProductSerializer(expand).to_representation': lambda: ProductSerializer(
+            products, many=True, expand=['product_type'], context=context).data,
+        'ProductTypeSerializer.to_representation': lambda: ProductTypeSerializer(product_types, many=True).data,
+        'MiniNewsSerializer.to_representation': lambda: MiniNewsSerializer(news, many=True).data,
+        'CreateUserSerializer.to_representation': lambda: CreateUserSerializer(users, many=True, context=context).data,
+        'ProductSerializer.is_valid': validate(ProductSerializer, lambda: {
+            "product_title": "Product", "product_tag": "tag", "product_desc": "Description",
+            "product_type_id": product_type_id, "product_image": png_upload()}),
+        'ProductTypeSerializer.is_valid': validate(ProductTypeSerializer, {"product_type_name": "Type"}),
+        'MiniNewsSerializer.is_valid': validate(MiniNewsSerializer, {"mn_title": "News", "mn_desc": "Description",
+                                                                     "mn_date": "2024-01-01"}),
+        'CreateUserSerializer.is_valid': validate(CreateUserSerializer, lambda: {
+            "username": f"new{next(counter)}", "email": f"new{next(counter)}@madadev.ru", "password": "password",
+            "image": png_upload()}),
+        'UpdateUserSerializer.is_valid': lambda: UpdateUserSerializer(instance=users[0], data={
+            "username": "renamed", "is_staff": False}, partial=True).is_valid(),
+        'PasswordRecoverySerializer.is_valid': validate(PasswordRecoverySerializer, {"username": users[0].username}),
+    }
+
+    results = {}
+    write(f"{'serializer':<46} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'queries':>7}")
+    for name, function in cases.items():
+        with CaptureQueriesContext(connection) as captured:
+            function()
+        result = summary(measure(function, options['repeat']))
+        result['queries'] = len(captured)
+        results[name] = result
+        write(f"{name:<46} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+              f"{result['queries']:>7}")
+
+    return results
+
+
+@benchmark('metrics')
+def metrics_overhead(options, write):
+    """
+    Накладные расходы `MetricsMiddleware`: задержка одних и тех же запросов с middleware и без него.
+    """
+    seed_catalog(options['rows'])
+    product_id = Product.objects.values_list('product_id', flat=True).first()
+    paths = ("/api/v1/products/?limit=20&fast=0", f"/api/v1/products/{product_id}/")
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+              'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+    write(f"{'path':<40} {'plain p50 ms':>13} {'metrics p50 ms':>15} {'overhead us':>12}")
+    with override_settings(CACHES=caches, CATALOG_CACHE='benchmark'):
+        for path in paths:
+            plain_client = Client()
+            with modify_settings(MIDDLEWARE={'remove': 'main.middleware.MetricsMiddleware'}):
+                plain = summary(measure(lambda: plain_client.get(path), options['repeat']))
+
+            metrics_client = Client()
+            with modify_settings(MIDDLEWARE={'append': 'main.middleware.MetricsMiddleware'}):
+                measured = summary(measure(lambda: metrics_client.get(path), options['repeat']))
+
+            write(f"{path:<40} {plain['p50_ms']:>13.3f} {measured['p50_ms']:>15.3f} "
+                  f"{(measured['p50_ms'] - plain['p50_ms']) * 1000:>12.1f}")
+
+
+@benchmark('bulk')
+def bulk(options, write):
+    """
+    Строк в секунду при создании `--rows` продуктов: `POST /api/v1/products/bulk/` массивом JSON и потоком
+    NDJSON при разных `BULK_BATCH_SIZE` против проверки и вставки по одной строке, как в `create`.
+    """
+    seed_catalog(0)
+    admin = User.objects.create_superuser(username="benchmark-admin", email="admin@madadev.ru",
+                                          password="benchmark-password")
+    headers = EndpointContext.bearer(admin)
+    product_type_id = TypeProduct.objects.values_list('product_type_id', flat=True).first()
+    rows = bulk_rows('products', options['rows'], product_type_id)
+    client = APIClient()
+
+    def per_row():
+        for row in rows:
+            serializer = ProductSerializer(data=row)
+            serializer.fields.pop('product_image')
+            serializer.is_valid(raise_exception=True)
+            Product.objects.create(**serializer.validated_data)
+
+    def send_bulk(data_format):
+        response = send(client, 'POST', "/api/v1/products/bulk/", rows, data_format, headers)
+        assert response.status_code == 201, response.content
+
+    cases = [('per-row', None, per_row)]
+    for batch_size in (100, 1000, 5000):
+        cases.append(('json', batch_size, lambda: send_bulk('json')))
+        cases.append(('ndjson', batch_size, lambda: send_bulk('ndjson')))
+
+    write(f"{'mode':>8} {'batch':>6} {'p50 ms':>10} {'rows/s':>10} {'queries':>8}")
+    for mode, batch_size, function in cases:
+        with override_settings(BULK_BATCH_SIZE=batch_size or 1):
+            # Тестовый клиент очищает журнал запросов в начале запроса, счёт должен начинаться с нуля
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                function()
+            result = summary(measure(function, options['repeat']))
+
+        write(f"{mode:>8} {batch_size or 1:>6} {result['p50_ms']:>10.2f} "
+              f"{options['rows'] / result['p50_ms'] * 1000:>10.0f} {len(captured):>8}")
+
+
+@benchmark('export')
+def user_export(options, write):
+    """
+    Выгрузка `--rows` пользователей через `/api/v1/users/export/` (для проверки памяти на большой таблице —
+    `--rows 1000000`): время, строк в секунду и пик памяти Python при чтении потока в NDJSON и CSV.
+    """
+    seed_users(options['rows'], "benchmark-password")
+    admin = User.objects.create_superuser(username="benchmark-admin", email="admin@madadev.ru",
+                                          password="benchmark-password")
+    client = APIClient()
+    client.force_authenticate(admin)
+
+    def read(export_format):
+        response = client.get("/api/v1/users/export/", {"format": export_format})
+        return sum(len(line) for line in response.streaming_content)
+
+    write(f"{'format':>7} {'seconds':>8} {'rows/s':>10} {'MB':>8} {'peak MB':>8}")
+    for export_format in ('ndjson', 'csv'):
+        started = time.perf_counter()
+        size = read(export_format)
+        elapsed = time.perf_counter() - started
+
+        # Пик памяти отдельным проходом: tracemalloc замедляет выгрузку в несколько раз
+        tracemalloc.start()
+        try:
+            read(export_format)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        write(f"{export_format:>7} {elapsed:>8.2f} {options['rows'] / elapsed:>10.0f} {size / 2 ** 20:>8.1f} "
+              f"{peak / 2 ** 20:>8.2f}")
+
+
+@benchmark('search')
+def full_text_search(options, write):
+    """
+    Задержка поиска `?q=` по засеянному каталогу: эндпоинт `/api/v1/products/` и сам запрос к индексу против
+    `icontains` по тем же полям без индекса. Кэш каталога отключён.
+    """
+    rows = options['rows']
+    seed_catalog(rows)
+    index = search.get_index(Product)
+    queries = ("tag7", f"product {rows // 2}", "description of product", "missing")
+    client = Client()
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+              'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+    write(f"{'query':<24} {'endpoint p50':>13} {'p95 ms':>8} {'index p50':>10} {'like p50':>9} {'found':>7}")
+    with override_settings(CACHES=caches, CATALOG_CACHE='benchmark'):
+        for query in queries:
+            words = search.terms(query)
+            endpoint = summary(measure(lambda: client.get("/api/v1/products/", {"q": query, "limit": 20}),
+                                       options['repeat']))
+            indexed = summary(measure(lambda: list(search.search(Product.objects.all(), query)[:20]),
+                                      options['repeat']))
+            like = summary(measure(lambda: list(search.LikeBackend().search(Product.objects.all(), index, words)[:20]),
+                                   options['repeat']))
+            found = search.search(Product.objects.all(), query).count()
+
+            write(f"{query:<24} {endpoint['p50_ms']:>13.2f} {endpoint['p95_ms']:>8.2f} {indexed['p50_ms']:>10.2f} "
+                  f"{like['p50_ms']:>9.2f} {found:>7}")
+
+
+@benchmark('facets')
+def product_facets(options, write):
+    """
+    Счётчики фильтров каталога: `/api/v1/products/facets/` со счётчиками из `product_count` против тех же
+    чисел через `GROUP BY` по продуктам, и задержка фильтра `?tags=`. Кэш каталога отключён.
+    """
+    rows = options['rows']
+    seed_catalog(rows)
+    facets.rebuild()
+    client = Client()
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+              'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+    def grouped():
+        return (list(ProductTag.objects.values('tag__tag_name').annotate(total=Count('pk')).order_by('-total')[:50]),
+                list(Product.objects.order_by().values('product_type_id').annotate(total=Count('pk'))))
+
+    with override_settings(CACHES=caches, CATALOG_CACHE='benchmark'):
+        write(f"{'request':<40} {'p50 ms':>8} {'p95 ms':>8}")
+        cases = {
+            "facets from counters": lambda: client.get("/api/v1/products/facets/"),
+            "facets with GROUP BY": grouped,
+            "?tags=tag7": lambda: client.get("/api/v1/products/", {"tags": "tag7", "limit": 20}),
+            "?tags=tag7&product_type": lambda: client.get("/api/v1/products/", {
+                "tags": "tag7", "product_type": Product.objects.values_list('product_type_id', flat=True)[7],
+                "limit": 20}),
+        }
+        for name, case in cases.items():
+            result = summary(measure(case, options['repeat']))
+            write(f"{name:<40} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f}")
+
+
+@benchmark('feed')
+def latest_news(options, write):
+    """
+    Лента `/api/v1/mini_news/latest/` по засеянным новостям: сборка ответа (кэш отключён) против ответа из
+    кэша между записями.
+    """
+    seed_catalog(0, types=0, news=options['rows'])
+    client = Client()
+    caches = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+              'benchmark': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+
+    write(f"{'request':<28} {'built p50 ms':>13} {'cached p50 ms':>14}")
+    for query in ("n=10", "n=100", "n=20&format=rss", "n=20&format=atom"):
+        url = f"/api/v1/mini_news/latest/?{query}"
+        with override_settings(CACHES=caches, CATALOG_CACHE='benchmark'):
+            built = summary(measure(lambda: client.get(url), options['repeat']))
+        cached = summary(measure(lambda: client.get(url), options['repeat']))
+        write(f"{query:<28} {built['p50_ms']:>13.2f} {cached['p50_ms']:>14.2f}")
+
+
+@benchmark('dbpool')
+def connection_pool(options, write):
+    """
+    Соединение на запрос, как с `CONN_MAX_AGE = 0`: открыть, `SELECT 1`, закрыть. Обычный бэкенд SQLite
+    против `main.dbpool.sqlite3` на файловой базе, последовательно и из 8 потоков. `connects` — сколько раз
+    за замер открывалось соединение драйвера.
+    """
+    directory = tempfile.mkdtemp()
+    repeat = options['repeat']
+    opened = []
+    driver_connect = sqlite_base.Database.connect
+
+    def counting_connect(*args, **kwargs):
+        opened.append(args)
+        return driver_connect(*args, **kwargs)
+
+    def request(backend, settings_dict):
+        wrapper = backend.DatabaseWrapper(settings_dict, 'benchmark_pool')
+        with wrapper.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        wrapper.close()
+
+    write(f"{'engine':<28} {'p50 ms':>8} {'p95 ms':>8} {'8 threads req/s':>16} {'connects':>9}")
+    try:
+        for engine in ('django.db.backends.sqlite3', 'main.dbpool.sqlite3'):
+            settings_dict = connections.configure_settings({
+                DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+                'benchmark_pool': {'ENGINE': engine, 'NAME': f"{directory}/pool.sqlite3",
+                                   'POOL': {'MAX_SIZE': 8}}})['benchmark_pool']
+            backend = load_backend(engine)
+            before = len(opened)
+
+            with mock.patch.object(sqlite_base.Database, 'connect', counting_connect):
+                sequential = summary(measure(lambda: request(backend, settings_dict), repeat))
+
+                started = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=8) as executor:
+                    list(executor.map(lambda _: request(backend, settings_dict), range(repeat * 8)))
+                throughput = repeat * 8 / (time.perf_counter() - started)
+
+            connects = len(opened) - before
+            write(f"{engine:<28} {sequential['p50_ms']:>8.3f} {sequential['p95_ms']:>8.3f} {throughput:>16.0f} "
+                  f"{connects:>9}")
+    finally:
+        dbpool.close_pools()
+        shutil.rmtree(directory)
+
+
+@benchmark('email')
+def email_rendering(options, write):
+    """
+    Писем в секунду: рендер шаблона целиком, как в `BaseEmailMessage`, против скомпилированного шаблона
+    по одному письму и пачкой через `rendering.render_many`.
+    """
+    count = options['repeat'] * 20
+    seed_users(min(count, 1000), "benchmark-password")
+    users = list(User.objects.all()[:count])
+    contexts = [{'user': users[number % len(users)], 'site_name': "MaDaDev"} for number in range(count)]
+
+    def template_render(email_class):
+        for context in contexts:
+            BaseEmailMessage.render(email_class(None, dict(context)))
+
+    def compiled_render(email_class):
+        for context in contexts:
+            email_class(None, dict(context)).render()
+
+    write(f"{'email':<22} {'template msg/s':>15} {'compiled msg/s':>15} {'batch msg/s':>12}")
+    for email_class in (ConfirmEmail, PasswordChangedEmail):
+        rates = []
+        for run in (lambda: template_render(email_class), lambda: compiled_render(email_class),
+                    lambda: rendering.render_many(email_class, [dict(context) for context in contexts])):
+            started = time.perf_counter()
+            run()
+            rates.append(count / (time.perf_counter() - started))
+        write(f"{email_class.__name__:<22} {rates[0]:>15.0f} {rates[1]:>15.0f} {rates[2]:>12.0f}")
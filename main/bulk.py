@@ -0,0 +1,251 @@
+import contextlib
+import itertools
+import json
+import logging
+from collections.abc import Iterator
+
+from django.conf import settings
+
+from drf_yasg.utils import swagger_auto_schema
+from django.db import DatabaseError, models, router, transaction
+
+from rest_framework import serializers, status
+from rest_framework.decorators import action
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import BaseParser, JSONParser
+from rest_framework.response import Response
+
+from main import caching, metrics, querybudget, schemas
+from main.schemas import BulkSchemas
+
+
+logger = logging.getLogger(__name__)
+
+bulk_rows = metrics.get_or_create(metrics.Counter, 'catalog_bulk_rows_total',
+                                  "Строки массовых операций каталога по результату")
+
+
+class NDJSONParser(BaseParser):
+    """
+    Тело `application/x-ndjson`: по объекту JSON на строку. Возвращает генератор, строки читаются из потока
+    запроса по мере обработки, а не целиком. Битая строка отдаётся как `ParseError` и попадает в отчёт об
+    ошибках, остальные строки обрабатываются.
+    """
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', settings.DEFAULT_CHARSET)
+
+        def rows():
+            for line in stream:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line.decode(encoding))
+                except ValueError as exc:
+                    yield ParseError(f"JSON parse error - {exc}")
+
+        return rows()
+
+
+def get_batch_size():
+    return getattr(settings, 'BULK_BATCH_SIZE', 1000)
+
+
+def batches(rows, size):
+    rows = iter(rows)
+    while batch := list(itertools.islice(rows, size)):
+        yield batch
+
+
+def parse_ids(value):
+    """
+    Список первичных ключей из `[1, 2]` или `"1,2"`. Возвращает None, если это не список целых чисел.
+    """
+    if isinstance(value, str):
+        value = [item.strip() for item in value.split(',') if item.strip()]
+    if not isinstance(value, list) or not value:
+        return None
+
+    try:
+        return sorted({int(item) for item in value if not isinstance(item, bool)})
+    except (TypeError, ValueError):
+        return None
+
+
+def delete_plan(model, queryset):
+    """
+    Запросы на удаление `queryset` и всех связанных строк по `on_delete=CASCADE`, сначала самые вложенные.
+    Возвращает None, если у какой-то связи другое поведение при удалении.
+    """
+    plan = []
+    for relation in model._meta.related_objects:
+        if not (relation.one_to_many or relation.one_to_one):
+            continue
+        if relation.on_delete is not models.CASCADE:
+            return None
+
+        related = relation.related_model._base_manager.using(queryset.db)
+        nested = delete_plan(relation.related_model,
+                             related.filter(**{f"{relation.field.name}__in": queryset.values('pk')}))
+        if nested is None:
+            return None
+        plan.extend(nested)
+
+    plan.append(queryset)
+    return plan
+
+
+def delete_rows(model, ids, using=None):
+    """
+    Удаляет строки `model` с первичными ключами `ids` одним `DELETE ... WHERE pk IN (...)` на таблицу, без
+    выборки объектов и сигналов `post_delete`. Связанные строки с `on_delete=CASCADE` удаляются так же, по
+    внешнему ключу через подзапрос. Если у модели есть связи с другим поведением при удалении, используется
+    обычный `QuerySet.delete()`.
+    """
+    using = using or router.db_for_write(model)
+    queryset = model._base_manager.db_manager(using).filter(pk__in=ids)
+
+    plan = delete_plan(model, queryset)
+    if plan is None:
+        return queryset.delete()[0]
+
+    return sum(item._raw_delete(using) for item in plan)
+
+
+class BulkMixin:
+    """
+    Массовые операции над ресурсом каталога по `{prefix}/bulk/`.
+
+    `POST` принимает массив JSON или поток NDJSON. Строки проверяются `serializer_class` без файловых полей
+    (у моделей для них есть значения по умолчанию) пакетами по `BULK_BATCH_SIZE`, данные для проверки пакета
+    сериализатор может загрузить одним запросом в `get_bulk_context(rows)`. Пакет читается из тела и
+    проверяется вне транзакции, корректные строки вставляются `bulk_create` в отдельной транзакции на пакет,
+    так что медленный клиент не держит блокировку записи. По некорректным строкам возвращается
+    `{"index": ..., "errors": ...}`. Если пакет не удалось записать, откатывается только он: его строки
+    попадают в ошибки, уже записанные пакеты остаются, следующие обрабатываются.
+
+    `DELETE` удаляет объекты из `{"ids": [...]}` или `?ids=1,2` одним запросом на таблицу, см. `delete_rows`.
+    Сигналы при этом не отправляются, поэтому кэш сбрасывается здесь же для `cache_resource` и ресурсов из
+    `bulk_delete_invalidates`, а остальное, что обычно делают сигналы, вид может сделать в
+    `perform_bulk_create` и `perform_bulk_delete`.
+    """
+    bulk_delete_invalidates = ()
+
+    def get_bulk_serializer(self, rows):
+        serializer_class = self.get_serializer_class()
+        context = self.get_serializer_context()
+
+        get_bulk_context = getattr(serializer_class, 'get_bulk_context', None)
+        if get_bulk_context is not None:
+            context.update(get_bulk_context(rows))
+
+        # Раскрываемые поля, доступные для записи (например, теги продукта), принимаются и в массовой загрузке
+        serializer = serializer_class(context=context,
+                                      expand=getattr(serializer_class.Meta, 'expandable_fields', ()))
+        for name, field in list(serializer.fields.items()):
+            if field.read_only or isinstance(field, serializers.FileField):
+                serializer.fields.pop(name)
+        return serializer
+
+    def validate_batch(self, batch, start):
+        """
+        Проверенные объекты пакета, их значения связей «ко многим» (`{поле: значение}` на объект) и ошибки.
+        """
+        serializer = self.get_bulk_serializer(batch)
+        model = self.get_queryset().model
+        many = [field.name for field in model._meta.many_to_many]
+        objects, relations, errors = [], [], []
+
+        for index, row in enumerate(batch, start):
+            if isinstance(row, ParseError):
+                errors.append({"index": index, "errors": {"status": row.detail}})
+                continue
+
+            try:
+                data = serializer.run_validation(row)
+            except serializers.ValidationError as exc:
+                errors.append({"index": index, "errors": exc.detail})
+                continue
+
+            relations.append({name: data.pop(name) for name in many if name in data})
+            objects.append(model(**data))
+
+        return objects, relations, errors
+
+    def perform_bulk_create(self, objects, relations):
+        self.get_queryset().model.objects.bulk_create(objects, batch_size=get_batch_size())
+
+    def perform_bulk_delete(self, model, ids):
+        return delete_rows(model, ids)
+
+    @swagger_auto_schema(request_body=BulkSchemas.bulk_create_request(),
+                         responses=BulkSchemas.bulk_create_response(),
+                         security=[schemas.bearer()])
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request, *args, **kwargs):
+        rows = request.data
+        if not isinstance(rows, (list, Iterator)):
+            return Response({"status": "Expected a JSON array or NDJSON rows"}, status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        using = router.db_for_write(model)
+        ids, errors, start = [], [], 0
+
+        for batch in batches(rows, get_batch_size()):
+            # Бюджет запросов действия задан на один пакет, следующие пакеты выполняют те же запросы
+            with querybudget.repeated() if start else contextlib.nullcontext():
+                objects, relations, batch_errors = self.validate_batch(batch, start)
+                if objects:
+                    try:
+                        with transaction.atomic(using=using):
+                            self.perform_bulk_create(objects, relations)
+                    except DatabaseError:
+                        logger.exception("Bulk batch of %s starting at %s was not saved", model.__name__, start)
+                        invalid = {error["index"] for error in batch_errors}
+                        batch_errors = sorted(batch_errors + [
+                            {"index": index, "errors": {"status": "Batch was not saved"}}
+                            for index in range(start, start + len(batch)) if index not in invalid
+                        ], key=lambda error: error["index"])
+                        objects = []
+
+            start += len(batch)
+            errors.extend(batch_errors)
+            ids.extend(item.pk for item in objects)
+
+        if ids:
+            caching.invalidate(self.cache_resource)
+        bulk_rows.inc(len(ids), resource=self.cache_resource, result='created')
+        bulk_rows.inc(len(errors), resource=self.cache_resource, result='invalid')
+
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_207_MULTI_STATUS if ids else status.HTTP_400_BAD_REQUEST
+
+        return Response({"created": len(ids), "ids": ids, "errors": errors}, status=response_status)
+
+    @swagger_auto_schema(request_body=BulkSchemas.bulk_delete_request(),
+                         responses=BulkSchemas.bulk_delete_response(),
+                         security=[schemas.bearer()])
+    @bulk.mapping.delete
+    def bulk_delete(self, request, *args, **kwargs):
+        value = request.query_params.get('ids')
+        if value is None and isinstance(request.data, dict):
+            value = request.data.get('ids')
+
+        ids = parse_ids(value)
+        if ids is None:
+            return Response({"status": "Expected a non-empty list of integer ids"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        model = self.get_queryset().model
+        with transaction.atomic(using=router.db_for_write(model)):
+            deleted = self.perform_bulk_delete(model, ids)
+
+        caching.invalidate_many(self.cache_resource, ids)
+        for resource in self.bulk_delete_invalidates:
+            caching.invalidate(resource)
+        bulk_rows.inc(deleted, resource=self.cache_resource, result='deleted')
+
+        return Response({"deleted": deleted}, status=status.HTTP_200_OK)
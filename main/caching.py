@@ -0,0 +1,213 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from rest_framework.exceptions import NotAcceptable
+from rest_framework.request import Request
+
+
+def get_cache():
+    return caches[getattr(settings, 'CATALOG_CACHE', 'default')]
+
+
+def version_key(resource, pk=None):
+    return f"catalog:version:{resource}" if pk is None else f"catalog:version:{resource}:{pk}"
+
+
+def get_versions(keys, cache=None):
+    """
+    Версии ресурсов в виде `time_ns()` последней записи. Если версия вытеснена из кэша, создаётся новая,
+    поэтому старые записи с прежней версией больше никогда не совпадут.
+    """
+    cache = cache or get_cache()
+    versions = cache.get_many(keys)
+
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    for key, value in missing.items():
+        if not cache.add(key, value, None):
+            missing[key] = cache.get(key, value)
+
+    versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+async def aget_versions(keys, cache=None):
+    cache = cache or get_cache()
+    versions = await cache.aget_many(keys)
+
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    for key, value in missing.items():
+        if not await cache.aadd(key, value, None):
+            missing[key] = await cache.aget(key, value)
+
+    versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def invalidate(resource, pk=None):
+    """
+    Сбрасывает списки ресурса и, если передан `pk`, закэшированный объект. Остальные ресурсы не трогаются.
+    """
+    now = time.time_ns()
+    keys = {version_key(resource): now}
+    if pk is not None:
+        keys[version_key(resource, pk)] = now
+
+    get_cache().set_many(keys, None)
+
+
+def invalidate_many(resource, pks):
+    """
+    Как `invalidate`, но для нескольких объектов ресурса одной записью в кэш.
+    """
+    now = time.time_ns()
+    keys = {version_key(resource): now}
+    keys.update((version_key(resource, pk), now) for pk in pks)
+
+    get_cache().set_many(keys, None)
+
+
+class CachedReadMixin:
+    """
+    Кэш ответов действий `cache_actions` (по умолчанию `list` и `retrieve`) для анонимных GET-запросов с `ETag`,
+    `Last-Modified` и ответом 304.
+
+    Ключ строится из пути, параметров запроса, формата ответа после согласования содержимого и версий
+    ресурсов, от которых зависит ответ: своего списка (или объекта для `retrieve`) и ресурсов из
+    `cache_expand_dependencies` для `?expand=`. Для действий из `cache_query_params` в ключ попадают только
+    перечисленные параметры, чтобы посторонние параметры не плодили записи.
+    """
+    cache_resource = None
+    cache_expand_dependencies = {}
+    cache_actions = ('list', 'retrieve')
+    # {действие: параметры запроса, от которых зависит ответ}, для остальных действий — все параметры
+    cache_query_params = {}
+    # {действие: время жизни записи}, по умолчанию `CATALOG_CACHE_TIMEOUT`
+    cache_timeouts = {}
+
+    def is_cacheable_action(self, request):
+        action = self.action_map.get(request.method.lower())
+        if request.method not in ('GET', 'HEAD') or action not in self.cache_actions:
+            return False
+        return 'HTTP_AUTHORIZATION' not in request.META
+
+    def is_cacheable_request(self, request):
+        if not self.is_cacheable_action(request):
+            return False
+
+        user = getattr(request, 'user', None)
+        return user is None or not user.is_authenticated
+
+    async def ais_cacheable_request(self, request):
+        if not self.is_cacheable_action(request):
+            return False
+
+        user = await request.auser() if hasattr(request, 'auser') else None
+        return user is None or not user.is_authenticated
+
+    def get_cache_dependencies(self, request, kwargs):
+        if self.action_map.get(request.method.lower()) == 'retrieve':
+            keys = [version_key(self.cache_resource, kwargs.get(self.lookup_url_kwarg or self.lookup_field))]
+        else:
+            keys = [version_key(self.cache_resource)]
+
+        expand = request.GET.get('expand', '')
+        for name in sorted(filter(None, (item.strip() for item in expand.split(',')))):
+            resource = self.cache_expand_dependencies.get(name)
+            if resource:
+                keys.append(version_key(resource))
+
+        return keys
+
+    def get_cache_timeout(self, request):
+        action = self.action_map.get(request.method.lower())
+        return self.cache_timeouts.get(action, getattr(settings, 'CATALOG_CACHE_TIMEOUT', 300))
+
+    def get_cache_format(self, request, kwargs):
+        """
+        Формат рендерера, который выберет DRF: `?format=` и разные `Accept` с одним итогом дают один ключ.
+        None, если подходящего рендерера нет — такой запрос не кэшируется.
+        """
+        try:
+            renderer, _ = self.get_content_negotiator().select_renderer(
+                Request(request), self.get_renderers(), kwargs.get(self.settings.FORMAT_SUFFIX_KWARG))
+        except NotAcceptable:
+            return None
+        return renderer.format
+
+    def get_cache_key(self, request, versions, renderer_format):
+        allowed = self.cache_query_params.get(self.action_map.get(request.method.lower()))
+        format_param = self.settings.URL_FORMAT_OVERRIDE
+        query = sorted((name, values) for name, values in request.GET.lists()
+                       if name != format_param and (allowed is None or name in allowed))
+        raw = f"{request.path}|{query}|{renderer_format}|{versions}"
+        return "catalog:response:" + hashlib.sha1(raw.encode()).hexdigest()
+
+    def build_entry(self, response, versions):
+        response.render()
+        return {
+            'content': response.content,
+            'content_type': response['Content-Type'],
+            'etag': quote_etag(hashlib.sha1(response.content).hexdigest()),
+            'last_modified': max(versions) // 1_000_000_000,
+        }
+
+    @staticmethod
+    def cached_response(request, entry, response=None):
+        if response is None:
+            response = HttpResponse(entry['content'], content_type=entry['content_type'])
+
+        response['ETag'] = entry['etag']
+        response['Last-Modified'] = http_date(entry['last_modified'])
+        patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+
+        return get_conditional_response(request, etag=entry['etag'], last_modified=entry['last_modified'],
+                                        response=response)
+
+    def dispatch(self, request, *args, **kwargs):
+        renderer_format = self.get_cache_format(request, kwargs) if self.is_cacheable_request(request) else None
+        if renderer_format is None:
+            return super().dispatch(request, *args, **kwargs)
+
+        versions = get_versions(self.get_cache_dependencies(request, kwargs))
+        key = self.get_cache_key(request, versions, renderer_format)
+        cache = get_cache()
+        entry = cache.get(key)
+
+        if entry is not None:
+            return self.cached_response(request, entry)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        entry = self.build_entry(response, versions)
+        cache.set(key, entry, self.get_cache_timeout(request))
+        return self.cached_response(request, entry, response)
+
+    async def adispatch(self, request, *args, **kwargs):
+        renderer_format = self.get_cache_format(request, kwargs) if await self.ais_cacheable_request(request) \
+            else None
+        if renderer_format is None:
+            return await super().adispatch(request, *args, **kwargs)
+
+        versions = await aget_versions(self.get_cache_dependencies(request, kwargs))
+        key = self.get_cache_key(request, versions, renderer_format)
+        cache = get_cache()
+        entry = await cache.aget(key)
+
+        if entry is not None:
+            return self.cached_response(request, entry)
+
+        response = await super().adispatch(request, *args, **kwargs)
+        if response.status_code != 200:
+            return response
+
+        entry = self.build_entry(response, versions)
+        await cache.aset(key, entry, self.get_cache_timeout(request))
+        return self.cached_response(request, entry, response)
@@ -0,0 +1,233 @@
+import collections
+import threading
+import time
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from main import metrics
+
+
+pool_in_use = metrics.get_or_create(metrics.Gauge, 'db_pool_connections_in_use',
+                                    "Соединения с базой, выданные потокам из пула")
+pool_idle = metrics.get_or_create(metrics.Gauge, 'db_pool_connections_idle',
+                                  "Свободные соединения с базой в пуле")
+pool_waiting = metrics.get_or_create(metrics.Gauge, 'db_pool_waiting',
+                                     "Потоки, ожидающие свободное соединение с базой")
+pool_created = metrics.get_or_create(metrics.Counter, 'db_pool_connections_created_total',
+                                     "Соединения с базой, открытые пулом")
+pool_closed = metrics.get_or_create(metrics.Counter, 'db_pool_connections_closed_total',
+                                    "Соединения с базой, закрытые пулом, по причине")
+pool_timeouts = metrics.get_or_create(metrics.Counter, 'db_pool_checkout_timeouts_total',
+                                      "Запросы соединения, не дождавшиеся свободного соединения")
+
+
+class PoolTimeout(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = {"status": "Database is busy, try again later"}
+    default_code = 'database_pool_timeout'
+
+
+def ping(connection):
+    try:
+        cursor = connection.cursor()
+        try:
+            cursor.execute("SELECT 1")
+        finally:
+            cursor.close()
+    except Exception:
+        return False
+    return True
+
+
+def close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+class ConnectionPool:
+    """
+    Пул соединений драйвера базы, общий для потоков процесса.
+
+    Открыто не больше `max_size` соединений. Поток, которому не хватило соединения, ждёт освобождения не
+    дольше `timeout` секунд и получает `PoolTimeout` (503). Свободное соединение перед выдачей проверяется
+    `SELECT 1` (`pre_ping`), сломанное закрывается и заменяется. Соединения, простаивающие дольше `max_idle`
+    секунд, закрываются, но не меньше `min_size` остаются открытыми.
+    """
+
+    def __init__(self, alias, min_size=1, max_size=10, max_idle=300, timeout=10, pre_ping=True):
+        self.alias = alias
+        self.min_size = min_size
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self.pre_ping = pre_ping
+        # (соединение, время освобождения), последнее освобождённое справа
+        self.idle = collections.deque()
+        self.size = 0
+        self.condition = threading.Condition()
+
+    def take_stale(self):
+        stale = []
+        border = time.monotonic() - self.max_idle
+        while self.idle and self.idle[0][1] < border and self.size > self.min_size:
+            stale.append(self.idle.popleft()[0])
+            self.size -= 1
+        return stale
+
+    def checkout(self, deadline):
+        """
+        Свободное соединение или None, если можно открыть новое (место под него уже занято).
+        """
+        with self.condition:
+            stale = self.take_stale()
+
+            while not self.idle and self.size >= self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    pool_timeouts.inc(database=self.alias)
+                    self.close(stale, 'idle')
+                    raise PoolTimeout()
+
+                pool_waiting.inc(database=self.alias)
+                try:
+                    self.condition.wait(remaining)
+                finally:
+                    pool_waiting.dec(database=self.alias)
+
+            if self.idle:
+                connection = self.idle.pop()[0]
+            else:
+                connection = None
+                self.size += 1
+            pool_idle.set(len(self.idle), database=self.alias)
+
+        self.close(stale, 'idle')
+        return connection
+
+    def acquire(self, connect):
+        """
+        Соединение из пула или новое из `connect()`.
+        """
+        deadline = time.monotonic() + self.timeout
+
+        while True:
+            connection = self.checkout(deadline)
+
+            if connection is None:
+                try:
+                    connection = connect()
+                except Exception:
+                    self.forget()
+                    raise
+                pool_created.inc(database=self.alias)
+
+            elif self.pre_ping and not ping(connection):
+                self.forget()
+                self.close([connection], 'broken')
+                continue
+
+            pool_in_use.inc(database=self.alias)
+            return connection
+
+    def release(self, connection, reusable=True):
+        """
+        Возвращает выданное соединение. Соединение в неизвестном состоянии (`reusable=False`) закрывается.
+        """
+        pool_in_use.dec(database=self.alias)
+
+        if not reusable:
+            self.forget()
+            self.close([connection], 'broken')
+            return
+
+        with self.condition:
+            self.idle.append((connection, time.monotonic()))
+            pool_idle.set(len(self.idle), database=self.alias)
+            self.condition.notify()
+
+    def forget(self):
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self, connections, reason):
+        for connection in connections:
+            close_quietly(connection)
+            pool_closed.inc(database=self.alias, reason=reason)
+
+    def close_idle(self):
+        with self.condition:
+            connections = [connection for connection, _ in self.idle]
+            self.idle.clear()
+            self.size -= len(connections)
+            pool_idle.set(0, database=self.alias)
+            self.condition.notify_all()
+
+        self.close(connections, 'shutdown')
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(wrapper):
+    """
+    Пул процесса для базы обёртки: ключ — псевдоним и адрес базы, поэтому тестовая база получает свой пул.
+    Параметры берутся из `DATABASES[alias]['POOL']`.
+    """
+    settings_dict = wrapper.settings_dict
+    key = (wrapper.alias, settings_dict['NAME'], settings_dict.get('HOST'), settings_dict.get('PORT'),
+           settings_dict.get('USER'))
+
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            options = settings_dict.get('POOL', {})
+            pool = _pools[key] = ConnectionPool(wrapper.alias,
+                                                min_size=options.get('MIN_SIZE', 1),
+                                                max_size=options.get('MAX_SIZE', 10),
+                                                max_idle=options.get('MAX_IDLE', 300),
+                                                timeout=options.get('TIMEOUT', 10),
+                                                pre_ping=options.get('PRE_PING', True))
+        return pool
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+
+    for pool in pools:
+        pool.close_idle()
+
+
+def pooled(wrapper_class):
+    """
+    Обёртка базы Django, которая берёт соединения драйвера из `ConnectionPool` и возвращает их туда при
+    `close()`. С `CONN_MAX_AGE = 0` соединение выдаётся на время запроса: закрытие в конце запроса
+    возвращает его в пул без разрыва.
+    """
+
+    class PooledDatabaseWrapper(wrapper_class):
+
+        def get_new_connection(self, conn_params):
+            return get_pool(self).acquire(lambda: super(PooledDatabaseWrapper, self).get_new_connection(conn_params))
+
+        def _close(self):
+            if self.connection is None:
+                return
+
+            # Соединение с открытой транзакцией или после ошибки драйвера в пул не возвращается
+            reusable = not self.in_atomic_block and (not self.errors_occurred or self.is_usable())
+            if reusable and not self.get_autocommit():
+                try:
+                    self.connection.rollback()
+                except Exception:
+                    reusable = False
+
+            get_pool(self).release(self.connection, reusable)
+
+    return PooledDatabaseWrapper
@@ -0,0 +1,16 @@
+from django.db.backends.postgresql import base
+
+from main.dbpool import pooled
+
+
+class DatabaseWrapper(pooled(base.DatabaseWrapper)):
+    """
+    PostgreSQL через пул `main.dbpool`: `ENGINE = 'main.dbpool.postgresql'`, без `OPTIONS['pool']` встроенного
+    пула Django.
+    """
+
+    def get_new_connection(self, conn_params):
+        # Обычно уровень изоляции запоминает `get_new_connection` драйвера, для соединения из пула он не вызывается
+        value = self.settings_dict['OPTIONS'].get('isolation_level')
+        self.isolation_level = base.IsolationLevel.READ_COMMITTED if value is None else base.IsolationLevel(value)
+        return super().get_new_connection(conn_params)
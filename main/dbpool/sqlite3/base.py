@@ -0,0 +1,10 @@
+from django.db.backends.sqlite3 import base
+
+from main.dbpool import pooled
+
+
+class DatabaseWrapper(pooled(base.DatabaseWrapper)):
+    """
+    SQLite через пул `main.dbpool`: `ENGINE = 'main.dbpool.sqlite3'`. База в памяти соединения не закрывает,
+    поэтому пул ей не нужен.
+    """
@@ -0,0 +1,152 @@
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from main.models import Product, ProductTag, Tag, TypeProduct
+
+
+MAX_TAG_LENGTH = 64
+
+
+def normalize_tag(name):
+    """
+    Тег в нижнем регистре с одиночными пробелами: `" Кухня  и БЫТ "` -> `"кухня и быт"`.
+    """
+    return " ".join(str(name).lower().split())[:MAX_TAG_LENGTH]
+
+
+def normalize_tags(names):
+    normalized = []
+    for name in names:
+        tag = normalize_tag(name)
+        if tag and tag not in normalized:
+            normalized.append(tag)
+    return normalized
+
+
+def add_counts(model, deltas):
+    """
+    Прибавляет `deltas = {pk: n}` к `product_count` одним `UPDATE ... CASE`.
+    """
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+
+    pk = model._meta.pk.name
+    change = Case(*[When(**{pk: key}, then=Value(delta)) for key, delta in deltas.items()],
+                  default=Value(0), output_field=IntegerField())
+    model.objects.filter(**{f"{pk}__in": list(deltas)}).update(product_count=F('product_count') + change)
+
+
+def get_tag_ids(names):
+    """
+    ID тегов по нормализованным именам, недостающие теги создаются.
+    """
+    if not names:
+        return {}
+
+    ids = dict(Tag.objects.filter(tag_name__in=names).values_list('tag_name', 'tag_id'))
+    missing = [name for name in names if name not in ids]
+    if missing:
+        Tag.objects.bulk_create([Tag(tag_name=name) for name in missing], ignore_conflicts=True)
+        ids.update(Tag.objects.filter(tag_name__in=missing).values_list('tag_name', 'tag_id'))
+    return ids
+
+
+def add_products(products, tag_lists):
+    """
+    Учитывает созданные без сигналов продукты (`bulk_create`): связывает их с тегами `tag_lists` (список имён
+    на продукт) и увеличивает счётчики тегов и категорий.
+    """
+    ids = get_tag_ids(normalize_tags(name for names in tag_lists for name in names))
+
+    links = []
+    tag_deltas = {}
+    type_deltas = {}
+    for product, names in zip(products, tag_lists):
+        type_deltas[product.product_type_id] = type_deltas.get(product.product_type_id, 0) + 1
+        for name in normalize_tags(names):
+            links.append(ProductTag(product_id=product.pk, tag_id=ids[name]))
+            tag_deltas[ids[name]] = tag_deltas.get(ids[name], 0) + 1
+
+    ProductTag.objects.bulk_create(links)
+    add_counts(Tag, tag_deltas)
+    add_counts(TypeProduct, type_deltas)
+
+
+def forget_products(queryset):
+    """
+    Уменьшает счётчики перед удалением продуктов `queryset` без сигналов: по одному запросу с `GROUP BY` на
+    теги и категории удаляемых строк.
+    """
+    tag_deltas = ProductTag.objects.filter(product__in=queryset.values('pk')).values('tag_id') \
+        .annotate(removed=Count('pk')).values_list('tag_id', 'removed')
+    type_deltas = queryset.order_by().values('product_type_id').annotate(removed=Count('pk')) \
+        .values_list('product_type_id', 'removed')
+
+    add_counts(Tag, {pk: -removed for pk, removed in tag_deltas})
+    add_counts(TypeProduct, {pk: -removed for pk, removed in type_deltas})
+
+
+def move_product(old_type_id, new_type_id):
+    """
+    Переносит продукт в счётчиках категорий: `old_type_id=None` для нового продукта.
+    """
+    deltas = {}
+    if old_type_id is not None:
+        deltas[old_type_id] = -1
+    if new_type_id is not None:
+        deltas[new_type_id] = deltas.get(new_type_id, 0) + 1
+    add_counts(TypeProduct, deltas)
+
+
+def retag_product(product, old_name, new_name):
+    """
+    Переносит сохранённый продукт с тега `old_name` на `new_name` (значения `product_tag`) и обновляет
+    счётчики этих тегов. Остальные теги продукта не меняются, `old_name=None` для нового продукта.
+    """
+    old_tag = normalize_tag(old_name) if old_name is not None else ""
+    new_tag = normalize_tag(new_name) if new_name is not None else ""
+    if old_tag == new_tag:
+        return
+
+    deltas = {}
+    if old_tag:
+        old_id = Tag.objects.filter(tag_name=old_tag).values_list('tag_id', flat=True).first()
+        if old_id is not None and ProductTag.objects.filter(product=product, tag_id=old_id).delete()[0]:
+            deltas[old_id] = -1
+    if new_tag:
+        new_id = get_tag_ids([new_tag])[new_tag]
+        if ProductTag.objects.get_or_create(product=product, tag_id=new_id)[1]:
+            deltas[new_id] = deltas.get(new_id, 0) + 1
+    add_counts(Tag, deltas)
+
+
+def rebuild():
+    """
+    Пересчитывает все счётчики с нуля и создаёт теги из `product_tag` у продуктов без тегов. Для обслуживания
+    (например, после загрузки данных в обход приложения), не для обработки запросов.
+    """
+    untagged = Product.objects.filter(tags__isnull=True).values_list('pk', 'product_tag')
+    ids = get_tag_ids(normalize_tags(tag for _, tag in untagged))
+    ProductTag.objects.bulk_create([ProductTag(product_id=pk, tag_id=ids[normalize_tag(tag)])
+                                    for pk, tag in untagged if normalize_tag(tag)], ignore_conflicts=True)
+
+    Tag.objects.update(product_count=0)
+    TypeProduct.objects.update(product_count=0)
+    add_counts(Tag, dict(ProductTag.objects.values('tag_id').annotate(total=Count('pk'))
+                         .values_list('tag_id', 'total')))
+    add_counts(TypeProduct, dict(Product.objects.order_by().values('product_type_id').annotate(total=Count('pk'))
+                                 .values_list('product_type_id', 'total')))
+
+
+def get_facets(tags_limit):
+    """
+    Счётчики для фильтров каталога: самые частые теги и все категории. Читаются готовыми из `product_count`.
+    """
+    return {
+        'tags': [{'tag_name': name, 'count': count} for name, count in
+                 Tag.objects.filter(product_count__gt=0).order_by('-product_count', 'tag_name')
+                 .values_list('tag_name', 'product_count')[:tags_limit]],
+        'product_types': [{'product_type_id': pk, 'product_type_name': name, 'count': count} for pk, name, count in
+                          TypeProduct.objects.order_by('product_type_id')
+                          .values_list('product_type_id', 'product_type_name', 'product_count')],
+    }
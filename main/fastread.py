@@ -0,0 +1,85 @@
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+
+class CompiledSerializer:
+    """
+    Представление строк `QuerySet.values()` в тот же JSON, что выдаёт сериализатор, без создания моделей.
+
+    Поля сериализатора один раз превращаются в список колонок и конвертеров, дальше каждая строка — это
+    один проход по списку. Файловые поля отдаются абсолютным URL, как в `FileField.to_representation`.
+    """
+
+    def __init__(self, serializer, prefix=""):
+        self.columns = []
+        self.plan = []
+        model = serializer.Meta.model
+
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+
+            if isinstance(field, serializers.BaseSerializer):
+                nested = CompiledSerializer(field, prefix + field.source + "__")
+                self.columns.extend(nested.columns)
+                self.plan.append((name, None, nested))
+                continue
+
+            column = prefix + field.source.replace('.', '__')
+            self.columns.append(column)
+
+            if isinstance(field, serializers.FileField):
+                storage = model._meta.get_field(field.source).storage
+                use_url = getattr(field, 'use_url', api_settings.UPLOADED_FILES_USE_URL)
+                self.plan.append((name, column, FileURL(storage, use_url)))
+            else:
+                self.plan.append((name, column, field.to_representation))
+
+    def to_representation(self, row, request=None):
+        data = {}
+        for name, column, convert in self.plan:
+            if column is None:
+                data[name] = convert.to_representation(row, request)
+                continue
+
+            value = row[column]
+            if value is None:
+                data[name] = None
+            elif isinstance(convert, FileURL):
+                data[name] = convert(value, request)
+            else:
+                data[name] = convert(value)
+        return data
+
+    def many(self, rows, request=None):
+        return [self.to_representation(row, request) for row in rows]
+
+
+class FileURL:
+    def __init__(self, storage, use_url):
+        self.storage = storage
+        self.use_url = use_url
+
+    def __call__(self, name, request):
+        if not name:
+            return None
+        if not self.use_url:
+            return name
+
+        url = self.storage.url(name)
+        if request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+
+_compiled = {}
+
+
+def compile_serializer(serializer):
+    key = (type(serializer), tuple(serializer.fields))
+    compiled = _compiled.get(key)
+
+    if compiled is None:
+        compiled = _compiled[key] = CompiledSerializer(serializer)
+
+    return compiled
@@ -0,0 +1,41 @@
+from django.utils.feedgenerator import Atom1Feed, Rss201rev2Feed
+
+from rest_framework import renderers
+
+
+class FeedRenderer(renderers.BaseRenderer):
+    """
+    Лента RSS или Atom из списка, который вернуло действие. Заголовок ленты даёт `view.get_feed(request)`,
+    поля записи — `view.get_feed_item(item, request)`, оба в аргументах `django.utils.feedgenerator`.
+    Ошибки действия отдаются в JSON.
+    """
+    feed_class = None
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        renderer_context = renderer_context or {}
+        response = renderer_context.get('response')
+
+        if response is not None and response.status_code >= 400:
+            response['Content-Type'] = renderers.JSONRenderer.media_type
+            return renderers.JSONRenderer().render(data)
+
+        view = renderer_context['view']
+        request = renderer_context['request']
+
+        feed = self.feed_class(**view.get_feed(request))
+        for item in data:
+            feed.add_item(**view.get_feed_item(item, request))
+        return feed.writeString(self.charset).encode(self.charset)
+
+
+class RSSRenderer(FeedRenderer):
+    media_type = 'application/rss+xml'
+    format = 'rss'
+    feed_class = Rss201rev2Feed
+
+
+class AtomRenderer(FeedRenderer):
+    media_type = 'application/atom+xml'
+    format = 'atom'
+    feed_class = Atom1Feed
@@ -0,0 +1,94 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db.models import Count
+from django.utils.dateparse import parse_date
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.filters import BaseFilterBackend
+
+from main import facets, search
+from main.models import ProductTag
+
+
+class FieldFilter(BaseFilterBackend):
+    """
+    Точные фильтры по параметрам запроса из `view.filter_fields = {параметр: поле}`, например
+    `?product_type=3`. Значения проверяются полем модели.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        for param, field in getattr(view, 'filter_fields', {}).items():
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+
+            try:
+                value = queryset.model._meta.get_field(field).to_python(value)
+            except DjangoValidationError:
+                raise ValidationError({"status": f"Invalid value for {param}"})
+            queryset = queryset.filter(**{field: value})
+
+        return queryset
+
+
+class DateRangeFilter(BaseFilterBackend):
+    """
+    Диапазон дат `?date_after=2024-01-01&date_before=2024-01-31` (обе границы включительно) по полю
+    `view.date_range_field`.
+    """
+    after_param = 'date_after'
+    before_param = 'date_before'
+
+    def filter_queryset(self, request, queryset, view):
+        field = getattr(view, 'date_range_field', None)
+        if field is None:
+            return queryset
+
+        for param, lookup in ((self.after_param, 'gte'), (self.before_param, 'lte')):
+            value = request.query_params.get(param)
+            if value is None:
+                continue
+
+            try:
+                day = parse_date(value)
+            except ValueError:
+                day = None
+            if day is None:
+                raise ValidationError({"status": f"Invalid date for {param}, expected YYYY-MM-DD"})
+            queryset = queryset.filter(**{f"{field}__{lookup}": day})
+
+        return queryset
+
+
+class FullTextSearchFilter(BaseFilterBackend):
+    """
+    Полнотекстовый поиск `?q=` по индексу модели из `main.search`. Результаты сортируются по релевантности,
+    поэтому `CatalogPagination` отдаёт их через offset.
+    """
+    search_param = 'q'
+
+    def filter_queryset(self, request, queryset, view):
+        text = request.query_params.get(self.search_param)
+        if text is None:
+            return queryset
+        return search.search(queryset, text)
+
+
+class TagFilter(BaseFilterBackend):
+    """
+    Продукты со всеми тегами из `?tags=a,b`. Один подзапрос по индексу `(tag, product)` таблицы `product_tag`:
+    связи с нужными тегами группируются по продукту, остаются продукты, у которых найдены все теги.
+    """
+    tags_param = 'tags'
+
+    def filter_queryset(self, request, queryset, view):
+        value = request.query_params.get(self.tags_param)
+        if value is None:
+            return queryset
+
+        names = facets.normalize_tags(value.split(','))
+        if not names:
+            return queryset
+
+        tagged = ProductTag.objects.filter(tag__tag_name__in=names).values('product_id') \
+            .annotate(found=Count('tag_id')).filter(found=len(names)).values('product_id')
+        return queryset.filter(pk__in=tagged)
@@ -0,0 +1,183 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent import futures
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import hashers
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from main import metrics
+
+
+hash_latency = metrics.get_or_create(metrics.Histogram, 'password_hash_seconds',
+                                     "Время хеширования пароля, включая ожидание в очереди пула")
+hash_queue_depth = metrics.get_or_create(metrics.Gauge, 'password_hash_queue_depth',
+                                         "Количество операций хеширования в пуле и в очереди")
+hash_rejected = metrics.get_or_create(metrics.Counter, 'password_hash_rejected_total',
+                                      "Операции хеширования, отклонённые из-за переполненной очереди")
+
+
+class HashingQueueFull(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = {"status": "Too many authentication requests, try again later"}
+    default_code = 'hashing_queue_full'
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+
+    import django
+    django.setup()
+
+
+def _check_password(password, encoded):
+    return hashers.check_password(password, encoded)
+
+
+def _make_password(password):
+    return hashers.make_password(password)
+
+
+class HashingPool:
+    """
+    Пул процессов для медленного хеширования паролей с ограниченной очередью.
+
+    Одновременно в пуле и очереди может быть не больше `workers + queue_size` операций, остальные сразу
+    получают `HashingQueueFull` (503), а не занимают воркер веб-сервера. Операция, не дождавшаяся результата
+    за `PASSWORD_HASHING_TIMEOUT` секунд, тоже получает `HashingQueueFull`. При `workers=0` хеширование
+    выполняется в текущем потоке.
+    """
+
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.slots = threading.BoundedSemaphore(workers + queue_size) if workers else None
+        self.lock = threading.Lock()
+        self.executor = None
+
+    def get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_worker,
+                                                    initargs=(os.environ.get('DJANGO_SETTINGS_MODULE', ''),))
+            return self.executor
+
+    def submit(self, function, *args):
+        if not self.slots.acquire(blocking=False):
+            hash_rejected.inc()
+            raise HashingQueueFull()
+
+        hash_queue_depth.inc()
+        started = time.perf_counter()
+
+        def release(_):
+            self.slots.release()
+            hash_queue_depth.dec()
+            hash_latency.observe(time.perf_counter() - started, operation=function.__name__.strip('_'))
+
+        try:
+            future = self.get_executor().submit(function, *args)
+        except Exception:
+            release(None)
+            raise
+
+        future.add_done_callback(release)
+        return future
+
+    def run(self, function, *args):
+        if not self.workers:
+            started = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                hash_latency.observe(time.perf_counter() - started, operation=function.__name__.strip('_'))
+
+        future = self.submit(function, *args)
+        try:
+            return future.result(timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 30))
+        except futures.TimeoutError:
+            raise HashingQueueFull()
+
+    async def arun(self, function, *args):
+        if not self.workers:
+            return await asyncio.to_thread(self.run, function, *args)
+
+        future = self.submit(function, *args)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future),
+                                          timeout=getattr(settings, 'PASSWORD_HASHING_TIMEOUT', 30))
+        except asyncio.TimeoutError:
+            raise HashingQueueFull()
+
+    def shutdown(self):
+        with self.lock:
+            if self.executor is not None:
+                self.executor.shutdown(wait=True)
+                self.executor = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', os.cpu_count() or 1)
+                queue_size = getattr(settings, 'PASSWORD_HASHING_QUEUE', workers * 4)
+                _pool = HashingPool(workers, queue_size)
+    return _pool
+
+
+def configure(workers, queue_size):
+    """
+    Пересоздаёт пул с другими размерами (для бенчмарков и тестов).
+    """
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+        _pool = HashingPool(workers, queue_size)
+    return _pool
+
+
+def check_password(password, encoded):
+    if password is None or not encoded:
+        return False
+    return get_pool().run(_check_password, password, encoded)
+
+
+def make_password(password):
+    return get_pool().run(_make_password, password)
+
+
+async def acheck_password(password, encoded):
+    if password is None or not encoded:
+        return False
+    return await get_pool().arun(_check_password, password, encoded)
+
+
+async def amake_password(password):
+    return await get_pool().arun(_make_password, password)
+
+
+def set_password(user, password):
+    """
+    Аналог `user.set_password()`, но хеш считается в пуле процессов.
+    """
+    user.password = make_password(password)
+    user._password = password
+
+
+async def aset_password(user, password):
+    user.password = await amake_password(password)
+    user._password = password
@@ -0,0 +1,210 @@
+import hashlib
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, models
+from django.utils import timezone
+
+from main.models import User
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """
+    Фильтр Блума: `False` из `__contains__` означает, что значение точно не добавлялось.
+    """
+
+    def __init__(self, size_bits, hashes):
+        self.size_bits = size_bits
+        self.hashes = hashes
+        self.bits = bytearray((size_bits + 7) // 8)
+
+    def _positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(first + i * second) % self.size_bits for i in range(self.hashes)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, value):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class RegisteredIPFilter:
+    """
+    Отрицательный кэш IP-адресов регистрации (`User.ip` и `User.last_ip`) в памяти процесса.
+
+    Пользователи, сохранённые в этом процессе, добавляются сразу через `post_save`. Новые и изменённые
+    пользователи из других процессов подтягиваются по `User.updated_at` не чаще раза в
+    `REGISTRATION_IP_FILTER_REFRESH` секунд, с перекрытием `REGISTRATION_IP_FILTER_OVERLAP` секунд на
+    транзакции, закоммиченные позже своей метки времени. Раз в `REGISTRATION_IP_FILTER_TTL` секунд фильтр
+    строится заново в фоновом потоке (`REGISTRATION_IP_FILTER_BACKGROUND`) и подменяется целиком. Запросы
+    к базе и догрузки, и перестроения выполняются вне блокировки. Пока первого фильтра нет, `might_contain` отвечает `True` — проверка уходит в базу.
+    Изменения `ip`/`last_ip` через `QuerySet.update()` не меняют `updated_at` и видны только после
+    перестроения.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.filter = None
+        self.loaded_until = None
+        self.built_at = 0.0
+        self.refreshed_at = 0.0
+        # Адреса, добавленные во время перестроения: попадут и в новый фильтр
+        self.pending = None
+        self.refreshing = False
+
+    @staticmethod
+    def _setting(name, default):
+        return getattr(settings, name, default)
+
+    @staticmethod
+    def _rows(queryset):
+        return queryset.values_list('ip', 'last_ip', 'updated_at').order_by().iterator(chunk_size=5000)
+
+    @staticmethod
+    def _load(bloom, rows):
+        loaded_until = None
+        for ip, last_ip, updated_at in rows:
+            bloom.add(ip)
+            bloom.add(last_ip)
+            loaded_until = updated_at if loaded_until is None else max(loaded_until, updated_at)
+        return loaded_until
+
+    def _build(self):
+        bloom = BloomFilter(self._setting('REGISTRATION_IP_FILTER_SIZE', 1 << 23),
+                            self._setting('REGISTRATION_IP_FILTER_HASHES', 7))
+        started = timezone.now()
+        self._load(bloom, self._rows(User.objects.all()))
+
+        with self.lock:
+            for ip in self.pending or ():
+                bloom.add(ip)
+            self.pending = None
+            self.filter = bloom
+            self.loaded_until = started
+            self.built_at = self.refreshed_at = time.monotonic()
+
+    def _build_in_background(self):
+        try:
+            self._build()
+        except Exception:  # noqa
+            logger.exception("Registration IP filter rebuild failed")
+            with self.lock:
+                self.pending = None
+        finally:
+            connections.close_all()
+
+    def _start_build(self):
+        """
+        Запускает перестроение, если оно ещё не идёт. Возвращает True, если перестроение уже выполнено
+        в текущем потоке.
+        """
+        with self.lock:
+            if self.pending is not None:
+                return False
+            self.pending = []
+
+        if not self._setting('REGISTRATION_IP_FILTER_BACKGROUND', True):
+            self._build()
+            return True
+
+        threading.Thread(target=self._build_in_background, name='registration-ip-filter', daemon=True).start()
+        return False
+
+    def _refresh(self):
+        """
+        Догружает изменённых пользователей, когда фильтр уже есть. Запрос выполняется вне `self.lock`, строки
+        добавляются в фильтр под ней. Догружает один поток, остальные тем временем проверяют по текущему фильтру.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.filter is None or self.refreshing or \
+                    now - self.refreshed_at <= self._setting('REGISTRATION_IP_FILTER_REFRESH', 1):
+                return
+            self.refreshing = True
+            since = self.loaded_until - timedelta(seconds=self._setting('REGISTRATION_IP_FILTER_OVERLAP', 60))
+
+        try:
+            rows = list(self._rows(User.objects.filter(updated_at__gte=since)))
+        finally:
+            with self.lock:
+                self.refreshing = False
+
+        with self.lock:
+            if self.filter is None:
+                return
+            loaded_until = self._load(self.filter, rows)
+            if loaded_until is not None:
+                self.loaded_until = max(self.loaded_until, loaded_until)
+            self.refreshed_at = max(self.refreshed_at, now)
+
+    def might_contain(self, ip):
+        if not ip:
+            return False
+
+        with self.lock:
+            expired = self.filter is None or \
+                time.monotonic() - self.built_at > self._setting('REGISTRATION_IP_FILTER_TTL', 3600)
+        if expired and not self._start_build():
+            with self.lock:
+                if self.filter is None:
+                    return True
+
+        self._refresh()
+        with self.lock:
+            return self.filter is None or ip in self.filter
+
+    def add(self, *ips):
+        with self.lock:
+            for ip in ips:
+                if not ip:
+                    continue
+                if self.pending is not None:
+                    self.pending.append(ip)
+                if self.filter is not None:
+                    self.filter.add(ip)
+
+    def reset(self):
+        with self.lock:
+            self.filter = None
+            self.pending = None
+            self.refreshing = False
+
+
+registered_ips = RegisteredIPFilter()
+
+
+def find_registration_conflicts(username, email, ip):
+    """
+    Одним запросом находит все конфликты регистрации: занятый `username`, `email` и IP-адрес.
+    Условие по IP добавляется, только если фильтр Блума не исключил этот адрес.
+    """
+    condition = models.Q(username=username) | models.Q(email=email)
+    check_ip = registered_ips.might_contain(ip)
+
+    if check_ip:
+        condition |= models.Q(ip=ip) | models.Q(last_ip=ip)
+
+    conflicts = []
+    for user in User.objects.filter(condition).values('username', 'email', 'ip', 'last_ip'):
+        if user['username'] == username:
+            conflicts.append({"key": "username", "param": user['username'], "status": "username is taken"})
+        if user['email'] == email:
+            conflicts.append({"key": "email", "param": user['username'], "status": "email is taken"})
+        if check_ip and (user['ip'] == ip or user['last_ip'] == ip):
+            conflicts.append({"key": "ip", "param": ip, "status": "registration with an ip that already exists"})
+
+    order = {"username": 0, "email": 1, "ip": 2}
+    unique = {(conflict["key"], conflict["param"]): conflict for conflict in conflicts}
+
+    return sorted(unique.values(), key=lambda conflict: order[conflict["key"]])
@@ -0,0 +1,61 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test.utils import setup_databases, teardown_databases, setup_test_environment, \
+    teardown_test_environment
+
+from main import benchmarks
+
+
+class Command(BaseCommand):
+    help = ("Запускает бенчмарк на временной тестовой базе данных, заполненной синтетическими данными. "
+            "Запросы к видам по умолчанию выполняются тестовым клиентом в этом же процессе, без сети и "
+            "веб-сервера; бенчмарк endpoints умеет слать их по HTTP (--http, --url, --concurrency)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('name', choices=sorted(benchmarks.registry), help="Название бенчмарка")
+        parser.add_argument('--rows', type=int, default=50000, help="Количество строк для заполнения")
+        parser.add_argument('--repeat', type=int, default=50, help="Количество повторов каждого замера")
+        parser.add_argument('--keepdb', action='store_true', help="Не удалять тестовую базу после запуска")
+        parser.add_argument('--baseline', help="JSON с базовым прогоном: при регрессии команда завершится ошибкой")
+        parser.add_argument('--save-baseline', help="Сохранить результаты прогона в JSON как базовые")
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help="Допустимое ухудшение p95 относительно базового прогона (доля)")
+        parser.add_argument('--http', action='store_true',
+                            help="Поднять проект на локальном HTTP-сервере и слать запросы по сети")
+        parser.add_argument('--url', help="Слать запросы по сети на уже запущенный сервер с той же базой данных")
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help="Количество одновременных клиентов при запросах по сети")
+
+    def handle(self, *args, **options):
+        function = benchmarks.registry.get(options['name'])
+        if function is None:
+            raise CommandError(f"Unknown benchmark {options['name']}")
+        if (options['http'] or options['url']) and not function.http:
+            raise CommandError(f"Benchmark {options['name']} runs in-process only")
+
+        setup_test_environment()
+        old_config = setup_databases(verbosity=0, interactive=False, keepdb=options['keepdb'])
+        try:
+            results = function(options, self.stdout.write)
+        finally:
+            teardown_databases(old_config, verbosity=0, keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        if not results:
+            if options['baseline'] or options['save_baseline']:
+                raise CommandError(f"Benchmark {options['name']} does not support baselines")
+            return
+
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                baseline = json.load(file)
+
+            regressions = benchmarks.compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError("Regressions against baseline:\n" + "\n".join(regressions))
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from MaDaDevAPI import openapi
+
+
+class Command(BaseCommand):
+    help = "Генерирует схему OpenAPI в артефакт (JSON, YAML и их .gz), который отдаёт `api/docs/?format=openapi`"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=None, help="Каталог артефакта, по умолчанию OPENAPI_SCHEMA_DIR")
+        parser.add_argument('--check', action='store_true',
+                            help="Не записывать, а завершиться с ошибкой, если артефакт устарел")
+
+    def handle(self, *args, **options):
+        documents = openapi.generate()
+
+        if options['check']:
+            stale = openapi.stale_files(documents, options['output'])
+            if stale:
+                raise CommandError(f"OpenAPI artifact is stale: {', '.join(stale)}. Run `manage.py build_schema`.")
+            self.stdout.write("OpenAPI artifact is up to date")
+            return
+
+        openapi.write(documents, options['output'])
+        self.stdout.write(f"OpenAPI artifact written to {options['output'] or openapi.get_schema_dir()}")
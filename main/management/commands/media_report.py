@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.template.defaultfilters import filesizeformat
+
+from main import media
+
+
+class Command(BaseCommand):
+    help = "Показывает, сколько места экономит хранение изображений по хэшу содержимого"
+
+    def handle(self, *args, **options):
+        totals = media.report()
+        ratio = totals['saved_bytes'] / totals['referenced_bytes'] if totals['referenced_bytes'] else 0
+
+        self.stdout.write(f"Stored files:      {totals['files']}")
+        self.stdout.write(f"References:        {totals['references']}")
+        self.stdout.write(f"Stored size:       {filesizeformat(totals['stored_bytes'])}")
+        self.stdout.write(f"Without dedup:     {filesizeformat(totals['referenced_bytes'])}")
+        self.stdout.write(f"Saved:             {filesizeformat(totals['saved_bytes'])} ({ratio:.1%})")
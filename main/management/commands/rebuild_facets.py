@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from main import caching, facets
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики тегов и категорий продуктов, например после загрузки данных в обход API"
+
+    def handle(self, *args, **options):
+        facets.rebuild()
+        caching.invalidate('products')
+        self.stdout.write("Product facets rebuilt")
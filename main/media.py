@@ -0,0 +1,376 @@
+import collections
+import functools
+import hashlib
+import logging
+import mimetypes
+import posixpath
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from urllib.parse import quote
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.core.files.utils import validate_file_name
+from django.db import IntegrityError, connections, models, router, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, parse_http_date_safe
+
+from main import metrics
+
+
+logger = logging.getLogger(__name__)
+
+
+HASH_LENGTH = 32
+
+# Имя из `HashedNameStorage`: хэш содержимого и расширение
+hashed_name_re = re.compile(rf'^[0-9a-f]{{{HASH_LENGTH}}}(\.[A-Za-z0-9]+)?$')
+
+collected = metrics.get_or_create(metrics.Counter, 'media_files_collected_total',
+                                  "Файлы изображений, удалённые после освобождения последней ссылки")
+
+_collector = None
+_collector_lock = threading.Lock()
+_collect_pending = False
+
+
+def get_immutable_max_age():
+    return getattr(settings, 'MEDIA_IMMUTABLE_MAX_AGE', 365 * 24 * 60 * 60)
+
+
+def get_max_age():
+    return getattr(settings, 'MEDIA_MAX_AGE', 60 * 60)
+
+
+def get_model():
+    from main.models import StoredImage  # models.py берёт хранилище из этого модуля
+    return StoredImage
+
+
+@functools.cache
+def default_names():
+    return frozenset(str(field.get_default()) for model in apps.get_models() for field in model._meta.fields
+                     if isinstance(field, models.FileField) and field.has_default())
+
+
+def get_protected():
+    """
+    Файлы, которые не удаляются никогда: значения по умолчанию файловых полей (аватар, заглушка продукта)
+    и `MEDIA_PROTECTED_FILES`.
+    """
+    return default_names() | set(getattr(settings, 'MEDIA_PROTECTED_FILES', ()))
+
+
+def content_hash(content):
+    digest = hashlib.sha256()
+    for chunk in content.chunks():
+        digest.update(chunk)
+    return digest.hexdigest()[:HASH_LENGTH]
+
+
+def hashed_name(name, content):
+    """
+    `images/users/photo.JPG` -> `images/users/<хэш содержимого>.jpg`.
+    """
+    directory, filename = posixpath.split(name)
+    extension = posixpath.splitext(filename)[1].lower()
+    return posixpath.join(directory, content_hash(content) + extension)
+
+
+def is_immutable(name):
+    return bool(hashed_name_re.match(posixpath.basename(name)))
+
+
+def acquire(name, size):
+    """
+    Ссылка на файл `name`: запись о файле создаётся при первой ссылке, дальше увеличивается счётчик.
+    Новое содержимое встречается чаще повторного, поэтому сначала `INSERT`. Если между неудачным `INSERT` и
+    `UPDATE` запись удалил `collect`, вставка повторяется.
+    """
+    StoredImage = get_model()
+    while True:
+        try:
+            with transaction.atomic(using=router.db_for_write(StoredImage)):
+                StoredImage.objects.create(name=name, size=size, ref_count=1)
+            return
+        except IntegrityError:
+            if StoredImage.objects.filter(name=name).update(ref_count=F('ref_count') + 1):
+                return
+
+
+def release(names):
+    """
+    Снимает по ссылке на каждое имя из `names` одним `UPDATE ... CASE`. Файлы без ссылок удаляются после
+    коммита в фоне, см. `schedule_collect`. Защищённые имена (`get_protected`) пропускаются без запроса.
+    """
+    protected = get_protected()
+    counts = collections.Counter(name for name in names if name and name not in protected)
+    if not counts:
+        return
+
+    change = Case(*[When(name=name, then=Value(count)) for name, count in counts.items()],
+                  default=Value(0), output_field=IntegerField())
+    if get_model().objects.filter(name__in=list(counts)).update(ref_count=F('ref_count') - change):
+        schedule_collect()
+
+
+def release_rows(queryset, field):
+    """
+    Снимает ссылки строк `queryset` на файлы поля `field` одним `UPDATE` с подзапросом. Вызывается перед
+    удалением строк в обход сигналов, например из `perform_bulk_delete`.
+    """
+    references = (queryset.filter(**{field: OuterRef('name')}).order_by().values(field)
+                  .annotate(count=Count('pk')).values('count'))
+    if get_model().objects.filter(name__in=queryset.values(field)).update(
+            ref_count=F('ref_count') - Subquery(references)):
+        schedule_collect()
+
+
+def collect():
+    """
+    Удаляет файлы и записи без ссылок. Строка блокируется на время удаления файла, так что одновременная
+    загрузка того же содержимого дождётся её и запишет файл заново.
+    """
+    StoredImage = get_model()
+    using = router.db_for_write(StoredImage)
+    removed = 0
+
+    for name in list(StoredImage.objects.filter(ref_count__lte=0).values_list('name', flat=True)):
+        with transaction.atomic(using=using):
+            if not StoredImage.objects.select_for_update().filter(name=name, ref_count__lte=0).exists():
+                continue
+            storage.delete(name)
+            StoredImage.objects.filter(name=name).delete()
+        removed += 1
+
+    collected.inc(removed)
+    return removed
+
+
+def collect_in_background():
+    global _collect_pending
+
+    with _collector_lock:
+        _collect_pending = False
+    try:
+        collect()
+    except Exception:
+        logger.exception("Stored image collection failed")
+    finally:
+        connections.close_all()
+
+
+def schedule_collect():
+    """
+    Запускает `collect` после коммита текущей транзакции в фоновом потоке (`MEDIA_COLLECT_ASYNC`), чтобы
+    запрос не ждал удаления файлов. Пока сборка в очереди, новые не ставятся.
+    """
+
+    def run():
+        global _collector, _collect_pending
+
+        if not getattr(settings, 'MEDIA_COLLECT_ASYNC', True):
+            collect()
+            return
+
+        with _collector_lock:
+            if _collect_pending:
+                return
+            _collect_pending = True
+            if _collector is None:
+                _collector = ThreadPoolExecutor(max_workers=1, thread_name_prefix='media-collect')
+            _collector.submit(collect_in_background)
+
+    transaction.on_commit(run, using=router.db_for_write(get_model()))
+
+
+def report():
+    """
+    Экономия места от дедупликации: сколько файлов и байт хранится и сколько заняли бы копии на каждую
+    ссылку.
+    """
+    totals = get_model().objects.filter(ref_count__gt=0).aggregate(
+        files=Count('pk'), references=Coalesce(Sum('ref_count'), 0), stored_bytes=Coalesce(Sum('size'), 0),
+        referenced_bytes=Coalesce(Sum(F('size') * F('ref_count')), 0))
+    totals['saved_bytes'] = totals['referenced_bytes'] - totals['stored_bytes']
+    return totals
+
+
+class HashedNameStorage(FileSystemStorage):
+    """
+    Файловое хранилище с адресацией по содержимому: файл называется по хэшу и хранится один раз, сколько бы
+    строк на него ни ссылалось. Каждое сохранение добавляет ссылку (`acquire`), файл удаляется, когда
+    ссылок не остаётся (`release`, `collect`). Содержимое по имени не меняется, поэтому `serve` отдаёт его с
+    `Cache-Control: immutable`.
+    """
+
+    def __init__(self, **kwargs):
+        # Одновременная запись одного и того же содержимого пишет одинаковые байты
+        kwargs.setdefault('allow_overwrite', True)
+        super().__init__(**kwargs)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+
+        name = hashed_name(name, content)
+        validate_file_name(name, allow_relative_path=True)
+        if max_length is not None and len(name) > max_length:
+            raise SuspiciousFileOperation(f"Storage can not find an available filename for \"{name}\"")
+
+        with transaction.atomic(using=router.db_for_write(get_model())):
+            acquire(name, content.size)
+            if not self.exists(name):
+                self._save(name, content)
+        return name
+
+    def delete(self, name):
+        if name in get_protected():
+            return
+        super().delete(name)
+
+
+storage = HashedNameStorage()
+
+
+def parse_range(header, size):
+    """
+    Один диапазон `bytes=начало-конец` из заголовка `Range`: (начало, конец) включительно. None, если
+    заголовка нет, он не разобран или диапазонов несколько — тогда отдаётся файл целиком. ValueError, если
+    диапазон за пределами файла.
+    """
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+
+    start, separator, end = header[len('bytes='):].strip().partition('-')
+    if not separator or not (start or end) or not (start or '0').isdigit() or not (end or '0').isdigit():
+        return None
+
+    if not start:
+        length = int(end)
+        if length == 0 or size == 0:
+            raise ValueError("Unsatisfiable range")
+        return max(size - length, 0), size - 1
+
+    start = int(start)
+    end = int(end) if end else size - 1
+    if start >= size:
+        raise ValueError("Unsatisfiable range")
+    if end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def range_matches(request, etag, last_modified):
+    """
+    `If-Range`: диапазон отдаётся, только если файл не менялся с тех пор, как клиент получил его начало.
+    """
+    condition = request.headers.get('If-Range')
+    if not condition:
+        return True
+    if condition.startswith(('"', 'W/')):
+        return condition == etag
+    return parse_http_date_safe(condition) == last_modified
+
+
+class RangeFile:
+    """
+    Часть открытого файла для `FileResponse`: читается не дальше `length` байт от текущей позиции.
+    """
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def file_response(path, fullpath, size, byte_range):
+    """
+    Отдача через фронт-прокси (`MEDIA_ACCEL_REDIRECT` для nginx, `MEDIA_SENDFILE` для Apache/lighttpd),
+    они сами обслуживают `Range`. Иначе `FileResponse`: WSGI-сервер с `wsgi.file_wrapper` отправляет файл
+    через `os.sendfile` без копирования в Python, диапазон читается по частям.
+    """
+    content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    accel_prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT', None)
+
+    if accel_prefix:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = accel_prefix.rstrip('/') + '/' + quote(path)
+        return response
+
+    if getattr(settings, 'MEDIA_SENDFILE', False):
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = str(fullpath)
+        return response
+
+    file = fullpath.open('rb')
+    if byte_range is None:
+        return FileResponse(file, content_type=content_type)
+
+    start, end = byte_range
+    file.seek(start)
+    response = FileResponse(RangeFile(file, end - start + 1), status=206, content_type=content_type)
+    response['Content-Length'] = end - start + 1
+    response['Content-Range'] = f"bytes {start}-{end}/{size}"
+    return response
+
+
+def serve(request, path):
+    """
+    Файлы `MEDIA_ROOT` с `ETag`, `Last-Modified` и `Range`. Файлы с хэшем в имени кэшируются навсегда
+    (`MEDIA_IMMUTABLE_MAX_AGE`), остальные, например аватар по умолчанию, — на `MEDIA_MAX_AGE` секунд.
+    """
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    try:
+        fullpath = Path(safe_join(settings.MEDIA_ROOT, path))
+    except SuspiciousFileOperation:
+        raise Http404("File not found")
+    if not fullpath.is_file():
+        raise Http404("File not found")
+
+    stat = fullpath.stat()
+    etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+    last_modified = int(stat.st_mtime)
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        try:
+            byte_range = parse_range(request.headers.get('Range'), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{stat.st_size}"
+        else:
+            if byte_range is not None and not range_matches(request, etag, last_modified):
+                byte_range = None
+            response = file_response(path, fullpath, stat.st_size, byte_range)
+
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    if is_immutable(path):
+        patch_cache_control(response, public=True, max_age=get_immutable_max_age(), immutable=True)
+    else:
+        patch_cache_control(response, public=True, max_age=get_max_age())
+    return response
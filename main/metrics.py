@@ -0,0 +1,157 @@
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+
+registry = {}
+
+
+def _labels_key(labels):
+    return tuple(sorted(labels.items()))
+
+
+def _escape(text, quote=True):
+    """
+    Экранирование текстового формата Prometheus: `\\` и перевод строки, в значениях меток ещё и `"`.
+    """
+    text = str(text).replace('\\', '\\\\').replace('\n', '\\n')
+    return text.replace('"', '\\"') if quote else text
+
+
+def _format_labels(key, extra=()):
+    items = list(key) + list(extra)
+    if not items:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in items) + "}"
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.Lock()
+        self.values = {}
+        registry[name] = self
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {_escape(self.description, quote=False)}", f"# TYPE {self.name} {self.type}"]
+        for name, key, value in self.samples():
+            lines.append(f"{name}{_format_labels(key)} {value}")
+        return "\n".join(lines)
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[_labels_key(labels)] = value
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def get(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+
+class Histogram(Metric):
+    """
+    Гистограмма в секундах с фиксированными границами корзин, как в клиенте Prometheus.
+    """
+    type = 'histogram'
+    default_buckets = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, name, description, buckets=None):
+        super().__init__(name, description)
+        self.buckets = tuple(buckets or self.default_buckets)
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            counts[0][index] += 1
+            counts[1] += value
+            counts[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def get(self, **labels):
+        counts = self.values.get(_labels_key(labels))
+        return {'count': counts[2], 'sum': counts[1]} if counts else {'count': 0, 'sum': 0.0}
+
+    def samples(self):
+        with self.lock:
+            values = [(key, list(counts[0]), counts[1], counts[2]) for key, counts in self.values.items()]
+
+        samples = []
+        for key, buckets, total, count in values:
+            cumulative = 0
+            for bound, amount in zip(self.buckets + (float('inf'),), buckets):
+                cumulative += amount
+                le = "+Inf" if bound == float('inf') else repr(bound)
+                samples.append((f"{self.name}_bucket", key + (('le', le),), cumulative))
+            samples.append((f"{self.name}_sum", key, total))
+            samples.append((f"{self.name}_count", key, count))
+        return samples
+
+
+def get_or_create(metric_class, name, description, **kwargs):
+    metric = registry.get(name)
+    if metric is None:
+        metric = metric_class(name, description, **kwargs)
+    return metric
+
+
+def render():
+    return "\n".join(metric.render() for metric in registry.values()) + "\n"
+
+
+validation_latency = get_or_create(Histogram, 'serializer_validation_seconds',
+                                   "Время `is_valid()` сериализатора")
+
+
+class TimedValidationMixin:
+    """
+    Примесь к сериализатору: время `is_valid()` пишется в `serializer_validation_seconds`.
+    """
+
+    def is_valid(self, *args, **kwargs):
+        with validation_latency.time(serializer=type(self).__name__):
+            return super().is_valid(*args, **kwargs)
@@ -0,0 +1,174 @@
+import contextvars
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from django.db import connections
+
+from main import metrics, querybudget, routers
+
+
+request_latency = metrics.get_or_create(metrics.Histogram, 'http_request_duration_seconds',
+                                        "Время обработки запроса по действию вида")
+request_queries = metrics.get_or_create(metrics.Histogram, 'http_request_db_queries',
+                                        "Количество запросов к базе на один запрос",
+                                        buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100, 200))
+request_db_latency = metrics.get_or_create(metrics.Histogram, 'http_request_db_seconds',
+                                           "Время запросов к базе за один запрос")
+
+_query_stats = contextvars.ContextVar('query_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = _query_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats[0] += 1
+        stats[1] += time.perf_counter() - started
+        if stats[2] is not None and not querybudget.is_repeated():
+            stats[2].append(sql)
+
+
+def instrument(connection):
+    """
+    Подключает подсчёт запросов к соединению. Без активного запроса `MetricsMiddleware` обёртка ничего не делает.
+    """
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def resolve_view(request):
+    """
+    (класс вида, действие) для видов DRF или (None, путь к функции) для остальных.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None, 'unmatched'
+
+    cls = getattr(match.func, 'cls', None)
+    if cls is None:
+        return None, match._func_path
+
+    method = request.method.lower()
+    actions = getattr(match.func, 'actions', None) or {}
+    return cls, actions.get(method) or (actions.get('get') if method == 'head' else None) or method
+
+
+class MetricsMiddleware:
+    """
+    Пишет время запроса, число и время запросов к базе с меткой действия вида. Запросы к базе считаются через
+    `execute_wrapper` и `contextvars`, поэтому учитываются и запросы асинхронных видов из `sync_to_async`.
+
+    У выборки запросов (`QUERY_BUDGET_SAMPLE_RATE`) сохраняется SQL и проверяется бюджет `query_budgets`
+    действия вида и повторяющиеся запросы (N+1), см. `main.querybudget`.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    @staticmethod
+    def new_stats():
+        return [0, 0.0, [] if querybudget.sampled() else None]
+
+    @staticmethod
+    def record(request, response, started, stats):
+        # Метка вида `UsersViewSet.create`, `AuthAPIView.login` для видов DRF и путь к функции для остальных
+        cls, action = resolve_view(request)
+        label = action if cls is None else f"{cls.__name__}.{action}"
+
+        request_latency.observe(time.perf_counter() - started, view=label, method=request.method,
+                                status=response.status_code)
+        request_queries.observe(stats[0], view=label)
+        request_db_latency.observe(stats[1], view=label)
+
+        if stats[2] is not None:
+            querybudget.check(label, querybudget.get_budget(cls, action), stats[2])
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        for connection in connections.all(initialized_only=True):
+            instrument(connection)
+
+        started = time.perf_counter()
+        stats = self.new_stats()
+        token = _query_stats.set(stats)
+        try:
+            response = self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+
+        self.record(request, response, started, stats)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stats = self.new_stats()
+        token = _query_stats.set(stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _query_stats.reset(token)
+
+        self.record(request, response, started, stats)
+        return response
+
+
+class ReplicaPinMiddleware:
+    """
+    Открывает для запроса контекст чтения с реплик `main.routers.reading`. Запросы с небезопасным методом и
+    клиенты, которые писали в последние `REPLICA_STICKY_SECONDS`, читают из основной базы. Если запрос что-то
+    записал, клиент привязывается к основной базе на это время и видит свои изменения. Без
+    `DATABASE_REPLICAS` ничего не делает.
+    """
+    sync_capable = True
+    async_capable = True
+    safe_methods = ('GET', 'HEAD', 'OPTIONS')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        if not routers.get_replicas():
+            return self.get_response(request)
+
+        cache = routers.get_cache()
+        key = routers.pin_key(request)
+        pinned = request.method not in self.safe_methods or cache.get(key) is not None
+
+        with routers.reading(pinned) as state:
+            response = self.get_response(request)
+
+        if state['wrote']:
+            cache.set(key, 1, routers.get_sticky_seconds())
+        return response
+
+    async def __acall__(self, request):
+        if not routers.get_replicas():
+            return await self.get_response(request)
+
+        cache = routers.get_cache()
+        key = routers.pin_key(request)
+        pinned = request.method not in self.safe_methods or await cache.aget(key) is not None
+
+        with routers.reading(pinned) as state:
+            response = await self.get_response(request)
+
+        if state['wrote']:
+            await cache.aset(key, 1, routers.get_sticky_seconds())
+        return response
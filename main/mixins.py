@@ -0,0 +1,280 @@
+import os
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import Http404
+
+from rest_framework import serializers
+from rest_framework.response import Response
+
+from main.fastread import compile_serializer
+from main.pagination import afetch
+
+
+class DynamicFieldsSerializerMixin:
+    """
+    Оставляет в сериализаторе только поля из `fields` и раскрывает вложенные объекты из `expand`.
+    Раскрываемые поля перечислены в `Meta.expandable_fields` и без `expand` не выводятся.
+    """
+
+    def __init__(self, *args, fields=None, expand=(), **kwargs):
+        super().__init__(*args, **kwargs)
+
+        expandable = getattr(self.Meta, 'expandable_fields', ())
+
+        for name in list(self.fields):
+            if name in expandable:
+                if name not in expand:
+                    self.fields.pop(name)
+            elif fields is not None and name not in fields:
+                self.fields.pop(name)
+
+
+class SparseFieldsMixin:
+    """
+    Поддержка `?fields=a,b` и `?expand=relation` для `list` и `retrieve`.
+
+    Выбранные поля превращаются в `.only()` по колонкам модели, а раскрываемые связи загружаются одним
+    JOIN через `.select_related()`, связи «ко многим» — одним дополнительным запросом `.prefetch_related()`.
+    """
+    fields_query_param = 'fields'
+    expand_query_param = 'expand'
+    sparse_actions = ('list', 'retrieve')
+
+    def _query_list(self, name):
+        if getattr(self, 'swagger_fake_view', False) or self.request is None:
+            return None
+
+        value = self.request.query_params.get(name)
+        if value is None:
+            return None
+        return [item.strip() for item in value.split(',') if item.strip()]
+
+    def get_requested_fields(self):
+        if self.action not in self.sparse_actions:
+            return None
+
+        fields = self._query_list(self.fields_query_param)
+        if fields is None:
+            return None
+
+        available = self.get_serializer_class()(expand=()).fields
+        unknown = [field for field in fields if field not in available]
+        if unknown:
+            raise serializers.ValidationError({"status": f"unknown fields: {', '.join(unknown)}"},
+                                              code="unknown_fields")
+        return fields
+
+    def get_requested_expand(self):
+        if self.action not in self.sparse_actions:
+            return []
+
+        expand = self._query_list(self.expand_query_param) or []
+        expandable = getattr(self.get_serializer_class().Meta, 'expandable_fields', ())
+        unknown = [field for field in expand if field not in expandable]
+        if unknown:
+            raise serializers.ValidationError({"status": f"cannot expand: {', '.join(unknown)}"},
+                                              code="unknown_expand")
+        return expand
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in self.sparse_actions:
+            kwargs.setdefault('fields', self.get_requested_fields())
+            kwargs.setdefault('expand', self.get_requested_expand())
+        return super().get_serializer(*args, **kwargs)
+
+    @staticmethod
+    def many_relations(model):
+        return {field.name for field in model._meta.many_to_many}
+
+    @staticmethod
+    def _columns(serializer, prefix=""):
+        columns = []
+        many = SparseFieldsMixin.many_relations(serializer.Meta.model)
+        for field in serializer.fields.values():
+            if isinstance(field, serializers.BaseSerializer):
+                columns.extend(SparseFieldsMixin._columns(field, prefix + field.source + "__"))
+            elif field.source != '*' and field.source not in many:
+                columns.append(prefix + field.source.replace('.', '__'))
+        return columns
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        if self.action not in self.sparse_actions:
+            return queryset
+
+        fields = self.get_requested_fields()
+        expand = self.get_requested_expand()
+
+        if expand:
+            many = self.many_relations(queryset.model)
+            joined = [name for name in expand if name not in many]
+            if joined:
+                queryset = queryset.select_related(*joined)
+            queryset = queryset.prefetch_related(*[name for name in expand if name in many])
+
+        if fields is not None or expand:
+            serializer = self.get_serializer_class()(fields=fields, expand=expand)
+            columns = self._columns(serializer) + list(getattr(self, 'cursor_ordering_fields', ()))
+            queryset = queryset.only(*columns)
+
+        return queryset
+
+
+class FastReadMixin:
+    """
+    Быстрый `list`: строки читаются через `.values()` и представляются `CompiledSerializer` без создания
+    экземпляров моделей. Вид включает его атрибутом `fast_read = True`, выключить для запроса можно `?fast=0`.
+    """
+    fast_read = False
+
+    def use_fast_read(self):
+        if not self.fast_read or self.request.query_params.get('fast') == '0':
+            return False
+
+        # `.values()` даёт по строке на каждую связанную запись, поэтому связи «ко многим» читаются моделями
+        many = {field.name for field in self.get_serializer_class().Meta.model._meta.many_to_many}
+        return not many & set(getattr(self, 'get_requested_expand', list)())
+
+    def get_fast_rows(self):
+        compiled = compile_serializer(self.get_serializer())
+        queryset = self.filter_queryset(self.get_queryset())
+
+        ordering = [queryset.model._meta.pk.name] + list(getattr(self, 'cursor_ordering_fields', ()))
+        rows = queryset.values(*compiled.columns, *[name for name in ordering if name not in compiled.columns])
+
+        return compiled, rows
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_fast_read():
+            return super().list(request, *args, **kwargs)
+
+        compiled, rows = self.get_fast_rows()
+
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(compiled.many(page, request))
+
+        return Response(compiled.many(rows, request))
+
+
+def use_async_views():
+    return getattr(settings, 'CATALOG_ASYNC_VIEWS', os.environ.get('CATALOG_ASYNC_VIEWS') == '1')
+
+
+class AsyncReadMixin:
+    """
+    Асинхронные `list` и `retrieve` для запуска под ASGI без перехода в поток на каждый запрос.
+
+    Если включён `CATALOG_ASYNC_VIEWS` (`asgi.py` включает его по умолчанию), `as_view` возвращает корутину:
+    действия из `async_actions` выполняются через асинхронный ORM (`alist`, `aretrieve`), остальные — прежним
+    синхронным видом через `sync_to_async`. Ответы совпадают с синхронными.
+    """
+    async_actions = ('list', 'retrieve')
+
+    @classmethod
+    def as_view(cls, actions=None, **initkwargs):
+        view = super().as_view(actions, **initkwargs)
+
+        if not use_async_views() or not set(actions.values()) & set(cls.async_actions):
+            return view
+
+        sync_view = sync_to_async(view)
+        method_actions = dict(actions)
+        if 'get' in method_actions and 'head' not in method_actions:
+            method_actions['head'] = method_actions['get']
+
+        async def async_view(request, *args, **kwargs):
+            if method_actions.get(request.method.lower()) not in cls.async_actions:
+                return await sync_view(request, *args, **kwargs)
+
+            self = cls(**initkwargs)
+            self.action_map = method_actions
+            for method, action in method_actions.items():
+                setattr(self, method, getattr(self, action))
+            self.request = request
+            self.args = args
+            self.kwargs = kwargs
+
+            return await self.adispatch(request, *args, **kwargs)
+
+        async_view.cls = cls
+        async_view.initkwargs = view.initkwargs
+        async_view.actions = actions
+        async_view.csrf_exempt = True
+        return async_view
+
+    @staticmethod
+    def has_credentials(request):
+        return 'HTTP_AUTHORIZATION' in request.META or settings.SESSION_COOKIE_NAME in request.COOKIES
+
+    async def initial_async(self, request, *args, **kwargs):
+        # Анонимный запрос аутентифицируется и проверяется без обращения к базе, остальные — в потоке
+        if self.has_credentials(request._request):
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+        else:
+            self.initial(request, *args, **kwargs)
+
+    async def adispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await self.initial_async(request, *args, **kwargs)
+            handler = getattr(self, 'a' + self.action_map[request.method.lower()])
+            response = await handler(request, *args, **kwargs)
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+    async def apaginate_queryset(self, queryset):
+        if self.paginator is None:
+            return None
+        return await self.paginator.apaginate_queryset(queryset, self.request, view=self)
+
+    async def aget_object(self):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        filter_kwargs = {self.lookup_field: self.kwargs[lookup_url_kwarg]}
+
+        try:
+            obj = await queryset.aget(**filter_kwargs)
+        except (queryset.model.DoesNotExist, TypeError, ValueError, ValidationError):
+            raise Http404(f"No {queryset.model._meta.object_name} matches the given query.")
+
+        self.check_object_permissions(self.request, obj)
+        return obj
+
+    async def alist(self, request, *args, **kwargs):
+        if getattr(self, 'use_fast_read', lambda: False)():
+            compiled, rows = self.get_fast_rows()
+
+            page = await self.apaginate_queryset(rows)
+            if page is not None:
+                return self.get_paginated_response(compiled.many(page, request))
+
+            return Response(compiled.many(await afetch(rows), request))
+
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = await self.apaginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
+
+        serializer = self.get_serializer(await afetch(queryset), many=True)
+        return Response(serializer.data)
+
+    async def aretrieve(self, request, *args, **kwargs):
+        instance = await self.aget_object()
+        serializer = self.get_serializer(instance)
+        return Response(serializer.data)
@@ -1,6 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import AbstractUser
 
+from main import media
+
 
 # Класс переопределение стандартной модели пользователя для Django
 class User(AbstractUser):
@@ -8,61 +10,96 @@ class User(AbstractUser):
     last_ip = models.GenericIPAddressField(null=False, default='0.0.0.0')
     image = models.ImageField(null=False,
                               default="images/default_avatar/default_avatar.png",
-                              upload_to="images/users/")
+                              upload_to="images/users/",
+                              storage=media.storage)
     is_email_verified = models.BooleanField(null=False, default=False)
     email = models.EmailField(null=False, unique=True)
+    # Время последнего сохранения, по нему `main.ipfilter` догружает изменённые адреса
+    updated_at = models.DateTimeField(auto_now=True, db_index=True)
 
     first_name = None
     last_name = None
 
+    class Meta(AbstractUser.Meta):
+        swappable = 'AUTH_USER_MODEL'
+        indexes = [
+            models.Index(fields=['ip'], name='user_ip_idx'),
+            models.Index(fields=['last_ip'], name='user_last_ip_idx'),
+        ]
+
 
 class TypeProduct(models.Model):
     product_type_id = models.AutoField(primary_key=True, null=False)
     product_type_name = models.CharField(max_length=64, null=False, default="Type of product")
+    # Количество продуктов категории, поддерживается `main.facets` при записи
+    product_count = models.IntegerField(null=False, default=0)
 
     class Meta:
         db_table = 'type_product'
 
 
+class Tag(models.Model):
+    tag_id = models.AutoField(primary_key=True, null=False)
+    tag_name = models.CharField(max_length=64, null=False, unique=True)
+    # Количество продуктов с тегом, поддерживается `main.facets` при записи
+    product_count = models.IntegerField(null=False, default=0)
+
+    class Meta:
+        db_table = 'tag'
+        indexes = [
+            models.Index(fields=['-product_count'], name='tag_product_count_idx'),
+        ]
+
+
 class Product(models.Model):
     product_id = models.AutoField(primary_key=True, null=False)
     product_title = models.CharField(max_length=128, null=False, default="Title of product")
     product_tag = models.CharField(max_length=64, null=False, default="Tag of product")
     product_desc = models.TextField(null=False, default="Description of product")
-    product_image = models.ImageField(null=False, upload_to='images/products/', default="images/plug/plug.jpg")
+    product_image = models.ImageField(null=False, upload_to='images/products/', default="images/plug/plug.jpg",
+                                      storage=media.storage)
     product_type = models.ForeignKey(TypeProduct, on_delete=models.CASCADE, null=False, default=1)
+    tags = models.ManyToManyField(Tag, through='ProductTag', related_name='products')
 
     class Meta:
         db_table = 'product'
 
 
+class ProductTag(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+
+    class Meta:
+        db_table = 'product_tag'
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'tag'], name='product_tag_unique'),
+        ]
+        # Фильтр по тегам читает только индекс: (тег, продукт)
+        indexes = [
+            models.Index(fields=['tag', 'product'], name='product_tag_tag_idx'),
+        ]
+
+
+class StoredImage(models.Model):
+    # Имя файла в `media.storage`: каталог и хэш содержимого
+    name = models.CharField(max_length=255, primary_key=True, null=False)
+    size = models.BigIntegerField(null=False, default=0)
+    # Количество строк, которые ссылаются на файл, поддерживается `main.media` при записи
+    ref_count = models.IntegerField(null=False, default=0, db_index=True)
+
+    class Meta:
+        db_table = 'stored_image'
+
+
 class MiniNews(models.Model):
     mini_news_id = models.AutoField(primary_key=True, null=False)
     mn_title = models.CharField(max_length=128, null=False, default="Title of mini news")
     mn_desc = models.TextField(null=False, default="Description of mini news")
     mn_date = models.DateField(auto_now=True)
 
-
-class DBManager(models.Manager):
-    def __init__(self, using, *args, **kwargs):
-        self.db_using = using
-        super(DBManager, self).__init__(*args, **kwargs)
-
-    def get_queryset(self):
-        return super().get_queryset(using=self.db_using)
-
-
-class DBModel(models.Model):
-    using = 'mdd'
-
-    objects = DBManager(using=using)
-
-    def save(self, *args, **kwargs):
-        return super().save(using=self.using, *args, **kwargs)
-
-    def delete(self, *args, **kwargs):
-        return super().save(using=self.using, *args, **kwargs)
-
     class Meta:
-        managed = False
-        abstract = True
+        # Лента последних новостей и фильтр по датам читают индекс по порядку ленты
+        indexes = [
+            models.Index(fields=['-mn_date', '-mini_news_id'], name='mini_news_date_idx'),
+        ]
+
@@ -0,0 +1,187 @@
+from rest_framework import pagination
+from rest_framework.settings import api_settings
+
+
+async def afetch(queryset):
+    return [item async for item in queryset]
+
+
+class KeysetPagination(pagination.CursorPagination):
+    """
+    Пагинация по непрозрачному курсору (`cursor`) без `COUNT(*)`: стоимость страницы не зависит от глубины.
+
+    Порядок берётся из `view.cursor_ordering`, клиент может выбрать другой из `view.cursor_ordering_fields`
+    параметром `ordering` (например, `-mn_date`). Первичный ключ всегда добавляется последним, чтобы порядок
+    был однозначным.
+    """
+    page_size = api_settings.PAGE_SIZE or 100
+    page_size_query_param = 'limit'
+    max_page_size = 1000
+    ordering_query_param = 'ordering'
+
+    def get_ordering(self, request, queryset, view):
+        pk = queryset.model._meta.pk.name
+        ordering = getattr(view, 'cursor_ordering', pk)
+        requested = request.query_params.get(self.ordering_query_param)
+
+        if requested and requested.lstrip('-') in getattr(view, 'cursor_ordering_fields', ()):
+            ordering = requested
+
+        if ordering.lstrip('-') == pk:
+            return (ordering,)
+
+        return ordering, ('-' if ordering.startswith('-') else '') + pk
+
+    def get_page_queryset(self, queryset, request, view=None):
+        """
+        Первая половина `paginate_queryset`: запоминает курсор и возвращает срез страницы с одной лишней
+        строкой (или None без пагинации). Запрос к базе не выполняется, поэтому срез можно прочитать как
+        синхронно, так и через асинхронный ORM.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, view)
+
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            (offset, reverse, current_position) = (0, False, None)
+        else:
+            (offset, reverse, current_position) = self.cursor
+
+        if reverse:
+            queryset = queryset.order_by(*pagination._reverse_ordering(self.ordering))
+        else:
+            queryset = queryset.order_by(*self.ordering)
+
+        if current_position is not None:
+            order = self.ordering[0]
+            is_reversed = order.startswith('-')
+            order_attr = order.lstrip('-')
+
+            if self.cursor.reverse != is_reversed:
+                kwargs = {order_attr + '__lt': current_position}
+            else:
+                kwargs = {order_attr + '__gt': current_position}
+
+            queryset = queryset.filter(**kwargs)
+
+        return queryset[offset:offset + self.page_size + 1]
+
+    def get_page(self, results):
+        """
+        Вторая половина `paginate_queryset`: по прочитанным строкам определяет позиции соседних страниц.
+        """
+        offset, reverse, current_position = self.cursor or (0, False, None)
+
+        self.page = list(results[:self.page_size])
+
+        if len(results) > len(self.page):
+            has_following_position = True
+            following_position = self._get_position_from_instance(results[-1], self.ordering)
+        else:
+            has_following_position = False
+            following_position = None
+
+        if reverse:
+            self.page = list(reversed(self.page))
+
+            self.has_next = (current_position is not None) or (offset > 0)
+            self.has_previous = has_following_position
+            if self.has_next:
+                self.next_position = current_position
+            if self.has_previous:
+                self.previous_position = following_position
+        else:
+            self.has_next = has_following_position
+            self.has_previous = (current_position is not None) or (offset > 0)
+            if self.has_next:
+                self.next_position = following_position
+            if self.has_previous:
+                self.previous_position = current_position
+
+        if (self.has_previous or self.has_next) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def paginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.get_page(list(page_queryset))
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        page_queryset = self.get_page_queryset(queryset, request, view)
+        if page_queryset is None:
+            return None
+        return self.get_page(await afetch(page_queryset))
+
+
+class OffsetPagination(pagination.LimitOffsetPagination):
+    """
+    `LimitOffsetPagination` с асинхронным вариантом `paginate_queryset`.
+    """
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.count = await queryset.acount()
+        self.offset = self.get_offset(request)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+
+        if self.count == 0 or self.offset > self.count:
+            return []
+        return await afetch(queryset[self.offset:self.offset + self.limit])
+
+
+class CatalogPagination(pagination.BasePagination):
+    """
+    По умолчанию отдаёт страницы по курсору (`KeysetPagination`). Если клиент передал `offset`,
+    работает как прежде через `LimitOffsetPagination` с полем `count`. Так же отдаётся выдача поиска
+    (`ranked_query_params`): порядок по релевантности нельзя продолжить курсором по полю.
+    """
+    offset_query_param = 'offset'
+    ranked_query_params = ('q',)
+    offset_class = OffsetPagination
+    cursor_class = KeysetPagination
+
+    def __init__(self):
+        self.paginator = None
+
+    def get_paginator(self, request):
+        if self.offset_query_param in request.query_params or \
+                any(param in request.query_params for param in self.ranked_query_params):
+            return self.offset_class()
+        return self.cursor_class()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        return self.paginator.paginate_queryset(queryset, request, view)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        self.paginator = self.get_paginator(request)
+        return await self.paginator.apaginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.paginator.get_paginated_response(data)
+
+    def get_paginated_response_schema(self, schema):
+        return self.cursor_class().get_paginated_response_schema(schema)
+
+    def to_html(self):
+        return self.paginator.to_html()
+
+    def get_results(self, data):
+        return data['results']
+
+    @property
+    def display_page_controls(self):
+        return getattr(self.paginator, 'display_page_controls', False)
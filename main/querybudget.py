@@ -0,0 +1,87 @@
+import contextvars
+import logging
+import random
+import re
+from collections import Counter
+from contextlib import contextmanager
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_PREFIXES = ('SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT')
+
+_repeated = contextvars.ContextVar('query_budget_repeated', default=False)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def sampled():
+    """
+    Нужно ли собирать SQL этого запроса: в тестах `QUERY_BUDGET_SAMPLE_RATE = 1`, в продакшене малая доля.
+    """
+    rate = getattr(settings, 'QUERY_BUDGET_SAMPLE_RATE', 0.01)
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+@contextmanager
+def repeated():
+    """
+    Запросы внутри не попадают в проверку бюджета и N+1, но учитываются в метриках. Для повторов уже
+    проверенной работы, например следующих пакетов массовой операции: бюджет такого действия — на один пакет.
+    """
+    token = _repeated.set(True)
+    try:
+        yield
+    finally:
+        _repeated.reset(token)
+
+
+def is_repeated():
+    return _repeated.get()
+
+
+def normalize(sql):
+    return re.sub(r'IN \((?:%s, )*%s\)', 'IN (...)', sql)
+
+
+def get_budget(view_class, action):
+    """
+    Бюджет из `query_budgets = {action: количество запросов}` вида, включая аутентификацию по токену.
+    Управление транзакцией (savepoint) не считается.
+    """
+    return getattr(view_class, 'query_budgets', {}).get(action)
+
+
+def find_problems(label, budget, statements):
+    statements = [sql for sql in statements if not sql.startswith(TRANSACTION_PREFIXES)]
+    problems = []
+
+    if budget is not None and len(statements) > budget:
+        problems.append(f"{label}: {len(statements)} queries, budget {budget}")
+
+    repeats = getattr(settings, 'QUERY_BUDGET_REPEATS', 3)
+    for sql, count in Counter(map(normalize, statements)).items():
+        if count >= repeats:
+            problems.append(f"{label}: possible N+1, {count} x {sql[:200]}")
+
+    return problems
+
+
+def check(label, budget, statements):
+    """
+    Проверяет собранные запросы: превышение бюджета и одинаковые запросы (N+1). С `QUERY_BUDGET_RAISE`
+    (в тестах) поднимает `QueryBudgetExceeded`, иначе пишет предупреждение в лог.
+    """
+    problems = find_problems(label, budget, statements)
+    if not problems:
+        return
+
+    if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+        raise QueryBudgetExceeded("\n".join(problems))
+
+    for problem in problems:
+        logger.warning(problem)
@@ -0,0 +1,254 @@
+import fcntl
+import functools
+import hashlib
+import ipaddress
+import logging
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+from rest_framework.throttling import BaseThrottle
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RATE_LIMITS = {
+    'login': {'ip': '30/min', 'username': '10/min'},
+    'send_mail_recovery_password': {'ip': '10/min', 'username': '3/hour'},
+    'activate': {'ip': '30/min', 'uid': '10/min'},
+}
+
+SLOT = struct.Struct('Qdd')
+PROBES = 16
+
+
+def get_rate_limits(action):
+    limits = getattr(settings, 'RATE_LIMITS', {})
+    return limits.get(action, DEFAULT_RATE_LIMITS.get(action, {}))
+
+
+def parse_rate(rate):
+    """
+    `"10/min"` -> (ёмкость корзины, токенов в секунду), формат как у `DEFAULT_THROTTLE_RATES` в DRF.
+    """
+    number, period = rate.split('/')
+    capacity = int(number)
+    seconds = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}[period[0]]
+    return capacity, capacity / seconds
+
+
+@functools.lru_cache(maxsize=8)
+def parse_networks(proxies):
+    return tuple(ipaddress.ip_network(proxy, strict=False) for proxy in proxies)
+
+
+def parse_ip(address):
+    try:
+        return ipaddress.ip_address(address.strip())
+    except ValueError:
+        return None
+
+
+def is_trusted(address, networks):
+    ip = parse_ip(address)
+    return ip is not None and any(ip in network for network in networks)
+
+
+_forwarding_warned = False
+
+
+def warn_untrusted_forwarding(remote_addr):
+    """
+    Один раз на процесс предупреждает, что `X-Forwarded-For` пришёл от внутреннего адреса, а
+    `TRUSTED_PROXIES` не задан: за обратным прокси все клиенты получат адрес прокси.
+    """
+    global _forwarding_warned
+
+    ip = parse_ip(remote_addr)
+    if _forwarding_warned or ip is None or not (ip.is_private or ip.is_loopback):
+        return
+    _forwarding_warned = True
+    logger.warning("X-Forwarded-For from %s is ignored because TRUSTED_PROXIES is not set: behind a reverse "
+                   "proxy every client gets the proxy address", remote_addr)
+
+
+def client_ip(request):
+    """
+    Адрес клиента для ограничения частоты, закрепления за репликой и IP регистрации: `REMOTE_ADDR`.
+    `X-Forwarded-For` учитывается, только если запрос пришёл от прокси из `TRUSTED_PROXIES` (адреса или
+    сети), и читается справа налево до первого адреса не из них: левую часть заголовка клиент пишет сам.
+    """
+    remote_addr = request.META.get('REMOTE_ADDR')
+    networks = parse_networks(tuple(getattr(settings, 'TRUSTED_PROXIES', ())))
+    x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
+
+    if not networks:
+        if x_forwarded_for and remote_addr:
+            warn_untrusted_forwarding(remote_addr)
+        return remote_addr
+
+    if not x_forwarded_for or not remote_addr or not is_trusted(remote_addr, networks):
+        return remote_addr
+
+    forwarded = [address.strip() for address in x_forwarded_for.split(',') if address.strip()]
+    for address in reversed(forwarded):
+        if not is_trusted(address, networks):
+            return address
+    return forwarded[0] if forwarded else remote_addr
+
+
+class SharedBuckets:
+    """
+    Таблица корзин токенов в файле, отображённом в память (по умолчанию в `/dev/shm`), общая для всех
+    процессов-воркеров на машине.
+
+    Слот — (хеш ключа, токены, время обновления). Ключ ищется линейным пробированием в `PROBES` слотах, при
+    нехватке места вытесняется слот, который дольше всех не обновлялся. Доступ сериализуется `flock` между
+    процессами и `threading.Lock` между потоками одного процесса.
+    """
+
+    def __init__(self, path, slots):
+        self.path = path
+        self.slots = slots
+        self.lock = threading.Lock()
+
+        self.fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = slots * SLOT.size
+        if os.fstat(self.fd).st_size < size:
+            os.ftruncate(self.fd, size)
+        self.memory = mmap.mmap(self.fd, size)
+
+    @staticmethod
+    def key_hash(key):
+        return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), 'little') | 1
+
+    def find(self, key_hash):
+        start = key_hash % self.slots
+        victim = None
+
+        for probe in range(PROBES):
+            index = (start + probe) % self.slots
+            stored, tokens, updated = SLOT.unpack_from(self.memory, index * SLOT.size)
+            if stored == key_hash:
+                return index, tokens, updated
+            if stored == 0:
+                return index, None, None
+            if victim is None or updated < victim[1]:
+                victim = (index, updated)
+
+        return victim[0], None, None
+
+    def take(self, buckets, now=None):
+        """
+        Списывает по токену из каждой корзины `[(ключ, ёмкость, токенов в секунду)]`, только если токены есть во
+        всех. Возвращает 0, если запрос разрешён, иначе через сколько секунд повторить.
+        """
+        now = time.time() if now is None else now
+        wait = 0.0
+
+        with self.lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                states = []
+                for key, capacity, rate in buckets:
+                    key_hash = self.key_hash(key)
+                    index, tokens, updated = self.find(key_hash)
+                    if tokens is None:
+                        tokens = float(capacity)
+                    else:
+                        tokens = min(float(capacity), tokens + (now - updated) * rate)
+
+                    if tokens < 1:
+                        wait = max(wait, (1 - tokens) / rate)
+                    states.append((index, key_hash, tokens))
+
+                for index, key_hash, tokens in states:
+                    SLOT.pack_into(self.memory, index * SLOT.size, key_hash, tokens if wait else tokens - 1, now)
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+
+        return wait
+
+    def close(self):
+        self.memory.close()
+        os.close(self.fd)
+
+
+_buckets = None
+_buckets_lock = threading.Lock()
+
+
+def get_buckets():
+    global _buckets
+
+    path = getattr(settings, 'RATE_LIMIT_PATH', None) or os.path.join(
+        '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(), 'madadev-ratelimit')
+    slots = getattr(settings, 'RATE_LIMIT_SLOTS', 65536)
+
+    with _buckets_lock:
+        if _buckets is None or _buckets.path != path or _buckets.slots != slots:
+            if _buckets is not None:
+                _buckets.close()
+            _buckets = SharedBuckets(path, slots)
+        return _buckets
+
+
+def get_identifiers(request):
+    """
+    Значения, по которым ограничиваются запросы: IP клиента, имя пользователя (или почта) и uid из `code`.
+    Берутся из параметров и тела запроса без обращения к базе.
+    """
+    def value(name):
+        found = request.query_params.get(name)
+        if found is None:
+            try:
+                found = request.data.get(name)
+            except AttributeError:
+                found = None
+        return found if isinstance(found, str) and found else None
+
+    username = value('username') or value('email')
+    code = value('code')
+
+    return {
+        'ip': client_ip(request),
+        'username': username.strip().lower() if username else None,
+        'uid': code.split('/')[0] if code else None,
+    }
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Ограничение частоты действий вида по корзинам токенов из `SharedBuckets`. Лимиты задаются в
+    `RATE_LIMITS = {action: {'ip' | 'username' | 'uid': '10/min'}}`, действия без лимитов не ограничиваются.
+    """
+
+    def __init__(self):
+        self.retry_after = None
+
+    def allow_request(self, request, view):
+        action = getattr(view, 'action', None)
+        limits = get_rate_limits(action)
+        if not limits:
+            return True
+
+        identifiers = get_identifiers(request)
+        buckets = []
+        for kind, rate in limits.items():
+            if identifiers.get(kind):
+                capacity, per_second = parse_rate(rate)
+                buckets.append((f"{action}:{kind}:{identifiers[kind]}", capacity, per_second))
+
+        if not buckets:
+            return True
+
+        self.retry_after = get_buckets().take(buckets)
+        return not self.retry_after
+
+    def wait(self):
+        return self.retry_after
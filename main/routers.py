@@ -0,0 +1,85 @@
+import contextlib
+import contextvars
+import hashlib
+import random
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+from main.ratelimit import client_ip
+
+
+_state = contextvars.ContextVar('replica_state', default=None)
+
+
+def get_primary():
+    return getattr(settings, 'DATABASE_PRIMARY', DEFAULT_DB_ALIAS)
+
+
+def get_replicas():
+    return list(getattr(settings, 'DATABASE_REPLICAS', ()))
+
+
+def get_sticky_seconds():
+    return getattr(settings, 'REPLICA_STICKY_SECONDS', 5)
+
+
+def get_cache():
+    return caches[getattr(settings, 'REPLICA_PIN_CACHE', 'default')]
+
+
+def pin_key(request):
+    """
+    Ключ клиента для привязки к основной базе: токен или сессия, без них — IP.
+    """
+    credentials = request.META.get('HTTP_AUTHORIZATION') or request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    identity = f"credentials:{credentials}" if credentials else f"ip:{client_ip(request)}"
+    return "replica:pinned:" + hashlib.sha1(identity.encode()).hexdigest()
+
+
+@contextlib.contextmanager
+def reading(pinned=False):
+    """
+    Контекст чтения с реплик, его открывает `ReplicaPinMiddleware` на время запроса. Одна реплика выбирается
+    на весь контекст, чтобы запросы страницы не видели разное отставание. С `pinned` и после любой записи в
+    контексте все запросы идут в основную базу. Возвращает состояние с флагом `wrote`.
+    """
+    replicas = get_replicas()
+    state = {'replica': random.choice(replicas) if replicas else None, 'pinned': pinned, 'wrote': False}
+    token = _state.set(state)
+    try:
+        yield state
+    finally:
+        _state.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Запись — в основную базу `DATABASE_PRIMARY`, чтение — в одну из `DATABASE_REPLICAS` внутри контекста
+    `reading`. Вне его (команды, фоновые задачи) и у клиента, который недавно писал, чтение тоже идёт в
+    основную базу. Реплики не мигрируются, в тестах им нужен `'TEST': {'MIRROR': 'default'}`.
+    """
+
+    def db_for_read(self, model, **hints):
+        state = _state.get()
+        if state is None or state['replica'] is None or state['pinned'] or state['wrote']:
+            return get_primary()
+        return state['replica']
+
+    def db_for_write(self, model, **hints):
+        state = _state.get()
+        if state is not None:
+            state['wrote'] = True
+        return get_primary()
+
+    def allow_relation(self, obj1, obj2, **hints):
+        pool = {get_primary(), *get_replicas()}
+        if obj1._state.db in pool and obj2._state.db in pool:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in get_replicas():
+            return False
+        return None
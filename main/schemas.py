@@ -11,6 +11,24 @@ def basic() -> dict:
     return {"Basic": []}
 
 
+def sparse_fields(expandable=()):
+    parameters = [
+        openapi.Parameter('fields',
+                          openapi.IN_QUERY,
+                          description="Список полей через запятую, которые нужно вернуть",
+                          type=openapi.TYPE_STRING)
+    ]
+
+    if expandable:
+        parameters.append(openapi.Parameter('expand',
+                                            openapi.IN_QUERY,
+                                            description="Связанные объекты, которые нужно вложить в ответ: "
+                                                        + ", ".join(f"`{name}`" for name in expandable),
+                                            type=openapi.TYPE_STRING))
+
+    return parameters
+
+
 def get_status_unauthorized():
     return openapi.Schema(
         type=openapi.TYPE_OBJECT,
@@ -76,8 +94,12 @@ class UsersSchemas:
                               type=openapi.TYPE_INTEGER),
             openapi.Parameter('offset',
                               openapi.IN_QUERY,
-                              description="Сдвиг на число пользователей",
-                              type=openapi.TYPE_INTEGER)
+                              description="Сдвиг на число пользователей. Включает старый режим страниц с полем `count`",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('cursor',
+                              openapi.IN_QUERY,
+                              description="Курсор страницы пользователей из ссылок `next` и `previous`",
+                              type=openapi.TYPE_STRING)
         ]
 
     @staticmethod
@@ -87,7 +109,8 @@ class UsersSchemas:
                 type=openapi.TYPE_OBJECT,
                 properties={
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER,
-                                            description="Количество выданных пользователей в поле `results`"),
+                                            description="Количество выданных пользователей в поле `results`. "
+                                                        "Только в режиме `offset`"),
                     'next': openapi.Schema(type=openapi.TYPE_INTEGER,
                                            description="Номер следующий страницы с данными"),
                     'previous': openapi.Schema(type=openapi.TYPE_INTEGER,
@@ -119,6 +142,45 @@ class UsersSchemas:
             status.HTTP_403_FORBIDDEN: get_status_forbidden()
         }
 
+    @staticmethod
+    def send_export():
+        return [
+            openapi.Parameter('format',
+                              openapi.IN_QUERY,
+                              description="Формат выгрузки: `ndjson` (по умолчанию) или `csv`",
+                              type=openapi.TYPE_STRING,
+                              enum=['ndjson', 'csv']),
+            openapi.Parameter('is_email_verified',
+                              openapi.IN_QUERY,
+                              description="Только пользователи с подтверждённой (`true`) или неподтверждённой "
+                                          "(`false`) почтой",
+                              type=openapi.TYPE_BOOLEAN),
+            openapi.Parameter('date_joined_after',
+                              openapi.IN_QUERY,
+                              description="Зарегистрированные начиная с даты или даты и времени ISO 8601",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('date_joined_before',
+                              openapi.IN_QUERY,
+                              description="Зарегистрированные до даты (включительно) или даты и времени ISO 8601",
+                              type=openapi.TYPE_STRING)
+        ]
+
+    @staticmethod
+    def response_export():
+        return {
+            status.HTTP_200_OK: openapi.Schema(
+                type=openapi.TYPE_FILE,
+                description="Поток NDJSON или CSV с полями пользователя как в списке пользователей"
+            ),
+            status.HTTP_400_BAD_REQUEST: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING, description="Неверный формат или фильтр")
+                }),
+            status.HTTP_401_UNAUTHORIZED: get_status_unauthorized(),
+            status.HTTP_403_FORBIDDEN: get_status_forbidden()
+        }
+
     @staticmethod
     def fields_create():
         return openapi.Schema(
@@ -382,8 +444,25 @@ class ProductSchemas:
                               type=openapi.TYPE_INTEGER),
             openapi.Parameter('offset',
                               openapi.IN_QUERY,
-                              description="Сдвиг на число продуктов проекта",
-                              type=openapi.TYPE_INTEGER)
+                              description="Сдвиг на число продуктов проекта. Включает старый режим страниц с полем `count`",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('cursor',
+                              openapi.IN_QUERY,
+                              description="Курсор страницы продуктов проекта из ссылок `next` и `previous`",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('q',
+                              openapi.IN_QUERY,
+                              description="Полнотекстовый поиск по названию, тегу и описанию. Выдача "
+                                          "сортируется по релевантности и разбивается на страницы через `offset`",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('product_type',
+                              openapi.IN_QUERY,
+                              description="Только продукты категории с этим ID",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('tags',
+                              openapi.IN_QUERY,
+                              description="Только продукты со всеми перечисленными через запятую тегами",
+                              type=openapi.TYPE_STRING)
         ]
 
     @staticmethod
@@ -393,7 +472,8 @@ class ProductSchemas:
                 type=openapi.TYPE_OBJECT,
                 properties={
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER,
-                                            description="Количество выданных пользователей в поле `results`"),
+                                            description="Количество выданных пользователей в поле `results`. "
+                                                        "Только в режиме `offset`"),
                     'next': openapi.Schema(type=openapi.TYPE_INTEGER,
                                            description="Номер следующий страницы с данными"),
                     'previous': openapi.Schema(type=openapi.TYPE_INTEGER,
@@ -412,6 +492,17 @@ class ProductSchemas:
                                                                 description="URI к аватару пользователя"),
                                 'product_type_id': openapi.Schema(type=openapi.TYPE_INTEGER,
                                                                   description="IP при регистрации"),
+                                'product_type': openapi.Schema(
+                                    type=openapi.TYPE_OBJECT,
+                                    description="Категория продукта, только при `expand=product_type`",
+                                    properties={
+                                        'product_type_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                                        'product_type_name': openapi.Schema(type=openapi.TYPE_STRING),
+                                    }),
+                                'tags': openapi.Schema(
+                                    type=openapi.TYPE_ARRAY,
+                                    description="Теги продукта, только при `expand=tags`",
+                                    items=openapi.Schema(type=openapi.TYPE_STRING)),
                             })
                     )}
             ),
@@ -419,6 +510,44 @@ class ProductSchemas:
             status.HTTP_403_FORBIDDEN: get_status_forbidden()
         }
 
+    @staticmethod
+    def send_facets():
+        return [
+            openapi.Parameter('limit',
+                              openapi.IN_QUERY,
+                              description="Сколько самых частых тегов вернуть, по умолчанию 50",
+                              type=openapi.TYPE_INTEGER)
+        ]
+
+    @staticmethod
+    def response_facets():
+        return {
+            status.HTTP_200_OK: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'tags': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        description="Самые частые теги по убыванию количества продуктов",
+                        items=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+                            'tag_name': openapi.Schema(type=openapi.TYPE_STRING),
+                            'count': openapi.Schema(type=openapi.TYPE_INTEGER, description="Количество продуктов"),
+                        })),
+                    'product_types': openapi.Schema(
+                        type=openapi.TYPE_ARRAY,
+                        description="Все категории продуктов",
+                        items=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+                            'product_type_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                            'product_type_name': openapi.Schema(type=openapi.TYPE_STRING),
+                            'count': openapi.Schema(type=openapi.TYPE_INTEGER, description="Количество продуктов"),
+                        })),
+                }),
+            status.HTTP_400_BAD_REQUEST: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING, description="Неверный `limit`")
+                })
+        }
+
     @staticmethod
     def response_delete():
         return {
@@ -463,8 +592,12 @@ class ProductTypeSchemas:
                               type=openapi.TYPE_INTEGER),
             openapi.Parameter('offset',
                               openapi.IN_QUERY,
-                              description="Сдвиг на число категорий продуктов проекта",
-                              type=openapi.TYPE_INTEGER)
+                              description="Сдвиг на число категорий продуктов проекта. Включает старый режим страниц с полем `count`",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('cursor',
+                              openapi.IN_QUERY,
+                              description="Курсор страницы категорий продуктов проекта из ссылок `next` и `previous`",
+                              type=openapi.TYPE_STRING)
         ]
 
     @staticmethod
@@ -474,7 +607,8 @@ class ProductTypeSchemas:
                 type=openapi.TYPE_OBJECT,
                 properties={
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER,
-                                            description="Количество выданных категорий продуктов в поле `results`"),
+                                            description="Количество выданных категорий продуктов в поле `results`. "
+                                                        "Только в режиме `offset`"),
                     'next': openapi.Schema(type=openapi.TYPE_INTEGER,
                                            description="Номер следующий страницы с данными"),
                     'previous': openapi.Schema(type=openapi.TYPE_INTEGER,
@@ -544,10 +678,73 @@ class MiniNewsSchemas:
                               type=openapi.TYPE_INTEGER),
             openapi.Parameter('offset',
                               openapi.IN_QUERY,
-                              description="Сдвиг на число мини новостей",
-                              type=openapi.TYPE_INTEGER)
+                              description="Сдвиг на число мини новостей. Включает старый режим страниц с полем `count`",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('ordering',
+                              openapi.IN_QUERY,
+                              description="Порядок курсора: `mini_news_id`, `mn_date` или с минусом для обратного",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('cursor',
+                              openapi.IN_QUERY,
+                              description="Курсор страницы мини новостей из ссылок `next` и `previous`",
+                              type=openapi.TYPE_STRING),
+            openapi.Parameter('q',
+                              openapi.IN_QUERY,
+                              description="Полнотекстовый поиск по заголовку и описанию. Выдача сортируется по "
+                                          "релевантности и разбивается на страницы через `offset`",
+                              type=openapi.TYPE_STRING)
+        ] + MiniNewsSchemas.send_date_range()
+
+    @staticmethod
+    def send_date_range():
+        return [
+            openapi.Parameter('date_after',
+                              openapi.IN_QUERY,
+                              description="Только новости с этой даты (включительно), YYYY-MM-DD",
+                              type=openapi.TYPE_STRING,
+                              format=openapi.FORMAT_DATE),
+            openapi.Parameter('date_before',
+                              openapi.IN_QUERY,
+                              description="Только новости до этой даты (включительно), YYYY-MM-DD",
+                              type=openapi.TYPE_STRING,
+                              format=openapi.FORMAT_DATE)
         ]
 
+    @staticmethod
+    def send_latest():
+        return [
+            openapi.Parameter('n',
+                              openapi.IN_QUERY,
+                              description="Сколько последних новостей вернуть, по умолчанию 10, не больше 100",
+                              type=openapi.TYPE_INTEGER),
+            openapi.Parameter('format',
+                              openapi.IN_QUERY,
+                              description="`json` (по умолчанию), `rss` или `atom`. Также выбирается заголовком "
+                                          "`Accept`",
+                              type=openapi.TYPE_STRING,
+                              enum=['json', 'rss', 'atom'])
+        ] + MiniNewsSchemas.send_date_range()
+
+    @staticmethod
+    def response_latest():
+        return {
+            status.HTTP_200_OK: openapi.Schema(
+                type=openapi.TYPE_ARRAY,
+                description="Последние мини новости от новых к старым. Для `rss` и `atom` — лента в XML",
+                items=openapi.Schema(
+                    type=openapi.TYPE_OBJECT, properties={
+                        'mini_news_id': openapi.Schema(type=openapi.TYPE_INTEGER),
+                        'mn_title': openapi.Schema(type=openapi.TYPE_STRING),
+                        'mn_desc': openapi.Schema(type=openapi.TYPE_STRING),
+                        'mn_date': openapi.Schema(type=openapi.TYPE_STRING),
+                    })),
+            status.HTTP_400_BAD_REQUEST: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING, description="Неверный `n` или дата")
+                })
+        }
+
     @staticmethod
     def response_list():
         return {
@@ -555,7 +752,8 @@ class MiniNewsSchemas:
                 type=openapi.TYPE_OBJECT,
                 properties={
                     'count': openapi.Schema(type=openapi.TYPE_INTEGER,
-                                            description="Количество выданных мини новостей в поле `results`"),
+                                            description="Количество выданных мини новостей в поле `results`. "
+                                                        "Только в режиме `offset`"),
                     'next': openapi.Schema(type=openapi.TYPE_INTEGER,
                                            description="Номер следующий страницы с данными"),
                     'previous': openapi.Schema(type=openapi.TYPE_INTEGER,
@@ -587,3 +785,67 @@ class MiniNewsSchemas:
             status.HTTP_401_UNAUTHORIZED: get_status_unauthorized(),
             status.HTTP_403_FORBIDDEN: get_status_forbidden()
         }
+
+
+class BulkSchemas:
+    @staticmethod
+    def bulk_create_request():
+        return openapi.Schema(
+            type=openapi.TYPE_ARRAY,
+            description="Массив объектов с полями как при создании одного объекта, без изображений. У продуктов "
+                        "можно передать `tags` — список тегов, по умолчанию тег из `product_tag`. Также "
+                        "принимается `application/x-ndjson`: по объекту на строку",
+            items=openapi.Schema(type=openapi.TYPE_OBJECT))
+
+    @staticmethod
+    def bulk_create_response():
+        result = openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'created': openapi.Schema(type=openapi.TYPE_INTEGER, description="Количество созданных объектов"),
+                'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                      description="ID созданных объектов в порядке строк запроса"),
+                'errors': openapi.Schema(
+                    type=openapi.TYPE_ARRAY,
+                    description="Ошибки строк, которые не были созданы",
+                    items=openapi.Schema(type=openapi.TYPE_OBJECT, properties={
+                        'index': openapi.Schema(type=openapi.TYPE_INTEGER, description="Номер строки с нуля"),
+                        'errors': openapi.Schema(type=openapi.TYPE_OBJECT, description="Ошибки полей строки"),
+                    })),
+            })
+
+        return {
+            status.HTTP_201_CREATED: result,
+            status.HTTP_207_MULTI_STATUS: result,
+            status.HTTP_400_BAD_REQUEST: result,
+            status.HTTP_401_UNAUTHORIZED: get_status_unauthorized(),
+            status.HTTP_403_FORBIDDEN: get_status_forbidden()
+        }
+
+    @staticmethod
+    def bulk_delete_request():
+        return openapi.Schema(
+            type=openapi.TYPE_OBJECT,
+            properties={
+                'ids': openapi.Schema(type=openapi.TYPE_ARRAY, items=openapi.Schema(type=openapi.TYPE_INTEGER),
+                                      description="ID удаляемых объектов, также можно передать `?ids=1,2`")
+            },
+            required=['ids'])
+
+    @staticmethod
+    def bulk_delete_response():
+        return {
+            status.HTTP_200_OK: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'deleted': openapi.Schema(type=openapi.TYPE_INTEGER,
+                                              description="Количество удалённых строк, включая связанные")
+                }),
+            status.HTTP_400_BAD_REQUEST: openapi.Schema(
+                type=openapi.TYPE_OBJECT,
+                properties={
+                    'status': openapi.Schema(type=openapi.TYPE_STRING, description="Не передан список ID")
+                }),
+            status.HTTP_401_UNAUTHORIZED: get_status_unauthorized(),
+            status.HTTP_403_FORBIDDEN: get_status_forbidden()
+        }
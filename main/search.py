@@ -0,0 +1,184 @@
+import re
+
+from django.conf import settings
+from django.db import connections, router
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from main.models import Product, MiniNews
+
+
+MAX_TERMS = 16
+
+
+def terms(text):
+    """
+    Слова запроса в нижнем регистре. Операторы языков запросов FTS5 и tsquery не передаются, поэтому любой
+    ввод пользователя безопасен и ищет все слова сразу (AND).
+    """
+    return re.findall(r'\w+', text.lower())[:MAX_TERMS]
+
+
+class SearchIndex:
+    """
+    Полнотекстовый индекс модели по полям `fields` с весами `weights` для ранжирования (больше — важнее).
+    """
+
+    def __init__(self, name, model, fields, weights):
+        self.name = name
+        self.model = model
+        self.fields = fields
+        self.weights = weights
+
+    @property
+    def table(self):
+        return self.model._meta.db_table
+
+    @property
+    def pk(self):
+        return self.model._meta.pk.column
+
+    def columns(self):
+        return [self.model._meta.get_field(name).column for name in self.fields]
+
+
+class SQLiteBackend:
+    """
+    FTS5 с внешним содержимым: в индексе хранятся только токены, текст читается из таблицы модели. Индекс
+    обновляют триггеры на вставку, изменение и удаление, поэтому он не расходится с таблицей и при
+    `bulk_create`, `update()` и удалении без сигналов. Ранг — `bm25()` с весами полей.
+    """
+
+    def install(self, index, connection):
+        columns = index.columns()
+        listed = ", ".join(columns)
+        new = ", ".join(f"new.{column}" for column in columns)
+        old = ", ".join(f"old.{column}" for column in columns)
+        delete = f"INSERT INTO {index.name}({index.name}, rowid, {listed}) VALUES ('delete', old.{index.pk}, {old});"
+        insert = f"INSERT INTO {index.name}(rowid, {listed}) VALUES (new.{index.pk}, {new});"
+
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [index.name])
+            created = cursor.fetchone() is None
+
+            cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {index.name} USING fts5({listed}, "
+                           f"content='{index.table}', content_rowid='{index.pk}', "
+                           f"tokenize='unicode61 remove_diacritics 2')")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {index.name}_ai AFTER INSERT ON {index.table} "
+                           f"BEGIN {insert} END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {index.name}_ad AFTER DELETE ON {index.table} "
+                           f"BEGIN {delete} END")
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {index.name}_au AFTER UPDATE OF {listed} "
+                           f"ON {index.table} BEGIN {delete} {insert} END")
+
+            if created:
+                cursor.execute(f"INSERT INTO {index.name}({index.name}) VALUES ('rebuild')")
+
+    def search(self, queryset, index, words):
+        match = " ".join('"' + word.replace('"', '""') + '"' for word in words)
+        weights = ", ".join(str(float(weight)) for weight in index.weights)
+
+        queryset = queryset.extra(tables=[index.name],
+                                  where=[f"{index.name}.rowid = {index.table}.{index.pk}", f"{index.name} MATCH %s"],
+                                  params=[match])
+        # bm25 тем меньше, чем лучше совпадение
+        return queryset.order_by(RawSQL(f"bm25({index.name}, {weights})", [], output_field=FloatField()).asc(),
+                                 index.model._meta.pk.name)
+
+
+class PostgresBackend:
+    """
+    GIN-индекс по выражению `tsvector` от полей модели с весами `setweight`. PostgreSQL сам обновляет его при
+    любой записи в таблицу, отдельная колонка не нужна. Ранг — `ts_rank()`.
+    """
+    letters = 'ABCD'
+
+    def vector(self, index):
+        config = getattr(settings, 'SEARCH_CONFIG', 'simple')
+        weights = sorted(set(index.weights), reverse=True)
+
+        parts = []
+        for column, weight in zip(index.columns(), index.weights):
+            letter = self.letters[min(weights.index(weight), len(self.letters) - 1)]
+            parts.append(f"setweight(to_tsvector('{config}'::regconfig, coalesce({index.table}.{column}, '')), "
+                         f"'{letter}')")
+        return " || ".join(parts)
+
+    def query(self):
+        return f"plainto_tsquery('{getattr(settings, 'SEARCH_CONFIG', 'simple')}'::regconfig, %s)"
+
+    def install(self, index, connection):
+        with connection.cursor() as cursor:
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {index.name} ON {index.table} USING GIN (({self.vector(index)}))")
+
+    def search(self, queryset, index, words):
+        text = " ".join(words)
+        vector = self.vector(index)
+
+        queryset = queryset.filter(RawSQL(f"({vector}) @@ {self.query()}", [text], output_field=BooleanField()))
+        return queryset.order_by(RawSQL(f"ts_rank({vector}, {self.query()})", [text],
+                                        output_field=FloatField()).desc(),
+                                 index.model._meta.pk.name)
+
+
+class LikeBackend:
+    """
+    Для остальных баз: каждое слово ищется `icontains` в любом из полей, без индекса и ранжирования.
+    """
+
+    def install(self, index, connection):
+        pass
+
+    def search(self, queryset, index, words):
+        for word in words:
+            condition = Q()
+            for field in index.fields:
+                condition |= Q(**{f"{field}__icontains": word})
+            queryset = queryset.filter(condition)
+        return queryset
+
+
+BACKENDS = {
+    'sqlite': SQLiteBackend(),
+    'postgresql': PostgresBackend(),
+}
+
+INDEXES = [
+    SearchIndex('search_product', Product, ('product_title', 'product_tag', 'product_desc'), (10, 5, 1)),
+    SearchIndex('search_mini_news', MiniNews, ('mn_title', 'mn_desc'), (10, 1)),
+]
+
+
+def get_backend(connection):
+    return BACKENDS.get(connection.vendor, LikeBackend())
+
+
+def get_index(model):
+    for index in INDEXES:
+        if index.model is model:
+            return index
+    raise LookupError(f"No search index for {model.__name__}")
+
+
+def install(using):
+    """
+    Создаёт индексы `INDEXES` в базе `using`, если их ещё нет. Вызывается после `migrate`.
+    """
+    connection = connections[using]
+    backend = get_backend(connection)
+
+    for index in INDEXES:
+        if router.allow_migrate_model(using, index.model):
+            backend.install(index, connection)
+
+
+def search(queryset, text):
+    """
+    Оставляет в `queryset` объекты, в которых есть все слова `text`, и сортирует их по релевантности.
+    """
+    words = terms(text)
+    if not words:
+        return queryset.none()
+
+    index = get_index(queryset.model)
+    return get_backend(connections[queryset.db]).search(queryset, index, words)
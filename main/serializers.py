@@ -1,3 +1,7 @@
+from main import facets, ipfilter, hashing
+from main.metrics import TimedValidationMixin
+from main.mixins import DynamicFieldsSerializerMixin
+from main.uploads import HeaderImageField
 from main.models import User, Product, TypeProduct, MiniNews
 from MaDaDevAPI import settings
 
@@ -9,11 +13,11 @@ from django.db import models
 from rest_framework_simplejwt.tokens import AccessToken, RefreshToken
 
 
-class CreateUserSerializer(serializers.ModelSerializer):
+class CreateUserSerializer(TimedValidationMixin, serializers.ModelSerializer):
     id = serializers.IntegerField(read_only=True)
     username = serializers.CharField(max_length=255)
     password = serializers.CharField(max_length=255, write_only=True)
-    image = serializers.ImageField(max_length=255)
+    image = HeaderImageField(max_length=255)
     email = serializers.EmailField(max_length=128)
 
     def __init__(self, ip=None, *args, **kwargs):
@@ -28,39 +32,22 @@ class CreateUserSerializer(serializers.ModelSerializer):
                 raise serializers.ValidationError({"status": f'Size of image more then {settings.IMAGE_LIMIT_SIZE}MB'},
                                                   code='big_image')
 
-        try:
-            user = User.objects.get(models.Q(username=validated_data.get('username')) |
-                                    models.Q(email=validated_data.get('email')) |
-                                    models.Q(ip=self.ip) | models.Q(last_ip=self.ip))
-        except models.ObjectDoesNotExist:
-            pass
-        else:
-            if user.username == validated_data.get('username'):
-                key = "username"
-                param = user.username
-                status = "username is taken"
-            elif user.email == validated_data.get('email'):
-                key = "email"
-                param = user.username
-                status = "email is taken"
-            elif user.ip == self.ip or user.last_ip == self.ip:
-                key = "ip"
-                param = self.ip
-                status = "registration with an ip that already exists"
-
-            raise serializers.ValidationError({"status": status,
-                                               "user": {key: param}},
+        conflicts = ipfilter.find_registration_conflicts(validated_data.get('username'),
+                                                         validated_data.get('email'),
+                                                         self.ip)
+        if conflicts:
+            raise serializers.ValidationError({"status": conflicts[0]["status"],
+                                               "user": {conflicts[0]["key"]: conflicts[0]["param"]},
+                                               "conflicts": [{conflict["key"]: conflict["param"]}
+                                                             for conflict in conflicts]},
                                               code='username_or_email_exist')
 
+        extra_fields = {'ip': self.ip} if self.ip else {}
         user = User.objects.create_user(username=validated_data.get('username'),
                                         email=validated_data.get('email'),
                                         image=validated_data.get('image'),
-                                        password=validated_data.get('password'))
-
-        if self.ip:
-            user.ip = self.ip
-
-        user.save()
+                                        password=validated_data.get('password'),
+                                        **extra_fields)
 
         return user
 
@@ -70,9 +57,9 @@ class CreateUserSerializer(serializers.ModelSerializer):
                   'is_staff', 'is_superuser', 'date_joined', 'last_login']
 
 
-class UpdateUserSerializer(serializers.Serializer):  # noqa
+class UpdateUserSerializer(TimedValidationMixin, serializers.Serializer):  # noqa
     username = serializers.CharField(max_length=255, required=False)
-    image = serializers.ImageField(required=False)
+    image = HeaderImageField(required=False)
     is_staff = serializers.BooleanField(required=False)
     is_superuser = serializers.BooleanField(required=False)
 
@@ -88,8 +75,6 @@ class UpdateUserSerializer(serializers.Serializer):  # noqa
                                                                  f"then {settings.IMAGE_LIMIT_SIZE}MB"},
                                                       code='big_image')
 
-                instance.image.storage.delete(instance.image.path)
-
             elif attr == 'username':
                 try:
                     user = User.objects.get(username=value)
@@ -128,7 +113,7 @@ class UpdateUserSerializer(serializers.Serializer):  # noqa
         fields = ['username', 'email', 'image', 'is_staff', 'is_superuser']
 
 
-class LoginSerializer(serializers.Serializer):  # noqa
+class LoginSerializer(TimedValidationMixin, serializers.Serializer):  # noqa
     id = serializers.IntegerField(read_only=True)
     username = serializers.CharField(max_length=255)
     password = serializers.CharField(max_length=128, write_only=True)
@@ -171,7 +156,7 @@ class LoginSerializer(serializers.Serializer):  # noqa
         model = User
 
 
-class PasswordChangeSerializer(serializers.Serializer):  # noqa
+class PasswordChangeSerializer(TimedValidationMixin, serializers.Serializer):  # noqa
     old_password = serializers.CharField(max_length=128, write_only=True)
     new_password = serializers.CharField(max_length=128, write_only=True)
 
@@ -183,8 +168,8 @@ class PasswordChangeSerializer(serializers.Serializer):  # noqa
             raise serializers.ValidationError({"status": "old and new passwords is equal"},
                                               code="invalid_old_new_password")
 
-        if self.instance.check_password(old_password):
-            self.instance.set_password(new_password)
+        if hashing.check_password(old_password, self.instance.password):
+            hashing.set_password(self.instance, new_password)
             self.instance.save()
         else:
             raise serializers.ValidationError({"status": "invalid old password"}, code="invalid_old_password")
@@ -192,7 +177,7 @@ class PasswordChangeSerializer(serializers.Serializer):  # noqa
         return {"status": "ok"}
 
 
-class PasswordRecoverySerializer(serializers.Serializer):  # noqa
+class PasswordRecoverySerializer(TimedValidationMixin, serializers.Serializer):  # noqa
     username = serializers.CharField(max_length=255, required=False)
     email = serializers.CharField(max_length=255, required=False)
 
@@ -235,38 +220,74 @@ class PasswordRecoverySerializer(serializers.Serializer):  # noqa
         return self.user
 
 
-class ProductSerializer(serializers.Serializer):  # noqa
+class ProductTypeSerializer(TimedValidationMixin, DynamicFieldsSerializerMixin, serializers.Serializer):  # noqa
+    product_type_id = serializers.IntegerField(read_only=True)
+    product_type_name = serializers.CharField(max_length=128)
+
+    class Meta:
+        model = TypeProduct
+        fields = ['product_type_id', 'product_type_name']
+
+
+class TagListField(serializers.ListField):
+    """
+    Теги продукта: на входе список строк, которые приводятся к виду `main.facets.normalize_tags`, на выходе
+    имена тегов по алфавиту.
+    """
+    child = serializers.CharField(max_length=facets.MAX_TAG_LENGTH)
+
+    def to_internal_value(self, data):
+        return facets.normalize_tags(super().to_internal_value(data))
+
+    def to_representation(self, value):
+        return sorted(tag.tag_name for tag in value.all())
+
+
+class ProductSerializer(TimedValidationMixin, DynamicFieldsSerializerMixin, serializers.Serializer):  # noqa
     product_id = serializers.IntegerField(read_only=True)
     product_title = serializers.CharField(max_length=128)
     product_tag = serializers.CharField(max_length=64)
     product_desc = serializers.CharField()
-    product_image = serializers.ImageField()
+    product_image = HeaderImageField()
     product_type_id = serializers.IntegerField()
+    product_type = ProductTypeSerializer(read_only=True)
+    tags = TagListField(required=False)
+
+    @staticmethod
+    def get_bulk_context(rows):
+        """
+        Существующие `product_type_id` пакета строк одним запросом, по ним проверяет `validate`.
+        """
+        requested = set()
+        for row in rows:
+            try:
+                requested.add(int(row.get("product_type_id")))
+            except (AttributeError, TypeError, ValueError):
+                continue
+
+        return {'product_type_ids': set(TypeProduct.objects.filter(product_type_id__in=requested)
+                                        .values_list('product_type_id', flat=True))}
 
     def validate(self, data):
         product_type_id = data.get("product_type_id", None)
-        try:
-            type_product = TypeProduct.objects.get(product_type_id=product_type_id)
-        except models.ObjectDoesNotExist:
-            raise serializers.ValidationError({"status": "Type product ID not exists"})
+        known = self.context.get('product_type_ids')
+
+        if known is not None:
+            exists = product_type_id in known
         else:
-            return True
+            exists = TypeProduct.objects.filter(product_type_id=product_type_id).exists()
+
+        if not exists:
+            raise serializers.ValidationError({"status": "Type product ID not exists"})
+        return data
 
     class Meta:
         model = Product
         fields = ['product_id', 'product_title', 'product_tag', 'product_desc', 'product_desc', 'product_type_id']
+        expandable_fields = ['product_type', 'tags']
 
 
-class ProductTypeSerializer(serializers.Serializer):  # noqa
-    product_type_id = serializers.IntegerField(read_only=True)
-    product_type_name = serializers.CharField(max_length=128)
-
-    class Meta:
-        model = TypeProduct
-        fields = ['product_type_id', 'product_type_name']
-
-
-class MiniNewsSerializer(serializers.Serializer):  # noqa
+class MiniNewsSerializer(TimedValidationMixin, DynamicFieldsSerializerMixin, serializers.Serializer):  # noqa
     mini_news_id = serializers.IntegerField(read_only=True)
     mn_title = serializers.CharField(max_length=128)
     mn_desc = serializers.CharField(max_length=128)
@@ -0,0 +1,109 @@
+from django.db.backends.signals import connection_created
+from django.db.models import FileField
+from django.db.models.signals import post_init, post_save, post_delete, post_migrate, pre_delete
+from django.dispatch import receiver
+
+from main import caching, facets, media, search
+from main.authentication import invalidate_user
+from main.middleware import instrument
+from main.ipfilter import registered_ips
+from main.models import User, Product, TypeProduct, MiniNews
+
+
+@receiver(post_save, sender=User)
+def remember_registration_ip(sender, instance, **kwargs):
+    registered_ips.add(instance.ip, instance.last_ip)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # Любая запись пользователя (админка, ORM, API) сбрасывает его копию в кэше аутентификации
+    invalidate_user(instance.pk)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+    caching.invalidate('products', instance.pk)
+
+
+@receiver(post_init, sender=Product)
+def remember_product_type(sender, instance, **kwargs):
+    # При `.only()` без категории или тега прежнее значение неизвестно, их смену у такой копии не учитываем
+    instance._facet_type_id = instance.__dict__.get('product_type_id')
+    instance._facet_tag = instance.__dict__.get('product_tag')
+
+
+@receiver(post_save, sender=Product)
+def count_product(sender, instance, created, **kwargs):
+    previous = instance._facet_type_id
+    if created:
+        facets.move_product(None, instance.product_type_id)
+    elif previous is not None and previous != instance.product_type_id:
+        facets.move_product(previous, instance.product_type_id)
+    instance._facet_type_id = instance.product_type_id
+
+    # Тег из `product_tag` связывается с продуктом так же, как при массовой загрузке без `tags`
+    previous = instance._facet_tag
+    if created:
+        facets.retag_product(instance, None, instance.product_tag)
+    elif previous is not None:
+        facets.retag_product(instance, previous, instance.product_tag)
+    instance._facet_tag = instance.product_tag
+
+
+@receiver(pre_delete, sender=Product)
+def forget_product(sender, instance, **kwargs):
+    facets.forget_products(Product.objects.filter(pk=instance.pk))
+
+
+def image_names(instance):
+    # Поля, не загруженные из базы (`.only()`), не учитываются: их прежнее значение неизвестно
+    return {field.attname: getattr(instance, field.attname).name for field in instance._meta.fields
+            if isinstance(field, FileField) and field.attname in instance.__dict__}
+
+
+@receiver(post_init, sender=User)
+@receiver(post_init, sender=Product)
+def remember_images(sender, instance, **kwargs):
+    instance._stored_images = image_names(instance)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_save, sender=Product)
+def release_replaced_images(sender, instance, created, **kwargs):
+    current = image_names(instance)
+    if not created:
+        media.release([name for attname, name in instance._stored_images.items()
+                       if attname in current and current[attname] != name])
+    instance._stored_images = current
+
+
+@receiver(post_delete, sender=User)
+@receiver(post_delete, sender=Product)
+def release_images(sender, instance, **kwargs):
+    media.release(image_names(instance).values())
+
+
+@receiver(post_save, sender=TypeProduct)
+@receiver(post_delete, sender=TypeProduct)
+def invalidate_product_type(sender, instance, **kwargs):
+    caching.invalidate('product_types', instance.pk)
+
+
+@receiver(post_save, sender=MiniNews)
+@receiver(post_delete, sender=MiniNews)
+def invalidate_mini_news(sender, instance, **kwargs):
+    caching.invalidate('mini_news', instance.pk)
+
+
+@receiver(post_migrate)
+def install_search_indexes(sender, app_config, using, **kwargs):
+    if app_config.name == 'main':
+        search.install(using)
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    instrument(connection)
@@ -1,3 +1,1627 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import tracemalloc
+from concurrent.futures import Future
+from unittest import mock
 
-# Create your tests here.
+from PIL import Image
+
+from asgiref.sync import async_to_sync
+
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+from django.core.cache import cache, caches
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import MemoryFileUploadHandler, TemporaryFileUploadHandler
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections
+from django.db.utils import load_backend
+from django.test import AsyncRequestFactory, SimpleTestCase, TestCase, modify_settings, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient, APIRequestFactory
+
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import AccessToken
+
+from MaDaDevAPI import openapi
+from main import ipfilter, hashing, authentication, ratelimit, benchmarks, metrics, middleware, querybudget, search, \
+    facets, routers, dbpool, media
+from main.authentication import CachedJWTAuthentication
+from main.backends import PooledModelBackend
+from main.models import User, Product, TypeProduct, MiniNews, Tag, ProductTag, StoredImage
+from main.serializers import CreateUserSerializer, PasswordChangeSerializer, UpdateUserSerializer, \
+    ProductTypeSerializer
+from main.uploads import LimitedImageUploadHandler
+from main.views import ProductAPIView, ProductTypeAPIView, MiniNewsAPIView, UsersViewSet
+
+
+@override_settings(REGISTRATION_IP_FILTER_BACKGROUND=False)
+class RegistrationConflictTests(TestCase):
+    def setUp(self):
+        ipfilter.registered_ips.reset()
+        User.objects.create_user(username="first", email="first@madadev.ru", password="password", ip="10.0.0.1")
+        User.objects.create_user(username="second", email="second@madadev.ru", password="password", ip="10.0.0.2")
+
+    def test_unknown_ip_is_excluded_by_filter(self):
+        self.assertFalse(ipfilter.registered_ips.might_contain("10.0.0.3"))
+        self.assertTrue(ipfilter.registered_ips.might_contain("10.0.0.1"))
+
+    def test_all_conflicts_reported(self):
+        conflicts = ipfilter.find_registration_conflicts("first", "second@madadev.ru", "10.0.0.2")
+
+        self.assertEqual([conflict["key"] for conflict in conflicts], ["username", "email", "ip"])
+
+    def test_serializer_reports_conflicts(self):
+        serializer = CreateUserSerializer(ip="10.0.0.1")
+
+        with self.assertRaises(ValidationError) as context:
+            serializer.create({"username": "third", "password": "password", "email": "third@madadev.ru"})
+
+        self.assertEqual(context.exception.detail["conflicts"], [{"ip": "10.0.0.1"}])
+
+    def test_new_user_is_added_to_filter(self):
+        ipfilter.registered_ips.might_contain("10.0.0.1")
+        User.objects.create_user(username="third", email="third@madadev.ru", password="password", ip="10.0.0.9")
+
+        self.assertTrue(ipfilter.registered_ips.might_contain("10.0.0.9"))
+
+    def test_registration_ip_is_read_behind_trusted_proxy(self):
+        request = APIRequestFactory().post("/api/v1/users/", REMOTE_ADDR="10.0.0.254",
+                                           HTTP_X_FORWARDED_FOR="203.0.113.5")
+
+        with self.settings(TRUSTED_PROXIES=["10.0.0.254"]):
+            self.assertEqual(UsersViewSet.get_ip(request), "203.0.113.5")
+
+    @override_settings(REGISTRATION_IP_FILTER_REFRESH=0)
+    def test_address_changed_elsewhere_is_loaded(self):
+        ipfilter.registered_ips.might_contain("10.0.0.1")
+        # Другой процесс: сигналы этого процесса изменения не видят
+        User.objects.filter(username="second").update(last_ip="10.0.0.7", updated_at=timezone.now())
+
+        self.assertTrue(ipfilter.registered_ips.might_contain("10.0.0.7"))
+
+    @override_settings(REGISTRATION_IP_FILTER_REFRESH=0)
+    def test_refresh_queries_without_lock(self):
+        filter_ = ipfilter.registered_ips
+        filter_.might_contain("10.0.0.1")
+        rows = filter_._rows
+        locked = []
+
+        def checked_rows(queryset):
+            locked.append(filter_.lock.locked())
+            return rows(queryset)
+
+        with mock.patch.object(filter_, '_rows', checked_rows):
+            User.objects.filter(username="second").update(ip="10.0.0.8", updated_at=timezone.now())
+            self.assertTrue(filter_.might_contain("10.0.0.8"))
+
+        self.assertEqual(locked, [False])
+
+    def test_filter_is_unknown_while_building_in_background(self):
+        with override_settings(REGISTRATION_IP_FILTER_BACKGROUND=True), \
+                mock.patch.object(threading.Thread, 'start') as start:
+            self.assertTrue(ipfilter.registered_ips.might_contain("10.0.0.3"))
+            self.assertTrue(ipfilter.registered_ips.might_contain("10.0.0.3"))
+
+        start.assert_called_once()
+
+
+class CatalogPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        type_product = TypeProduct.objects.create(product_type_name="Type")
+        Product.objects.bulk_create([Product(product_title=f"Product {number}", product_type=type_product)
+                                     for number in range(5)])
+
+    def test_cursor_mode_does_not_count(self):
+        response = self.client.get("/api/v1/products/", {"limit": 2})
+
+        self.assertNotIn("count", response.data)
+        self.assertEqual(len(response.data["results"]), 2)
+
+        following = self.client.get(response.data["next"])
+        self.assertEqual([product["product_title"] for product in following.data["results"]],
+                         ["Product 2", "Product 3"])
+
+    def test_offset_mode_is_kept(self):
+        response = self.client.get("/api/v1/products/", {"limit": 2, "offset": 4})
+
+        self.assertEqual(response.data["count"], 5)
+        self.assertEqual(len(response.data["results"]), 1)
+
+
+class SparseFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        type_product = TypeProduct.objects.create(product_type_name="Type")
+        Product.objects.bulk_create([Product(product_title=f"Product {number}", product_type=type_product)
+                                     for number in range(3)])
+
+    def test_fields_select_only_requested_columns(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/v1/products/", {"fields": "product_id,product_title"})
+
+        self.assertEqual(set(response.data["results"][0]), {"product_id", "product_title"})
+        self.assertNotIn("product_desc", queries[-1]["sql"])
+
+    def test_expand_product_type_uses_one_join(self):
+        with self.assertNumQueries(1):
+            response = self.client.get("/api/v1/products/", {"fields": "product_title", "expand": "product_type"})
+
+        self.assertEqual(response.data["results"][0]["product_type"]["product_type_name"], "Type")
+
+    def test_unknown_field_is_rejected(self):
+        response = self.client.get("/api/v1/products/", {"fields": "password"})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class FastReadTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        type_product = TypeProduct.objects.create(product_type_name="Type")
+        Product.objects.create(product_title="Plug", product_type=type_product)
+        Product.objects.create(product_title="Image", product_type=type_product,
+                               product_image="images/products/picture.png")
+        MiniNews.objects.create(mn_title="News", mn_desc="Description")
+
+    def assertSameResponse(self, url, params):
+        fast = self.client.get(url, params)
+        slow = self.client.get(url, dict(params, fast="0"))
+
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_products_are_identical(self):
+        self.assertSameResponse("/api/v1/products/", {})
+        self.assertSameResponse("/api/v1/products/", {"offset": 0, "limit": 10})
+        self.assertSameResponse("/api/v1/products/", {"fields": "product_image", "expand": "product_type"})
+
+    def test_product_image_is_absolute(self):
+        response = self.client.get("/api/v1/products/")
+
+        self.assertTrue(response.data["results"][1]["product_image"].startswith("http://testserver/"))
+
+    def test_types_and_news_are_identical(self):
+        self.assertSameResponse("/api/v1/product_types/", {})
+        self.assertSameResponse("/api/v1/mini_news/", {"ordering": "-mn_date"})
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.type_product = TypeProduct.objects.create(product_type_name="Type")
+        self.product = Product.objects.create(product_title="Product", product_type=self.type_product)
+
+    def test_second_read_is_served_from_cache(self):
+        self.client.get("/api/v1/products/")
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/v1/products/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("ETag", response)
+
+    def test_if_none_match_returns_not_modified(self):
+        etag = self.client.get("/api/v1/products/")["ETag"]
+
+        response = self.client.get("/api/v1/products/", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_if_modified_since_returns_not_modified(self):
+        last_modified = self.client.get(f"/api/v1/products/{self.product.pk}/")["Last-Modified"]
+
+        response = self.client.get(f"/api/v1/products/{self.product.pk}/", HTTP_IF_MODIFIED_SINCE=last_modified)
+
+        self.assertEqual(response.status_code, 304)
+
+    def test_write_invalidates_only_affected_entries(self):
+        self.client.get("/api/v1/products/")
+        self.client.get("/api/v1/product_types/")
+
+        self.product.product_title = "Renamed"
+        self.product.save()
+
+        self.assertEqual(self.client.get("/api/v1/products/").data["results"][0]["product_title"], "Renamed")
+        with self.assertNumQueries(0):
+            self.client.get("/api/v1/product_types/")
+
+    def test_type_change_invalidates_expanded_products(self):
+        self.client.get("/api/v1/products/", {"expand": "product_type"})
+
+        self.type_product.product_type_name = "Renamed"
+        self.type_product.save()
+
+        response = self.client.get("/api/v1/products/", {"expand": "product_type"})
+        self.assertEqual(response.data["results"][0]["product_type"]["product_type_name"], "Renamed")
+
+
+class OpenAPIArtifactTests(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.addCleanup(openapi.reset)
+        openapi.reset()
+
+        self.user = User.objects.create_user(username="reader", email="reader@madadev.ru", password="password")
+        self.client.force_login(self.user)
+
+    def test_schema_is_served_precompressed_with_etag(self):
+        with override_settings(OPENAPI_SCHEMA_DIR=self.directory):
+            call_command('build_schema', stdout=io.StringIO())
+            response = self.client.get("/api/docs/", {"format": "openapi"}, HTTP_ACCEPT_ENCODING="gzip")
+            cached = self.client.get("/api/docs/", {"format": "openapi"}, HTTP_IF_NONE_MATCH=response["ETag"])
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertIn("max-age", response["Cache-Control"])
+        self.assertIn(b'"/api/v1/products/"', gzip.decompress(response.content))
+        self.assertEqual(cached.status_code, 304)
+
+    def test_gzip_respects_quality_values(self):
+        with override_settings(OPENAPI_SCHEMA_DIR=self.directory):
+            call_command('build_schema', stdout=io.StringIO())
+            for accept_encoding, compressed in (("gzip;q=0, identity", False), ("br, *;q=0.5", True),
+                                                ("*, gzip;q=0", False), ("deflate", False),
+                                                ("GZIP; q=0.8", True), ("gzip;q=abc", False)):
+                with self.subTest(accept_encoding=accept_encoding):
+                    response = self.client.get("/api/docs/", {"format": "openapi"},
+                                               HTTP_ACCEPT_ENCODING=accept_encoding)
+
+                    self.assertEqual(response.has_header("Content-Encoding"), compressed)
+                    self.assertIn("Accept-Encoding", response["Vary"])
+
+        self.assertIn("Accept-Encoding", self.client.get("/api/docs/")["Vary"])
+
+    def test_check_fails_on_stale_artifact(self):
+        call_command('build_schema', output=self.directory, stdout=io.StringIO())
+        call_command('build_schema', output=self.directory, check=True, stdout=io.StringIO())
+
+        with open(os.path.join(self.directory, 'openapi.json'), 'ab') as file:
+            file.write(b" ")
+
+        with self.assertRaises(CommandError):
+            call_command('build_schema', output=self.directory, check=True, stdout=io.StringIO())
+
+
+class StreamingBody(io.RawIOBase):
+    """
+    Тело multipart-запроса, которое генерируется по мере чтения и не хранится в памяти целиком.
+    """
+
+    def __init__(self, prefix, filler_size, suffix):
+        self.parts = [prefix, filler_size, suffix]
+        self.length = len(prefix) + filler_size + len(suffix)
+        self.position = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        prefix, filler_size, suffix = self.parts
+        chunk = bytearray()
+
+        while len(chunk) < len(buffer) and self.position < self.length:
+            if self.position < len(prefix):
+                piece = prefix[self.position:self.position + len(buffer) - len(chunk)]
+            elif self.position < len(prefix) + filler_size:
+                piece = b"\0" * min(len(buffer) - len(chunk), len(prefix) + filler_size - self.position)
+            else:
+                offset = self.position - len(prefix) - filler_size
+                piece = suffix[offset:offset + len(buffer) - len(chunk)]
+            chunk += piece
+            self.position += len(piece)
+
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+
+
+def png_bytes(size=(10, 10), mode='RGB', color=0):
+    buffer = io.BytesIO()
+    Image.new(mode, size, color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+@override_settings(IMAGE_LIMIT_SIZE=1)
+class ImageUploadLimitTests(TestCase):
+    boundary = "madadevboundary"
+
+    def streaming_request(self, filler_size):
+        prefix = (f"--{self.boundary}\r\nContent-Disposition: form-data; name=\"image\"; filename=\"a.png\"\r\n"
+                  f"Content-Type: image/png\r\n\r\n").encode() + png_bytes()
+        suffix = f"\r\n--{self.boundary}--\r\n".encode()
+        body = StreamingBody(prefix, filler_size, suffix)
+
+        request = WSGIRequest({
+            'REQUEST_METHOD': 'POST', 'PATH_INFO': '/', 'SERVER_NAME': 'testserver', 'SERVER_PORT': '80',
+            'wsgi.url_scheme': 'http', 'CONTENT_TYPE': f"multipart/form-data; boundary={self.boundary}",
+            'CONTENT_LENGTH': str(body.length), 'wsgi.input': body,
+        })
+        request.upload_handlers = [LimitedImageUploadHandler(request, ('image',)),
+                                   MemoryFileUploadHandler(request), TemporaryFileUploadHandler(request)]
+        return request, body
+
+    def parse_with_memory(self, request):
+        tracemalloc.start()
+        try:
+            request.FILES  # noqa
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    @override_settings(IMAGE_UPLOAD_OVERHEAD=1024 * 1024 * 1024)
+    def test_oversized_stream_is_aborted_early(self):
+        request, body = self.streaming_request(64 * 1024 * 1024)
+
+        peak = self.parse_with_memory(request)
+
+        self.assertEqual(request.upload_errors["image"][0], "big_image")
+        self.assertNotIn("image", request.FILES)
+        self.assertLess(body.position, 2 * 1024 * 1024)
+        self.assertLess(peak, 4 * 1024 * 1024)
+
+    def test_oversized_content_length_is_not_read(self):
+        request, body = self.streaming_request(64 * 1024 * 1024)
+
+        peak = self.parse_with_memory(request)
+
+        self.assertEqual(request.upload_errors["__all__"][0], "big_image")
+        self.assertEqual(body.position, 0)
+        self.assertLess(peak, 1024 * 1024)
+
+    def test_malformed_image_is_rejected(self):
+        response = self.client.post("/api/v1/users/", {
+            "username": "user", "password": "password", "email": "user@madadev.ru",
+            "image": SimpleUploadedFile("a.png", b"not an image" * 1000, content_type="image/png"),
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("valid image", response.data["status"])
+
+    @override_settings(IMAGE_MAX_PIXELS=1_000_000)
+    def test_decompression_bomb_is_rejected_by_header(self):
+        response = self.client.post("/api/v1/users/", {
+            "username": "user", "password": "password", "email": "user@madadev.ru",
+            "image": SimpleUploadedFile("a.png", png_bytes((5000, 5000), '1'), content_type="image/png"),
+        })
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("5000x5000", response.data["status"])
+
+    def test_valid_image_is_accepted(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        with self.settings(MEDIA_ROOT=media_root):
+            response = self.client.post("/api/v1/users/", {
+                "username": "user", "password": "password", "email": "user@madadev.ru",
+                "image": SimpleUploadedFile("a.png", png_bytes(), content_type="image/png"),
+            })
+
+        self.assertEqual(response.status_code, 201)
+        self.assertRegex(User.objects.get(username="user").image.name, r"^images/users/[0-9a-f]{32}\.png$")
+
+
+class PasswordHashingPoolTests(TestCase):
+    def setUp(self):
+        self.pool = hashing.configure(workers=2, queue_size=1)
+        self.addCleanup(hashing.configure, 0, 0)
+        self.user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+
+    def test_pool_checks_and_makes_passwords(self):
+        encoded = hashing.make_password("secret")
+
+        self.assertTrue(hashing.check_password("secret", encoded))
+        self.assertFalse(hashing.check_password("wrong", encoded))
+        self.assertGreaterEqual(hashing.hash_latency.get(operation="check_password")["count"], 2)
+        self.assertEqual(hashing.hash_queue_depth.get(), 0)
+
+    def test_full_queue_is_rejected(self):
+        for _ in range(3):
+            self.pool.slots.acquire()
+        self.addCleanup(lambda: [self.pool.slots.release() for _ in range(3)])
+
+        with self.assertRaises(hashing.HashingQueueFull):
+            hashing.check_password("password", self.user.password)
+
+    def test_backend_authenticates_through_pool(self):
+        backend = PooledModelBackend()
+
+        self.assertEqual(backend.authenticate(None, username="user", password="password"), self.user)
+        self.assertIsNone(backend.authenticate(None, username="user", password="wrong"))
+        self.assertIsNone(backend.authenticate(None, username="nobody", password="password"))
+
+    def test_backend_is_awaitable(self):
+        backend = PooledModelBackend()
+
+        user = async_to_sync(backend.aauthenticate)(None, username="user", password="password")
+
+        self.assertEqual(user, self.user)
+
+    def test_backends_upgrade_outdated_hashes(self):
+        backend = PooledModelBackend()
+        hasher = PBKDF2PasswordHasher()
+
+        for authenticate in (backend.authenticate, async_to_sync(backend.aauthenticate)):
+            User.objects.filter(pk=self.user.pk).update(
+                password=hasher.encode("password", hasher.salt(), iterations=1000))
+
+            self.assertEqual(authenticate(None, username="user", password="password"), self.user)
+            self.user.refresh_from_db()
+            self.assertFalse(hasher.must_update(self.user.password))
+            self.assertTrue(self.user.check_password("password"))
+
+    @override_settings(PASSWORD_HASHING_TIMEOUT=0.01)
+    def test_hashing_timeout_is_unavailable(self):
+        with mock.patch.object(self.pool, 'submit', return_value=Future()):
+            with self.assertRaises(hashing.HashingQueueFull):
+                hashing.check_password("password", self.user.password)
+            with self.assertRaises(hashing.HashingQueueFull):
+                async_to_sync(hashing.acheck_password)("password", self.user.password)
+
+    def test_password_change_uses_pool(self):
+        serializer = PasswordChangeSerializer(instance=self.user, data={"old_password": "password",
+                                                                         "new_password": "changed"})
+
+        self.assertTrue(serializer.is_valid())
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.check_password("changed"))
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+        self.backend = CachedJWTAuthentication()
+        self.request = APIRequestFactory().get("/api/v1/users/",
+                                               HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.user)}")
+
+    def authenticate(self):
+        return self.backend.authenticate(self.request)[0]
+
+    def test_user_is_loaded_once(self):
+        hits = authentication.user_cache_requests.get(result='hit')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.authenticate(), self.user)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.authenticate(), self.user)
+
+        self.assertEqual(authentication.user_cache_requests.get(result='hit'), hits + 1)
+
+    def test_cached_user_has_no_password_hash(self):
+        self.authenticate()
+        hashed = self.user.password
+
+        self.assertFalse([value for value in cache._cache.values() if hashed.encode() in value])
+        with self.assertNumQueries(0):
+            user = self.authenticate()
+        self.assertEqual((user.username, user.email, user.is_active), ("user", "user@madadev.ru", True))
+
+        user.is_staff = True
+        user.save()
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.is_staff)
+        self.assertEqual(self.user.password, hashed)
+        self.assertTrue(user.check_password("password"))
+
+    def test_account_change_invalidates_user(self):
+        self.authenticate()
+
+        serializer = UpdateUserSerializer(instance=self.user, data={"is_staff": True}, partial=True)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.authenticate().is_staff)
+
+    def test_deactivation_takes_effect_immediately(self):
+        self.authenticate()
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate()
+
+        admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password")
+        client = APIClient()
+        client.force_authenticate(admin)
+        response = client.delete(f"/api/v1/users/{self.user.pk}/")
+
+        self.assertEqual(response.status_code, 204)
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class RateLimitTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, "buckets")
+        limits = {'login': {'ip': '100/min', 'username': '2/min'}, 'activate': {'uid': '1/hour'}}
+        override = override_settings(RATE_LIMIT_PATH=self.path, RATE_LIMIT_SLOTS=64, RATE_LIMITS=limits)
+        override.enable()
+        self.addCleanup(override.disable)
+        patcher = mock.patch.object(ratelimit, '_forwarding_warned', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_refills_over_time(self):
+        buckets = ratelimit.get_buckets()
+        limit = [("key", 2, 1.0)]
+
+        self.assertEqual(buckets.take(limit, now=100.0), 0)
+        self.assertEqual(buckets.take(limit, now=100.0), 0)
+        self.assertAlmostEqual(buckets.take(limit, now=100.0), 1.0)
+        self.assertEqual(buckets.take(limit, now=101.0), 0)
+
+    def test_state_is_shared_between_processes(self):
+        other = ratelimit.SharedBuckets(self.path, 64)
+        self.addCleanup(other.close)
+        limit = [("key", 1, 0.001)]
+
+        self.assertEqual(ratelimit.get_buckets().take(limit, now=100.0), 0)
+        self.assertGreater(other.take(limit, now=100.0), 0)
+
+    def test_rejected_bucket_does_not_spend_other_buckets(self):
+        buckets = ratelimit.get_buckets()
+
+        buckets.take([("a", 1, 0.001)], now=100.0)
+        self.assertGreater(buckets.take([("b", 1, 0.001), ("a", 1, 0.001)], now=100.0), 0)
+        self.assertEqual(buckets.take([("b", 1, 0.001)], now=100.0), 0)
+
+    def test_login_is_limited_by_username_before_database(self):
+        for _ in range(2):
+            self.client.get("/api/v1/auth/login/", {"username": "victim"})
+
+        with self.assertNumQueries(0):
+            response = self.client.get("/api/v1/auth/login/", {"username": "Victim"})
+
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertNotEqual(self.client.get("/api/v1/auth/login/", {"username": "other"}).status_code, 429)
+
+    @override_settings(RATE_LIMITS={'login': {'ip': '2/min'}})
+    def test_spoofed_forwarded_for_does_not_reset_bucket(self):
+        with self.assertLogs('main.ratelimit', 'WARNING') as logs:
+            for number in range(2):
+                self.client.get("/api/v1/auth/login/", {"username": f"user{number}"},
+                                HTTP_X_FORWARDED_FOR=f"198.51.100.{number}")
+
+            response = self.client.get("/api/v1/auth/login/", {"username": "user2"},
+                                       HTTP_X_FORWARDED_FOR="198.51.100.2")
+
+        self.assertEqual(response.status_code, 429)
+        # Запрос от внутреннего адреса с `X-Forwarded-For` без `TRUSTED_PROXIES`: одно предупреждение на процесс
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("TRUSTED_PROXIES is not set", logs.output[0])
+
+    def test_forwarded_for_is_read_behind_trusted_proxy(self):
+        request = APIRequestFactory().get("/", REMOTE_ADDR="10.0.0.1",
+                                          HTTP_X_FORWARDED_FOR="203.0.113.9, 198.51.100.7, 10.0.0.2")
+
+        with self.assertLogs('main.ratelimit', 'WARNING'):
+            self.assertEqual(ratelimit.client_ip(request), "10.0.0.1")
+        with self.settings(TRUSTED_PROXIES=["10.0.0.0/8"]):
+            self.assertEqual(ratelimit.client_ip(request), "198.51.100.7")
+            request.META['REMOTE_ADDR'] = "192.0.2.1"
+            self.assertEqual(ratelimit.client_ip(request), "192.0.2.1")
+
+    def test_activation_is_limited_by_uid(self):
+        self.client.post("/user/token/activate/", {"status": "confirm", "code": "MQ/token"})
+
+        with self.assertNumQueries(0):
+            response = self.client.post("/user/token/activate/", {"status": "confirm", "code": "MQ/other"})
+
+        self.assertEqual(response.status_code, 429)
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.type_product = TypeProduct.objects.create(product_type_name="Type")
+        self.products = [Product.objects.create(product_title=f"Product {number}", product_type=self.type_product)
+                         for number in range(5)]
+        MiniNews.objects.create(mn_title="News", mn_desc="Description")
+
+    def get_view(self, view_class, actions, use_async):
+        with override_settings(CATALOG_ASYNC_VIEWS=use_async):
+            return view_class.as_view(actions)
+
+    def compare(self, view_class, path, query=None, **kwargs):
+        actions = {'get': 'retrieve'} if kwargs else {'get': 'list'}
+        sync_view = self.get_view(view_class, actions, False)
+        async_view = self.get_view(view_class, actions, True)
+
+        self.assertFalse(asyncio.iscoroutinefunction(sync_view))
+        self.assertTrue(asyncio.iscoroutinefunction(async_view))
+
+        cache.clear()
+        expected = sync_view(APIRequestFactory().get(path, query), **kwargs)
+        expected.render()
+        cache.clear()
+        response = async_to_sync(async_view)(AsyncRequestFactory().get(path, query), **kwargs)
+        response.render()
+
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        self.assertEqual(response.get('ETag'), expected.get('ETag'))
+        return response
+
+    def test_list_matches_sync(self):
+        self.compare(ProductAPIView, "/api/v1/products/", {"limit": 2})
+        self.compare(ProductAPIView, "/api/v1/products/", {"limit": 2, "offset": 2})
+        self.compare(ProductAPIView, "/api/v1/products/", {"expand": "product_type", "fast": "0"})
+        self.compare(ProductTypeAPIView, "/api/v1/product_types/")
+        self.compare(MiniNewsAPIView, "/api/v1/mini_news/", {"ordering": "-mn_date", "fields": "mn_title"})
+
+    def test_retrieve_matches_sync(self):
+        pk = self.products[0].pk
+
+        self.compare(ProductAPIView, f"/api/v1/products/{pk}/", pk=pk)
+        self.compare(ProductAPIView, "/api/v1/products/0/", pk=0)
+
+    def test_errors_match_sync(self):
+        response = self.compare(ProductAPIView, "/api/v1/products/", {"fields": "missing"})
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_cached_async_response(self):
+        view = self.get_view(ProductAPIView, {'get': 'list'}, True)
+        async_to_sync(view)(AsyncRequestFactory().get("/api/v1/products/"))
+
+        with self.assertNumQueries(0):
+            response = async_to_sync(view)(AsyncRequestFactory().get("/api/v1/products/"))
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_fall_back_to_sync_view(self):
+        view = self.get_view(ProductTypeAPIView, {'get': 'list', 'post': 'create'}, True)
+
+        response = async_to_sync(view)(AsyncRequestFactory().post("/api/v1/product_types/",
+                                                                  {"product_type_name": "New"}))
+
+        self.assertEqual(response.status_code, 401)
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_every_route_has_scenario(self):
+        scenarios = benchmarks.endpoint_scenarios(None)
+
+        self.assertEqual([route for route in benchmarks.routes() if route not in scenarios], [])
+
+    def test_compare_reports_regressions(self):
+        baseline = {"GET /api/v1/products/": {"p95_ms": 10.0, "queries": 1}}
+
+        self.assertEqual(benchmarks.compare({"GET /api/v1/products/": {"p95_ms": 12.0, "queries": 1}},
+                                            baseline, 0.25), [])
+        regressions = benchmarks.compare({"GET /api/v1/products/": {"p95_ms": 20.0, "queries": 2}}, baseline, 0.25)
+        self.assertEqual(len(regressions), 2)
+
+    def test_scenario_is_sent_over_http(self):
+        headers = {'HTTP_RANGE': "bytes=0-1", 'REMOTE_ADDR': "10.0.0.1"}
+
+        with benchmarks.http_server() as base_url:
+            status_code, seconds = benchmarks.send_http(base_url, "GET", "/api/v1/", None, None, headers)
+
+        self.assertEqual(status_code, 200)
+        self.assertEqual(benchmarks.http_headers(headers), {'Range': "bytes=0-1", 'X-Forwarded-For': "10.0.0.1"})
+
+    def test_http_mode_is_limited_to_supporting_benchmarks(self):
+        with self.assertRaisesMessage(CommandError, "runs in-process only"):
+            call_command('benchmark', 'serializers', '--http')
+
+
+@modify_settings(MIDDLEWARE={'append': 'main.middleware.MetricsMiddleware'})
+class MetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.type_product = TypeProduct.objects.create(product_type_name="Type")
+
+    def test_request_is_recorded_per_action(self):
+        before = middleware.request_latency.get(view="ProductTypeAPIView.list", method="GET", status=200)["count"]
+        queries = middleware.request_queries.get(view="ProductTypeAPIView.list")
+
+        self.client.get("/api/v1/product_types/")
+
+        self.assertEqual(middleware.request_latency.get(view="ProductTypeAPIView.list", method="GET",
+                                                        status=200)["count"], before + 1)
+        self.assertGreater(middleware.request_queries.get(view="ProductTypeAPIView.list")["sum"], queries["sum"])
+
+    def test_serializer_validation_is_timed(self):
+        before = metrics.validation_latency.get(serializer="ProductTypeSerializer")["count"]
+
+        ProductTypeSerializer(data={"product_type_name": "Type"}).is_valid()
+
+        self.assertEqual(metrics.validation_latency.get(serializer="ProductTypeSerializer")["count"], before + 1)
+
+    def test_label_values_and_help_are_escaped(self):
+        counter = metrics.Counter('test_escaped_total', 'Help with \\ and\nnewline')
+        self.addCleanup(metrics.registry.pop, 'test_escaped_total')
+
+        counter.inc(path='say "hi"\\n\nnext')
+
+        self.assertEqual(counter.render().splitlines(), [
+            '# HELP test_escaped_total Help with \\\\ and\\nnewline',
+            '# TYPE test_escaped_total counter',
+            'test_escaped_total{path="say \\"hi\\"\\\\n\\nnext"} 1',
+        ])
+
+    def test_endpoint_is_staff_only(self):
+        user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+        staff = User.objects.create_user(username="staff", email="staff@madadev.ru", password="password",
+                                         is_staff=True)
+
+        self.assertIn(self.client.get("/api/v1/metrics/").status_code, (401, 403))
+        self.client.force_login(user)
+        self.assertEqual(self.client.get("/api/v1/metrics/").status_code, 403)
+
+        self.client.force_login(staff)
+        response = self.client.get("/api/v1/metrics/", HTTP_ACCEPT="text/plain")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(b"# TYPE http_request_duration_seconds histogram", response.content)
+        self.assertIn(b"email_outbox_depth 0", response.content)
+
+
+class UserExportTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password",
+                                                   is_email_verified=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def export(self, **params):
+        response = self.client.get("/api/v1/users/export/", params)
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_ndjson_uses_list_fields(self):
+        rows = [json.loads(line) for line in self.export().splitlines()]
+
+        self.assertEqual(len(rows), 1)
+        self.assertEqual(set(rows[0]), set(CreateUserSerializer.Meta.fields) - {"password"})
+        self.assertEqual(rows[0]["username"], "admin")
+
+    def test_csv(self):
+        User.objects.create_user(username="second", email="second@madadev.ru", password="password")
+
+        rows = list(csv.reader(io.StringIO(self.export(format="csv"))))
+
+        self.assertEqual(rows[0][:2], ["id", "username"])
+        self.assertEqual([row[1] for row in rows[1:]], ["admin", "second"])
+
+    def test_filters(self):
+        user = User.objects.create_user(username="second", email="second@madadev.ru", password="password")
+        User.objects.filter(pk=user.pk).update(date_joined="2020-01-01T00:00:00Z")
+
+        self.assertEqual([json.loads(line)["username"] for line in self.export(is_email_verified="false")
+                          .splitlines()], ["second"])
+        self.assertEqual([json.loads(line)["username"] for line in self.export(date_joined_before="2020-01-01")
+                          .splitlines()], ["second"])
+        self.assertEqual([json.loads(line)["username"] for line in self.export(date_joined_after="2021-01-01")
+                          .splitlines()], ["admin"])
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get("/api/v1/users/export/", {"format": "xml"}).status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/users/export/", {"date_joined_after": "yesterday"}).status_code,
+                         400)
+
+    def test_staff_only(self):
+        user = User.objects.create_user(username="user", email="user@madadev.ru", password="password")
+        client = APIClient()
+        client.force_authenticate(user)
+
+        self.assertEqual(client.get("/api/v1/users/export/").status_code, 403)
+
+    @override_settings(EXPORT_CHUNK_SIZE=200)
+    def test_memory_does_not_grow_with_table(self):
+        benchmarks.seed_users(10000, "password")
+        response = self.client.get("/api/v1/users/export/")
+
+        size = 0
+        tracemalloc.start()
+        try:
+            for line in response.streaming_content:
+                size += len(line)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        self.assertGreater(size, 3 * 1024 * 1024)
+        self.assertLess(peak, size // 8)
+
+
+class SearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.kitchen = TypeProduct.objects.create(product_type_name="Kitchen")
+        self.light = TypeProduct.objects.create(product_type_name="Light")
+        self.kettle = Product.objects.create(product_title="Красный чайник", product_tag="кухня",
+                                             product_desc="Электрический", product_type=self.kitchen)
+        self.lamp = Product.objects.create(product_title="Лампа", product_tag="свет",
+                                           product_desc="Настольная лампа, светит на чайник", product_type=self.light)
+        Product.objects.create(product_title="Стул", product_tag="мебель", product_desc="Деревянный",
+                               product_type=self.kitchen)
+
+    def titles(self, **params):
+        response = self.client.get("/api/v1/products/", params)
+        self.assertEqual(response.status_code, 200)
+        return [product["product_title"] for product in response.data["results"]]
+
+    def test_results_are_ranked(self):
+        response = self.client.get("/api/v1/products/", {"q": "ЧАЙНИК"})
+
+        self.assertEqual([product["product_title"] for product in response.data["results"]],
+                         ["Красный чайник", "Лампа"])
+        self.assertEqual(response.data["count"], 2)
+
+    def test_all_words_must_match(self):
+        self.assertEqual(self.titles(q="чайник светит"), ["Лампа"])
+        self.assertEqual(self.titles(q='чайник" OR *'), [])
+        self.assertEqual(self.titles(q="  "), [])
+
+    def test_filter_by_product_type(self):
+        self.assertEqual(self.titles(q="чайник", product_type=self.light.pk), ["Лампа"])
+        self.assertEqual(self.titles(product_type=self.kitchen.pk), ["Красный чайник", "Стул"])
+        self.assertEqual(self.client.get("/api/v1/products/", {"product_type": "light"}).status_code, 400)
+
+    def test_index_follows_writes(self):
+        self.kettle.product_title = "Синий чайник"
+        self.kettle.save()
+        Product.objects.filter(pk=self.lamp.pk).update(product_desc="Без слов")
+        Product.objects.bulk_create([Product(product_title="Чайник заварочный", product_type=self.kitchen)])
+
+        self.assertEqual(list(search.search(Product.objects.all(), "чайник").values_list('product_title', flat=True)),
+                         ["Синий чайник", "Чайник заварочный"])
+
+        ProductTag.objects.filter(product=self.kettle)._raw_delete(connection.alias)
+        Product.objects.filter(pk=self.kettle.pk)._raw_delete(connection.alias)
+        self.assertEqual(search.search(Product.objects.all(), "синий").count(), 0)
+
+    def test_mini_news(self):
+        MiniNews.objects.create(mn_title="Релиз", mn_desc="Вышла новая версия")
+        MiniNews.objects.create(mn_title="Версия 2", mn_desc="Подробности")
+
+        response = self.client.get("/api/v1/mini_news/", {"q": "версия"})
+
+        self.assertEqual([news["mn_title"] for news in response.data["results"]], ["Версия 2", "Релиз"])
+
+
+class LatestNewsTests(TestCase):
+    def setUp(self):
+        for number, day in enumerate(["2024-01-05", "2024-01-07", "2024-01-06", "2024-01-07"]):
+            news = MiniNews.objects.create(mn_title=f"News {number}", mn_desc=f"Description {number}")
+            MiniNews.objects.filter(pk=news.pk).update(mn_date=day)
+        cache.clear()
+
+    def titles(self, data):
+        return [item["mn_title"] for item in data]
+
+    def test_latest_newest_first(self):
+        response = self.client.get("/api/v1/mini_news/latest/", {"n": 3})
+
+        self.assertEqual(self.titles(response.json()), ["News 3", "News 1", "News 2"])
+        self.assertEqual(self.client.get("/api/v1/mini_news/latest/", {"n": 0}).status_code, 400)
+        self.assertEqual(self.client.get("/api/v1/mini_news/latest/", {"n": "many"}).status_code, 400)
+
+    def test_date_range(self):
+        latest = self.client.get("/api/v1/mini_news/latest/", {"date_after": "2024-01-06", "date_before": "2024-01-06"})
+        listed = self.client.get("/api/v1/mini_news/", {"date_before": "2024-01-06"})
+
+        self.assertEqual(self.titles(latest.json()), ["News 2"])
+        self.assertEqual(self.titles(listed.data["results"]), ["News 0", "News 2"])
+        self.assertEqual(self.client.get("/api/v1/mini_news/", {"date_after": "yesterday"}).status_code, 400)
+
+    def test_rss_and_atom(self):
+        rss = self.client.get("/api/v1/mini_news/latest/", {"n": 2, "format": "rss"})
+        atom = self.client.get("/api/v1/mini_news/latest/", HTTP_ACCEPT="application/atom+xml")
+
+        self.assertEqual(rss["Content-Type"], "application/rss+xml; charset=utf-8")
+        self.assertEqual(rss.content.count(b"<item>"), 2)
+        self.assertIn(b"<title>News 3</title>", rss.content)
+        self.assertIn(b"/api/v1/mini_news/", rss.content)
+        self.assertTrue(atom["Content-Type"].startswith("application/atom+xml"))
+        self.assertEqual(atom.content.count(b"<entry>"), 4)
+
+    def test_errors_stay_json(self):
+        response = self.client.get("/api/v1/mini_news/latest/", {"n": 1000, "format": "rss"})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn("status", json.loads(response.content))
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=0)
+    def test_served_from_cache_until_write(self):
+        self.client.get("/api/v1/mini_news/latest/", {"format": "rss"})
+
+        with self.assertNumQueries(0):
+            self.client.get("/api/v1/mini_news/latest/", {"format": "rss"})
+
+        MiniNews.objects.create(mn_title="Fresh", mn_desc="Description")
+        MiniNews.objects.filter(mn_title="Fresh").update(mn_date="2024-02-01")
+
+        self.assertIn(b"<title>Fresh</title>", self.client.get("/api/v1/mini_news/latest/", {"format": "rss"}).content)
+
+    def test_cache_key_ignores_unknown_parameters(self):
+        response_cache = caches['default']
+        with mock.patch.object(response_cache, 'set', wraps=response_cache.set) as cache_set:
+            self.client.get("/api/v1/mini_news/latest/", {"n": 2, "format": "rss"})
+
+        self.assertEqual(cache_set.call_args.args[2], 60 * 60)
+
+        with self.assertNumQueries(0):
+            for query in ({"n": 2, "format": "rss", "x": 1}, {"n": 2, "x": 2, "format": "rss"}):
+                self.client.get("/api/v1/mini_news/latest/", query)
+            self.client.get("/api/v1/mini_news/latest/?n=2", HTTP_ACCEPT="application/rss+xml")
+            self.client.get("/api/v1/mini_news/latest/?n=2", HTTP_ACCEPT="text/html;q=0.1, application/rss+xml")
+
+    def test_search_is_part_of_cache_key(self):
+        searched = self.client.get("/api/v1/mini_news/latest/", {"n": 10, "q": "zzzz"})
+        plain = self.client.get("/api/v1/mini_news/latest/", {"n": 10})
+
+        self.assertEqual(searched.json(), [])
+        self.assertEqual(self.titles(plain.json()), ["News 3", "News 1", "News 2", "News 0"])
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.first = TypeProduct.objects.create(product_type_name="First")
+        self.second = TypeProduct.objects.create(product_type_name="Second")
+        self.admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def create(self, *rows):
+        response = self.client.post("/api/v1/products/bulk/", [
+            {"product_title": title, "product_tag": "main", "product_desc": "Description",
+             "product_type_id": product_type.pk, **({"tags": tags} if tags is not None else {})}
+            for title, product_type, tags in rows], format='json')
+        self.assertEqual(response.status_code, 201)
+        return response.data["ids"]
+
+    def counts(self):
+        data = APIClient().get("/api/v1/products/facets/").data
+        return ({tag["tag_name"]: tag["count"] for tag in data["tags"]},
+                {item["product_type_name"]: item["count"] for item in data["product_types"]})
+
+    def titles(self, query):
+        return [product["product_title"] for product in APIClient().get(f"/api/v1/products/?{query}").data["results"]]
+
+    def test_bulk_create_counts_tags_and_types(self):
+        self.create(("A", self.first, [" Red ", "Sale", "red"]), ("B", self.first, ["red"]),
+                    ("C", self.second, None))
+
+        self.assertEqual(self.counts(), ({"red": 2, "sale": 1, "main": 1}, {"First": 2, "Second": 1}))
+
+    def test_facets_are_read_without_grouping(self):
+        self.create(("A", self.first, ["red"]))
+
+        with CaptureQueriesContext(connection) as captured:
+            response = APIClient().get("/api/v1/products/facets/?limit=1")
+
+        self.assertEqual(response.data["tags"], [{"tag_name": "red", "count": 1}])
+        self.assertFalse([query for query in captured if "GROUP BY" in query['sql']])
+        self.assertEqual(APIClient().get("/api/v1/products/facets/?limit=0").status_code, 400)
+
+    def test_filter_by_all_tags_and_type(self):
+        self.create(("A", self.first, ["red", "sale"]), ("B", self.first, ["red"]), ("C", self.second, ["red", "sale"]))
+
+        self.assertEqual(self.titles("tags=red"), ["A", "B", "C"])
+        self.assertEqual(self.titles("tags=Sale,red"), ["A", "C"])
+        self.assertEqual(self.titles(f"tags=sale&product_type={self.first.pk}"), ["A"])
+        self.assertEqual(self.titles("tags=blue"), [])
+
+    def test_expand_tags(self):
+        self.create(("A", self.first, ["sale", "red"]))
+
+        product = APIClient().get("/api/v1/products/?expand=tags").data["results"][0]
+
+        self.assertEqual(product["tags"], ["red", "sale"])
+        self.assertNotIn("tags", APIClient().get("/api/v1/products/").data["results"][0])
+
+    def test_model_writes_keep_type_counts(self):
+        product = Product.objects.create(product_title="A", product_type=self.first)
+        product.product_type = self.second
+        product.save()
+        Product.objects.create(product_title="B", product_type=self.second)
+
+        self.assertEqual(self.counts()[1], {"First": 0, "Second": 2})
+
+        product.delete()
+        self.assertEqual(self.counts()[1], {"First": 0, "Second": 1})
+
+    def test_model_writes_keep_product_tag(self):
+        product = Product.objects.create(product_title="A", product_tag="Kitchen", product_type=self.first)
+        Product.objects.create(product_title="B", product_tag="kitchen", product_type=self.first)
+
+        self.assertEqual(self.counts()[0], {"kitchen": 2})
+        self.assertEqual(self.titles("tags=kitchen"), ["A", "B"])
+
+        product.product_tag = "Garden"
+        product.save()
+        self.assertEqual(self.counts()[0], {"kitchen": 1, "garden": 1})
+        self.assertEqual(self.titles("tags=garden"), ["A"])
+
+        product.delete()
+        self.assertEqual(self.counts()[0], {"kitchen": 1})
+
+    def test_bulk_delete_forgets_products(self):
+        ids = self.create(("A", self.first, ["red", "sale"]), ("B", self.first, ["red"]),
+                          ("C", self.second, ["red"]))
+
+        self.client.delete(f"/api/v1/products/bulk/?ids={ids[0]}")
+        self.assertEqual(self.counts(), ({"red": 2}, {"First": 1, "Second": 1}))
+
+        self.client.delete(f"/api/v1/product_types/bulk/?ids={self.first.pk}")
+        self.assertEqual(self.counts(), ({"red": 1}, {"Second": 1}))
+
+    def test_rebuild(self):
+        Product.objects.create(product_title="A", product_tag="Old Tag", product_type=self.first)
+        TypeProduct.objects.update(product_count=5)
+
+        facets.rebuild()
+
+        self.assertEqual(self.counts(), ({"old tag": 1}, {"First": 1, "Second": 0}))
+        self.assertEqual(Tag.objects.get().product_count, 1)
+
+
+class BulkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.type_product = TypeProduct.objects.create(product_type_name="Type")
+        self.admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password")
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def product(self, number, product_type_id=None):
+        return {"product_title": f"Product {number}", "product_tag": "tag", "product_desc": "Description",
+                "product_type_id": product_type_id or self.type_product.pk}
+
+    def test_json_array_reports_invalid_rows(self):
+        rows = [self.product(0), self.product(1, product_type_id=999), {"product_title": "No fields"},
+                self.product(3)]
+
+        response = self.client.post("/api/v1/products/bulk/", rows, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([error["index"] for error in response.data["errors"]], [1, 2])
+        self.assertEqual(list(Product.objects.values_list('product_id', flat=True)), response.data["ids"])
+        self.assertEqual(Product.objects.first().product_image, "images/plug/plug.jpg")
+
+    @override_settings(BULK_BATCH_SIZE=2)
+    def test_product_types_are_checked_once_per_batch(self):
+        rows = [self.product(number) for number in range(5)]
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post("/api/v1/products/bulk/", rows, format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Product.objects.count(), 5)
+        type_queries = [query for query in captured if 'FROM "type_product"' in query['sql']]
+        self.assertEqual(len(type_queries), 3)
+
+    def test_ndjson_stream(self):
+        body = b'{"product_type_name": "First"}\n\n{broken\n{"product_type_name": "Second"}\n'
+
+        response = self.client.generic('POST', "/api/v1/product_types/bulk/", body,
+                                       content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual(response.data["errors"][0]["index"], 1)
+        self.assertEqual(TypeProduct.objects.filter(product_type_name__in=["First", "Second"]).count(), 2)
+
+    @override_settings(BULK_BATCH_SIZE=2)
+    def test_failed_batch_keeps_committed_batches(self):
+        rows = [self.product(0), self.product(1), self.product(2), self.product(3, product_type_id=999)]
+        create = ProductAPIView.perform_bulk_create
+
+        def perform_bulk_create(view, objects, relations):
+            if objects[0].product_title == "Product 2":
+                raise IntegrityError("constraint failed")
+            create(view, objects, relations)
+
+        with mock.patch.object(ProductAPIView, 'perform_bulk_create', perform_bulk_create), \
+                self.assertLogs('main.bulk', 'ERROR'):
+            response = self.client.post("/api/v1/products/bulk/", rows, format='json')
+
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual(response.data["created"], 2)
+        self.assertEqual([error["index"] for error in response.data["errors"]], [2, 3])
+        self.assertEqual(response.data["errors"][0]["errors"], {"status": "Batch was not saved"})
+        self.assertEqual(Product.objects.count(), 2)
+
+    def test_object_is_rejected(self):
+        response = self.client.post("/api/v1/mini_news/bulk/", {"mn_title": "News"}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_bulk_create_invalidates_cache(self):
+        self.client.logout()
+        self.assertEqual(APIClient().get("/api/v1/mini_news/").data["results"], [])
+        self.client.force_authenticate(self.admin)
+
+        self.client.post("/api/v1/mini_news/bulk/", [{"mn_title": "News", "mn_desc": "Description",
+                                                      "mn_date": "2024-01-01"}], format='json')
+
+        self.assertEqual(len(APIClient().get("/api/v1/mini_news/").data["results"]), 1)
+
+    def test_delete_by_ids_in_one_statement(self):
+        products = Product.objects.bulk_create([Product(product_title=f"Product {number}",
+                                                        product_type=self.type_product) for number in range(3)])
+
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.delete("/api/v1/products/bulk/", {"ids": [products[0].pk, products[1].pk]},
+                                          format='json')
+
+        self.assertEqual(response.data, {"deleted": 2})
+        deletes = [query['sql'] for query in captured if query['sql'].startswith('DELETE')]
+        self.assertEqual([sql.split()[2] for sql in deletes], ['"product_tag"', '"product"'])
+        self.assertEqual(list(Product.objects.values_list('product_id', flat=True)), [products[2].pk])
+
+    def test_delete_product_types_cascades(self):
+        Product.objects.create(product_title="Product", product_type=self.type_product)
+        APIClient().get("/api/v1/products/")
+
+        response = self.client.delete(f"/api/v1/product_types/bulk/?ids={self.type_product.pk}")
+
+        # Категория, её продукт и связь продукта с тегом из `product_tag`
+        self.assertEqual(response.data, {"deleted": 3})
+        self.assertEqual(APIClient().get("/api/v1/products/").data["results"], [])
+
+    def test_delete_requires_ids(self):
+        response = self.client.delete("/api/v1/products/bulk/", {"ids": ["one"]}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+
+    def test_anonymous_is_rejected(self):
+        response = APIClient().post("/api/v1/product_types/bulk/", [{"product_type_name": "Type"}], format='json')
+
+        self.assertIn(response.status_code, (401, 403))
+
+
+@modify_settings(MIDDLEWARE={'append': 'main.middleware.MetricsMiddleware'})
+@override_settings(QUERY_BUDGET_SAMPLE_RATE=1, QUERY_BUDGET_RAISE=True,
+                   RATE_LIMITS={action: {} for action in ratelimit.DEFAULT_RATE_LIMITS})
+class QueryBudgetTests(TestCase):
+    def test_endpoints_stay_within_budgets(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+
+        with override_settings(MEDIA_ROOT=media_root):
+            context = benchmarks.EndpointContext(30)
+            for route, scenario in benchmarks.endpoint_scenarios(context).items():
+                if route.startswith("POST") and route.endswith(("/products/", "/product_types/", "/mini_news/")):
+                    continue  # создание объектов каталога не реализовано в сериализаторах
+                with self.subTest(route=route):
+                    benchmarks.send(APIClient(), route.split()[0], *scenario())
+
+    def test_repeated_queries_are_reported(self):
+        statements = ['SELECT * FROM "main_product" WHERE "product_id" = %s'] * 3
+        statements.append('SELECT * FROM "main_product" WHERE "product_id" IN (%s, %s)')
+
+        problems = querybudget.find_problems("ProductAPIView.list", 10, statements)
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn("possible N+1", problems[0])
+
+    def test_budget_is_enforced(self):
+        with self.assertRaises(querybudget.QueryBudgetExceeded):
+            querybudget.check("ProductAPIView.list", 1, ["SELECT 1", "SELECT 2", "SAVEPOINT x"])
+
+        querybudget.check("ProductAPIView.list", 2, ["SELECT 1", "SELECT 2", "SAVEPOINT x"])
+
+    @override_settings(QUERY_BUDGET_RAISE=False)
+    def test_production_logs_warning(self):
+        with self.assertLogs('main.querybudget', level='WARNING') as logs:
+            querybudget.check("ProductAPIView.list", 1, ["SELECT 1", "SELECT 2"])
+
+        self.assertIn("2 queries, budget 1", logs.output[0])
+
+
+REPLICAS = ['replica_1', 'replica_2']
+
+
+def add_sqlite_replicas(aliases):
+    """
+    Реплики для тестов роутера — отдельные файлы SQLite без репликации: строка, записанная только в основную
+    базу, на них не видна. Регистрируются при импорте модуля, до создания тестовых баз.
+    """
+    configured = connections.configure_settings({
+        DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+        **{alias: {'ENGINE': 'django.db.backends.sqlite3',
+                   'TEST': {'NAME': os.path.join(tempfile.gettempdir(), f"mdd_{os.getpid()}_{alias}.sqlite3")}}
+           for alias in aliases}})
+    for alias in aliases:
+        connections.settings.setdefault(alias, configured[alias])
+
+
+add_sqlite_replicas(REPLICAS)
+
+
+@modify_settings(MIDDLEWARE={'append': 'main.middleware.ReplicaPinMiddleware'})
+@override_settings(DATABASE_ROUTERS=['main.routers.ReplicaRouter'], DATABASE_REPLICAS=REPLICAS,
+                   REPLICA_STICKY_SECONDS=60)
+class ReplicaRouterTests(TestCase):
+    databases = {DEFAULT_DB_ALIAS, *REPLICAS}
+
+    def setUp(self):
+        cache.clear()
+        for alias in REPLICAS:
+            TypeProduct.objects.using(alias).create(product_type_name="Replicated")
+
+        self.admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password")
+        for alias in REPLICAS:
+            User.objects.get(pk=self.admin.pk).save(using=alias, force_insert=True)
+        self.writer = APIClient(HTTP_AUTHORIZATION=f"Bearer {AccessToken.for_user(self.admin)}")
+
+    def names(self, client, **extra):
+        response = client.get("/api/v1/product_types/", {"fast": "0"}, **extra)
+        return [item["product_type_name"] for item in response.data["results"]]
+
+    def test_reads_go_to_replica(self):
+        TypeProduct.objects.create(product_type_name="Primary only")
+
+        self.assertEqual(self.names(APIClient()), ["Replicated"])
+
+    def test_writer_reads_own_writes_until_window_ends(self):
+        response = self.writer.post("/api/v1/product_types/bulk/", [{"product_type_name": "Written"}],
+                                    format='json')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.names(self.writer), ["Written"])
+        self.assertEqual(self.names(APIClient(), REMOTE_ADDR="10.0.0.2"), ["Replicated"])
+
+        cache.delete(routers.pin_key(self.writer.get("/api/v1/").wsgi_request))
+        self.assertEqual(self.names(self.writer), ["Replicated"])
+
+    def test_failed_write_does_not_pin(self):
+        self.writer.post("/api/v1/product_types/bulk/", {"product_type_name": "Not a list"}, format='json')
+
+        self.assertEqual(self.names(self.writer), ["Replicated"])
+
+    def test_outside_request_uses_primary(self):
+        router = routers.ReplicaRouter()
+
+        self.assertEqual(router.db_for_read(TypeProduct), DEFAULT_DB_ALIAS)
+        with routers.reading() as state:
+            self.assertIn(router.db_for_read(TypeProduct), REPLICAS)
+            self.assertEqual(router.db_for_write(TypeProduct), DEFAULT_DB_ALIAS)
+            self.assertEqual(router.db_for_read(TypeProduct), DEFAULT_DB_ALIAS)
+        self.assertTrue(state['wrote'])
+        self.assertFalse(router.allow_migrate(REPLICAS[0], 'main'))
+
+
+class ConnectionPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "pool.sqlite3")
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def connect(self):
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def pool(self, **options):
+        pool = dbpool.ConnectionPool("pool_test", **options)
+        self.addCleanup(pool.close_idle)
+        return pool
+
+    def test_released_connection_is_reused(self):
+        pool = self.pool()
+        created = dbpool.pool_created.get(database="pool_test")
+
+        first = pool.acquire(self.connect)
+        pool.release(first)
+        second = pool.acquire(self.connect)
+
+        self.assertIs(first, second)
+        self.assertEqual(dbpool.pool_created.get(database="pool_test"), created + 1)
+        self.assertEqual(dbpool.pool_in_use.get(database="pool_test"), 1)
+        pool.release(second)
+
+    def test_checkout_times_out_when_exhausted(self):
+        pool = self.pool(max_size=1, timeout=0.05)
+        timeouts = dbpool.pool_timeouts.get(database="pool_test")
+        held = pool.acquire(self.connect)
+
+        with self.assertRaises(dbpool.PoolTimeout):
+            pool.acquire(self.connect)
+
+        self.assertEqual(dbpool.pool_timeouts.get(database="pool_test"), timeouts + 1)
+        self.assertEqual(dbpool.pool_waiting.get(database="pool_test"), 0)
+        pool.release(held)
+
+    def test_waiter_gets_released_connection(self):
+        pool = self.pool(max_size=1, timeout=5)
+        held = pool.acquire(self.connect)
+        received = []
+
+        waiter = threading.Thread(target=lambda: received.append(pool.acquire(self.connect)))
+        waiter.start()
+        pool.release(held)
+        waiter.join()
+
+        self.assertEqual(received, [held])
+        pool.release(held)
+
+    def test_broken_connection_is_replaced(self):
+        pool = self.pool()
+        broken = pool.acquire(self.connect)
+        pool.release(broken)
+        broken.close()
+
+        replacement = pool.acquire(self.connect)
+
+        self.assertIsNot(replacement, broken)
+        self.assertEqual(replacement.execute("SELECT 1").fetchone(), (1,))
+        pool.release(replacement)
+
+    def test_idle_connections_are_evicted_above_min_size(self):
+        pool = self.pool(min_size=1, max_idle=0)
+        first, second = pool.acquire(self.connect), pool.acquire(self.connect)
+        pool.release(first)
+        pool.release(second)
+
+        third = pool.acquire(self.connect)
+
+        self.assertIs(third, second)
+        self.assertEqual(pool.size, 1)
+        pool.release(third)
+
+    def test_database_wrapper_returns_connections_to_pool(self):
+        settings_dict = connections.configure_settings({
+            DEFAULT_DB_ALIAS: connections.settings[DEFAULT_DB_ALIAS],
+            'pooled': {'ENGINE': 'main.dbpool.sqlite3', 'NAME': self.path, 'POOL': {'MAX_SIZE': 2}}})['pooled']
+        backend = load_backend('main.dbpool.sqlite3')
+        first, second = backend.DatabaseWrapper(settings_dict, 'pooled'), backend.DatabaseWrapper(settings_dict, 'pooled')
+        self.addCleanup(dbpool.close_pools)
+
+        first.ensure_connection()
+        raw = first.connection
+        first.close()
+        second.ensure_connection()
+
+        self.assertIs(second.connection, raw)
+        self.assertEqual(second.cursor().execute("PRAGMA foreign_keys").fetchone(), (1,))
+
+        with second.cursor() as cursor:
+            cursor.execute("CREATE TABLE item (id integer)")
+        second.set_autocommit(False)
+        second.in_atomic_block = True
+        second.close()
+        second.in_atomic_block = False
+
+        first.ensure_connection()
+        self.assertIsNot(first.connection, raw)
+        first.close()
+
+
+class MediaTests(TestCase):
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = self.settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.data = bytes(range(256)) * 4
+        self.name = media.storage.save("images/products/Photo.PNG", ContentFile(self.data))
+        os.makedirs(os.path.join(media_root, "images", "plug"))
+        with open(os.path.join(media_root, "images", "plug", "plug.jpg"), "wb") as file:
+            file.write(self.data)
+
+    def get(self, path, **headers):
+        response = self.client.get(path, **headers)
+        response.body = b"".join(response.streaming_content) if response.streaming else response.content
+        return response
+
+    def test_uploads_are_named_by_content_hash(self):
+        self.assertRegex(self.name, r"^images/products/[0-9a-f]{32}\.png$")
+        self.assertTrue(media.is_immutable(self.name))
+        self.assertFalse(media.is_immutable("images/plug/plug.jpg"))
+
+    def test_hashed_file_is_immutable(self):
+        response = self.get(f"/media/{self.name}")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.body, self.data)
+        self.assertEqual(response["Content-Type"], "image/png")
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=31536000", response["Cache-Control"])
+
+    def test_other_files_are_revalidated(self):
+        response = self.get("/media/images/plug/plug.jpg")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("immutable", response["Cache-Control"])
+        self.assertIn("max-age=3600", response["Cache-Control"])
+
+    def test_range_requests(self):
+        cases = (("bytes=10-19", 10, 19), ("bytes=1000-", 1000, 1023), ("bytes=-24", 1000, 1023),
+                 ("bytes=1000-5000", 1000, 1023))
+
+        for header, start, end in cases:
+            with self.subTest(header=header):
+                response = self.get(f"/media/{self.name}", HTTP_RANGE=header)
+
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response.body, self.data[start:end + 1])
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        response = self.get(f"/media/{self.name}", HTTP_RANGE="bytes=2048-")
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response["Content-Range"], "bytes */1024")
+
+    def test_multiple_or_stale_ranges_return_whole_file(self):
+        for headers in ({"HTTP_RANGE": "bytes=0-1,5-6"}, {"HTTP_RANGE": "bytes=0-1", "HTTP_IF_RANGE": '"stale"'}):
+            with self.subTest(headers=headers):
+                response = self.get(f"/media/{self.name}", **headers)
+
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.body, self.data)
+
+    def test_conditional_request(self):
+        etag = self.get(f"/media/{self.name}")["ETag"]
+
+        response = self.get(f"/media/{self.name}", HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.body, b"")
+
+    def test_missing_and_outside_files(self):
+        self.assertEqual(self.get("/media/images/products/missing.png").status_code, 404)
+        self.assertEqual(self.get("/media/../../etc/passwd").status_code, 404)
+        self.assertEqual(self.client.post(f"/media/{self.name}").status_code, 405)
+
+    def test_proxy_offload(self):
+        with self.settings(MEDIA_ACCEL_REDIRECT="/internal-media/"):
+            response = self.get(f"/media/{self.name}", HTTP_RANGE="bytes=0-1")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["X-Accel-Redirect"], f"/internal-media/{self.name}")
+        self.assertEqual(response.body, b"")
+
+        with self.settings(MEDIA_SENDFILE=True):
+            response = self.get(f"/media/{self.name}")
+
+        self.assertEqual(response["X-Sendfile"], os.path.join(media.storage.location, self.name))
+        self.assertIn("immutable", response["Cache-Control"])
+
+
+@override_settings(MEDIA_COLLECT_ASYNC=False)
+class StoredImageTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = self.settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def upload(self, color, name="a.png"):
+        return SimpleUploadedFile(name, png_bytes(color=color), content_type="image/png")
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.media_root, name))
+
+    def test_same_content_is_stored_once(self):
+        first = User.objects.create(username="first", email="first@madadev.ru", image=self.upload('red'))
+        second = User.objects.create(username="second", email="second@madadev.ru",
+                                     image=self.upload('red', "other.png"))
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertEqual(os.listdir(os.path.join(self.media_root, "images", "users")),
+                         [os.path.basename(first.image.name)])
+        stored = StoredImage.objects.get()
+        self.assertEqual(stored.ref_count, 2)
+        self.assertEqual(media.report()['saved_bytes'], stored.size)
+
+    def test_replaced_image_is_released_after_commit(self):
+        user = User.objects.create(username="user", email="user@madadev.ru", image=self.upload('red'))
+        other = User.objects.create(username="other", email="other@madadev.ru", image=self.upload('red'))
+        old_name = user.image.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer = UpdateUserSerializer(instance=User.objects.get(pk=user.pk),
+                                              data={"image": self.upload('blue')}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+
+        self.assertTrue(self.exists(old_name))
+        self.assertEqual(StoredImage.objects.get(name=old_name).ref_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+
+        self.assertFalse(self.exists(old_name))
+        self.assertFalse(StoredImage.objects.filter(name=old_name).exists())
+        self.assertTrue(self.exists(User.objects.get(pk=user.pk).image.name))
+
+    def test_default_avatar_is_never_deleted(self):
+        default = "images/default_avatar/default_avatar.png"
+        os.makedirs(os.path.join(self.media_root, "images", "default_avatar"))
+        open(os.path.join(self.media_root, default), "wb").close()
+        user = User.objects.create(username="user", email="user@madadev.ru")
+
+        with self.captureOnCommitCallbacks(execute=True):
+            serializer = UpdateUserSerializer(instance=User.objects.get(pk=user.pk),
+                                              data={"image": self.upload('blue')}, partial=True)
+            serializer.is_valid(raise_exception=True)
+            serializer.save()
+            media.storage.delete(default)
+
+        self.assertTrue(self.exists(default))
+        self.assertEqual(StoredImage.objects.get().name, User.objects.get(pk=user.pk).image.name)
+
+    def test_bulk_delete_releases_product_images(self):
+        product_type = TypeProduct.objects.create(product_type_name="Type")
+        products = [Product.objects.create(product_type=product_type, product_image=self.upload(color))
+                    for color in ('red', 'red', 'blue')]
+        admin = User.objects.create_superuser(username="admin", email="admin@madadev.ru", password="password")
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.delete("/api/v1/products/bulk/", {"ids": [products[0].pk, products[2].pk]},
+                                     format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(StoredImage.objects.values_list('name', 'ref_count')),
+                         [(products[1].product_image.name, 1)])
+        self.assertFalse(self.exists(products[2].product_image.name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            client.delete("/api/v1/product_types/bulk/", {"ids": [product_type.pk]}, format='json')
+
+        self.assertFalse(StoredImage.objects.exists())
+        self.assertFalse(self.exists(products[1].product_image.name))
+
+    def test_acquire_retries_insert_after_concurrent_collect(self):
+        create = StoredImage.objects.create
+        attempts = []
+
+        def collected_create(**kwargs):
+            # Первая вставка видит запись, которую `collect` удаляет до `UPDATE`
+            attempts.append(kwargs)
+            if len(attempts) == 1:
+                raise IntegrityError("UNIQUE constraint failed: stored_image.name")
+            return create(**kwargs)
+
+        with mock.patch.object(StoredImage.objects, 'create', side_effect=collected_create):
+            media.acquire("images/users/collected.png", 10)
+
+        self.assertEqual(len(attempts), 2)
+        self.assertEqual(StoredImage.objects.get(name="images/users/collected.png").ref_count, 1)
+
+    def test_report_command(self):
+        for number in range(3):
+            User.objects.create(username=f"user{number}", email=f"user{number}@madadev.ru", image=self.upload('red'))
+        output = io.StringIO()
+
+        call_command('media_report', stdout=output)
+
+        self.assertIn("References:        3", output.getvalue())
+        self.assertIn("(66.7%)", output.getvalue())
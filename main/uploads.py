@@ -0,0 +1,160 @@
+import io
+import warnings
+
+from PIL import Image
+
+from django.conf import settings
+from django.core.files.uploadhandler import FileUploadHandler, StopUpload
+from django.http import QueryDict
+from django.utils.datastructures import MultiValueDict
+
+from rest_framework import serializers
+
+
+HEADER_LIMIT = 256 * 1024
+
+
+def get_size_limit():
+    return settings.IMAGE_LIMIT_SIZE * 1024 * 1024
+
+
+def get_pixel_limit():
+    return getattr(settings, 'IMAGE_MAX_PIXELS', 25_000_000)
+
+
+def inspect_header(data):
+    """
+    Разбирает только заголовок изображения, не декодируя пиксели. Возвращает (формат, ширина, высота).
+    """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', Image.DecompressionBombWarning)
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                return image.format, image.width, image.height
+        except Image.DecompressionBombError:
+            return 'bomb', get_pixel_limit() + 1, 1
+
+
+def validate_header(data):
+    """
+    Проверяет заголовок изображения и лимит пикселей. Возвращает текст ошибки или None.
+    """
+    try:
+        image_format, width, height = inspect_header(data)
+    except Exception:  # noqa: Pillow бросает разные исключения на битых данных
+        return "Upload a valid image. The file you uploaded was either not an image or a corrupted image."
+
+    if width * height > get_pixel_limit():
+        return f"Image is too large: {width}x{height} pixels, limit is {get_pixel_limit()} pixels"
+
+    return None
+
+
+def size_error():
+    return f"Size of image more then {settings.IMAGE_LIMIT_SIZE}MB"
+
+
+class LimitedImageUploadHandler(FileUploadHandler):
+    """
+    Обработчик загрузки изображений, который ставится перед стандартными обработчиками Django.
+
+    Для полей из `fields` считает байты по мере чтения тела запроса и прерывает разбор, как только файл
+    превысил `IMAGE_LIMIT_SIZE`, а по первым байтам проверяет заголовок и число пикселей. Если
+    `Content-Length` заранее больше лимита, тело запроса не читается вовсе. Ошибки складываются
+    в `request.upload_errors`, их поднимает `raise_upload_errors`.
+    """
+
+    def __init__(self, request=None, fields=('image',)):
+        super().__init__(request)
+        self.fields = fields
+        self.tracking = False
+        self.header = b""
+        self.header_checked = False
+
+        if request is not None and not hasattr(request, 'upload_errors'):
+            request.upload_errors = {}
+
+    def fail(self, code, message, stop=True):
+        self.request.upload_errors[self.field_name] = (code, message)
+        if stop:
+            raise StopUpload(connection_reset=True)
+
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        overhead = getattr(settings, 'IMAGE_UPLOAD_OVERHEAD', 64 * 1024)
+        if content_length > get_size_limit() + overhead:
+            self.request.upload_errors['__all__'] = ('big_image', size_error())
+            return QueryDict(encoding=encoding), MultiValueDict()
+        return None
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.tracking = field_name in self.fields
+        self.header = b""
+        self.header_checked = False
+
+    def check_header(self, final=False):
+        error = validate_header(self.header)
+        if error is None or final or len(self.header) >= HEADER_LIMIT:
+            self.header_checked = True
+            if error is not None:
+                self.fail('invalid_image', error, stop=not final)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.tracking:
+            return raw_data
+
+        if start + len(raw_data) > get_size_limit():
+            self.fail('big_image', size_error())
+
+        if not self.header_checked:
+            self.header += raw_data[:HEADER_LIMIT - len(self.header)]
+            self.check_header()
+
+        return raw_data
+
+    def file_complete(self, file_size):
+        if self.tracking and not self.header_checked:
+            self.check_header(final=True)
+        return None
+
+
+def raise_upload_errors(request):
+    """
+    Разбирает тело запроса и поднимает ValidationError, если `LimitedImageUploadHandler` отклонил файл.
+    """
+    request.data  # noqa: запускает разбор multipart с нашими обработчиками
+    errors = getattr(request._request, 'upload_errors', None)
+
+    if errors:
+        field, (code, message) = next(iter(errors.items()))
+        raise serializers.ValidationError({"status": message, "field": field}, code=code)
+
+
+class ImageUploadLimitMixin:
+    """
+    Подключает `LimitedImageUploadHandler` к запросам вида для полей из `upload_image_fields`.
+    """
+    upload_image_fields = ('image',)
+
+    def initialize_request(self, request, *args, **kwargs):
+        request.upload_handlers.insert(0, LimitedImageUploadHandler(request, self.upload_image_fields))
+        return super().initialize_request(request, *args, **kwargs)
+
+
+class HeaderImageField(serializers.FileField):
+    """
+    Как `ImageField`, но проверяет только заголовок и число пикселей, а не декодирует изображение целиком.
+    """
+
+    def to_internal_value(self, data):
+        file = super().to_internal_value(data)
+
+        position = file.tell() if hasattr(file, 'tell') else 0
+        header = file.read(HEADER_LIMIT)
+        file.seek(position)
+
+        error = validate_header(header)
+        if error is not None:
+            raise serializers.ValidationError(error, code='invalid_image')
+
+        return file
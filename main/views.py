@@ -1,38 +1,50 @@
+import datetime
+
 from django.contrib.auth import login, logout
+from django.http import HttpResponse
 
 from drf_yasg.utils import swagger_auto_schema
 
-from rest_framework import viewsets, mixins, status, permissions
+from rest_framework import viewsets, mixins, status, permissions, renderers
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.views import APIView
 
+from activation import outbox
 from activation.views import ConfirmEmail, PasswordChangedEmail, PasswordRecoveryEmail, ReConfirmEmail
-from main import schemas
+from main import schemas, metrics, export, facets, media
+from main.bulk import BulkMixin
+from main.caching import CachedReadMixin
+from main.fastread import compile_serializer
+from main.feeds import AtomRenderer, RSSRenderer
+from main.filters import DateRangeFilter, FieldFilter, FullTextSearchFilter, TagFilter
+from main.mixins import AsyncReadMixin, SparseFieldsMixin, FastReadMixin
+from main.pagination import CatalogPagination
+from main.ratelimit import TokenBucketThrottle, client_ip
+from main.uploads import ImageUploadLimitMixin, raise_upload_errors
 from main.schemas import UsersSchemas, AuthUserSchemas, ProductSchemas, ProductTypeSchemas, MiniNewsSchemas
 from main.serializers import *
 
 
-class UsersViewSet(mixins.CreateModelMixin,
+class UsersViewSet(ImageUploadLimitMixin,
+                   mixins.CreateModelMixin,
                    mixins.DestroyModelMixin,
                    mixins.ListModelMixin,
                    mixins.RetrieveModelMixin,
                    viewsets.GenericViewSet):
     queryset = User.objects.all()
     serializer_class = CreateUserSerializer
+    pagination_class = CatalogPagination
+    cursor_ordering = 'id'
     permission_classes_by_action = {'list': [permissions.IsAdminUser | permissions.DjangoModelPermissions],
                                     'create': [permissions.AllowAny],
-                                    'delete': [permissions.IsAdminUser | permissions.DjangoModelPermissions]}
+                                    'delete': [permissions.IsAdminUser | permissions.DjangoModelPermissions],
+                                    'export': [permissions.IsAdminUser]}
+    query_budgets = {'list': 4, 'create': 5, 'retrieve': 2, 'update': 6, 'destroy': 6, 'export': 1}
 
     @staticmethod
     def get_ip(request):
-        x_forwarded_for = request.META.get('HTTP_X_FORWARDED_FOR')
-
-        if x_forwarded_for:
-            ip = x_forwarded_for.split(',')[0]
-        else:
-            ip = request.META.get('REMOTE_ADDR')
-
-        return ip
+        return client_ip(request)
 
     def get_permissions(self):
         try:
@@ -40,6 +52,12 @@ class UsersViewSet(mixins.CreateModelMixin,
         except KeyError:
             return [permission() for permission in self.permission_classes]
 
+    def perform_content_negotiation(self, request, force=False):
+        # `?format=csv` у выгрузки выбирает формат файла, а не рендерер DRF, ошибки отдаются в JSON
+        if self.action == 'export':
+            return renderers.JSONRenderer(), renderers.JSONRenderer.media_type
+        return super(UsersViewSet, self).perform_content_negotiation(request, force)
+
     @swagger_auto_schema(tags=["user"],
                          responses=UsersSchemas.response_user_retrieve(),
                          security=[schemas.bearer()],
@@ -58,14 +76,15 @@ class UsersViewSet(mixins.CreateModelMixin,
         """
         Список пользователей
         ===
-        При выводе полного списка пользователей можно указать `offset`, а также `limit`, для того чтобы либо сократить
-        ваш список, либо сдвинуть его.
+        По умолчанию список отдаётся страницами по курсору: `limit` задаёт размер страницы, а ссылки `next` и
+        `previous` содержат `cursor` следующей и предыдущей страницы. Старый режим с `offset` и `count` включается,
+        если передать `offset`.
         """
-        response = super(UsersViewSet, self).list(request, *args, **kwargs)
-
         if not request.user.has_perm('main.view_user'):
             return Response({"status": "user dont have permissions"}, status=status.HTTP_403_FORBIDDEN)
 
+        response = super(UsersViewSet, self).list(request, *args, **kwargs)
+
         return response
 
     @swagger_auto_schema(tags=["user"],
@@ -82,15 +101,17 @@ class UsersViewSet(mixins.CreateModelMixin,
         Данный метод защищен от повторной регистрации с одного и того же IP-адреса. Но если же пользователь
         забыл пароль или же не может подтвердить почту, ему необходимо будет обратиться к Администрации.
         """
+        raise_upload_errors(request)
+
         serializer = self.serializer_class(data=request.data, ip=self.get_ip(request))
         serializer.is_valid(raise_exception=True)
         self.perform_create(serializer)
 
-        user = User.objects.get(username=request.data.get('username'))
+        user = serializer.instance
 
         context = {'user': user}
         to = [user.email]
-        ConfirmEmail(request, context).send(to)
+        ConfirmEmail(request, context).queue(to)
 
         headers = self.get_success_headers(serializer.data)
 
@@ -109,6 +130,8 @@ class UsersViewSet(mixins.CreateModelMixin,
         `is_superuser`
         """
 
+        raise_upload_errors(request)
+
         if not request.data:
             return Response({"empty": "request data is empty"}, status.HTTP_400_BAD_REQUEST)
 
@@ -124,19 +147,37 @@ class UsersViewSet(mixins.CreateModelMixin,
         if email:
             context = {'user': instance}
             to = [instance.email]
-            ReConfirmEmail(request, context).send(to)
+            ReConfirmEmail(request, context).queue(to)
 
         headers = self.get_success_headers(serializer.data)
 
         return Response(serializer.data, status.HTTP_200_OK, headers=headers)
 
+    @swagger_auto_schema(tags=["user"],
+                         manual_parameters=UsersSchemas.send_export(),
+                         responses=UsersSchemas.response_export(),
+                         security=[schemas.bearer()],
+                         operation_id="export users")
+    @action(detail=False, methods=['get'])
+    def export(self, request, *args, **kwargs):
+        """
+        Выгрузка пользователей
+        ===
+        Все пользователи одним потоком в NDJSON (по объекту на строку) или CSV, поля как в списке
+        пользователей. Только для администрации.
+        """
+        export_format = export.get_format(request)
+        queryset = export.filter_users(User.objects.order_by('id'), request.query_params)
+        serializer = self.get_serializer()
+
+        return export.export_response(queryset, serializer, export_format, "users")
+
     @swagger_auto_schema(tags=["user"],
                          responses=UsersSchemas.response_delete(),
                          security=[schemas.bearer()],
                          operation_id="delete user")
     def destroy(self, request, *args, **kwargs):
         instance = self.get_object()
-
         self.perform_destroy(instance)
 
         return Response(status=status.HTTP_204_NO_CONTENT)
@@ -144,9 +185,12 @@ class UsersViewSet(mixins.CreateModelMixin,
 
 class AuthAPIView(viewsets.ViewSet):
     serializer_class = LoginSerializer
+    throttle_classes = (TokenBucketThrottle,)
 
     permission_classes_by_action = {'login': [permissions.AllowAny],
                                     'send_mail_recovery_password': [permissions.AllowAny]}
+    query_budgets = {'login': 5, 'logout': 2, 'change_password': 3, 'send_mail_recovery_password': 2,
+                     'confirm_email': 2}
 
     def get_permissions(self):
         try:
@@ -215,7 +259,7 @@ class AuthAPIView(viewsets.ViewSet):
         serializer = PasswordChangeSerializer(instance=user, data=request.data)
         if serializer.is_valid(raise_exception=True):
             context = {'user': user}
-            PasswordChangedEmail(request, context).send(user)
+            PasswordChangedEmail(request, context).queue(user)
 
             return Response({'status': "ok"}, status=status.HTTP_200_OK)
 
@@ -243,7 +287,7 @@ class AuthAPIView(viewsets.ViewSet):
             user = serializer.get_user()
 
             context = {'user': user}
-            PasswordRecoveryEmail(request, context).send(to=user)
+            PasswordRecoveryEmail(request, context).queue(to=user)
 
             return Response({'status': "email send to user"}, status=status.HTTP_200_OK)
 
@@ -262,12 +306,18 @@ class AuthAPIView(viewsets.ViewSet):
             return Response({"status": "email already verified"}, status=status.HTTP_409_CONFLICT)
 
         context = {'user': request.user}
-        ReConfirmEmail(request, context).send([request.user.email])
+        ReConfirmEmail(request, context).queue([request.user.email])
 
         return Response({"status": "email send"}, status.HTTP_200_OK)
 
 
-class ProductAPIView(mixins.CreateModelMixin,
+class ProductAPIView(ImageUploadLimitMixin,
+                     CachedReadMixin,
+                     AsyncReadMixin,
+                     SparseFieldsMixin,
+                     FastReadMixin,
+                     BulkMixin,
+                     mixins.CreateModelMixin,
                      mixins.DestroyModelMixin,
                      mixins.ListModelMixin,
                      mixins.RetrieveModelMixin,
@@ -275,6 +325,27 @@ class ProductAPIView(mixins.CreateModelMixin,
     permission_classes = [permissions.DjangoModelPermissionsOrAnonReadOnly]
     serializer_class = ProductSerializer
     queryset = Product.objects.all()
+    pagination_class = CatalogPagination
+    cursor_ordering = 'product_id'
+    fast_read = True
+    cache_resource = 'products'
+    filter_backends = [FieldFilter, TagFilter, FullTextSearchFilter]
+    filter_fields = {'product_type': 'product_type_id'}
+    query_budgets = {'list': 2, 'retrieve': 1, 'create': 3, 'destroy': 3, 'bulk': 9, 'bulk_delete': 7,
+                     'facets': 2}
+    upload_image_fields = ('product_image',)
+    cache_expand_dependencies = {'product_type': 'product_types'}
+    facets_limit = 50
+
+    def perform_bulk_create(self, objects, relations):
+        super(ProductAPIView, self).perform_bulk_create(objects, relations)
+        facets.add_products(objects, [relation.get('tags') or [product.product_tag]
+                                      for product, relation in zip(objects, relations)])
+
+    def perform_bulk_delete(self, model, ids):
+        facets.forget_products(Product.objects.filter(pk__in=ids))
+        media.release_rows(Product.objects.filter(pk__in=ids), 'product_image')
+        return super(ProductAPIView, self).perform_bulk_delete(model, ids)
 
     @swagger_auto_schema(tags=["product"],
                          request_body=ProductSchemas.product_request(),
@@ -287,11 +358,13 @@ class ProductAPIView(mixins.CreateModelMixin,
         ===
         Продукт проекта - это то что создает MaDaDev Inc.
         """
+        raise_upload_errors(request)
+
         response = super(ProductAPIView, self).create(request, *args, **kwargs)
         return response
 
     @swagger_auto_schema(tags=["product"],
-                         manual_parameters=ProductSchemas.send_list(),
+                         manual_parameters=ProductSchemas.send_list() + schemas.sparse_fields(['product_type', 'tags']),
                          responses=ProductSchemas.response_list(),
                          operation_id="get list products")
     def list(self, request, *args, **kwargs):
@@ -304,6 +377,7 @@ class ProductAPIView(mixins.CreateModelMixin,
         return response
 
     @swagger_auto_schema(tags=["product"],
+                         manual_parameters=schemas.sparse_fields(['product_type', 'tags']),
                          responses=ProductTypeSchemas.response_list(),
                          operation_id="product")
     def retrieve(self, request, *args, **kwargs):
@@ -327,8 +401,35 @@ class ProductAPIView(mixins.CreateModelMixin,
         response = super(ProductAPIView, self).list(request, *args, **kwargs)
         return response
 
-
-class ProductTypeAPIView(mixins.CreateModelMixin,
+    @swagger_auto_schema(tags=["product"],
+                         manual_parameters=ProductSchemas.send_facets(),
+                         responses=ProductSchemas.response_facets(),
+                         operation_id="product facets")
+    @action(detail=False, methods=['get'])
+    def facets(self, request, *args, **kwargs):
+        """
+        Счётчики фильтров каталога
+        ===
+        Количество продуктов по самым частым тегам и по каждой категории. Счётчики обновляются при записи
+        продуктов, поэтому ответ не пересчитывается по таблице продуктов.
+        """
+        try:
+            limit = int(request.query_params.get('limit', self.facets_limit))
+        except ValueError:
+            limit = -1
+        if not 0 < limit <= 1000:
+            return Response({"status": "limit must be an integer from 1 to 1000"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(facets.get_facets(limit), status=status.HTTP_200_OK)
+
+
+class ProductTypeAPIView(CachedReadMixin,
+                         AsyncReadMixin,
+                         SparseFieldsMixin,
+                         FastReadMixin,
+                         BulkMixin,
+                         mixins.CreateModelMixin,
                          mixins.DestroyModelMixin,
                          mixins.ListModelMixin,
                          mixins.RetrieveModelMixin,
@@ -336,6 +437,18 @@ class ProductTypeAPIView(mixins.CreateModelMixin,
     permission_classes = [permissions.DjangoModelPermissionsOrAnonReadOnly]
     serializer_class = ProductTypeSerializer
     queryset = TypeProduct.objects.all()
+    pagination_class = CatalogPagination
+    cursor_ordering = 'product_type_id'
+    fast_read = True
+    cache_resource = 'product_types'
+    query_budgets = {'list': 2, 'retrieve': 1, 'create': 2, 'destroy': 3, 'bulk': 2, 'bulk_delete': 8}
+    bulk_delete_invalidates = ('products',)
+
+    def perform_bulk_delete(self, model, ids):
+        # Продукты удаляются каскадом без сигналов, их теги и изображения перестают учитываться здесь
+        facets.forget_products(Product.objects.filter(product_type_id__in=ids))
+        media.release_rows(Product.objects.filter(product_type_id__in=ids), 'product_image')
+        return super(ProductTypeAPIView, self).perform_bulk_delete(model, ids)
 
     @swagger_auto_schema(tags=["product"],
                          request_body=ProductTypeSchemas.product_request(),
@@ -351,7 +464,7 @@ class ProductTypeAPIView(mixins.CreateModelMixin,
         return response
 
     @swagger_auto_schema(tags=["product"],
-                         manual_parameters=ProductTypeSchemas.send_list(),
+                         manual_parameters=ProductTypeSchemas.send_list() + schemas.sparse_fields(),
                          responses=ProductTypeSchemas.response_list(),
                          operation_id="get list product types")
     def list(self, request, *args, **kwargs):
@@ -363,6 +476,7 @@ class ProductTypeAPIView(mixins.CreateModelMixin,
         return response
 
     @swagger_auto_schema(tags=["product"],
+                         manual_parameters=schemas.sparse_fields(),
                          responses=ProductTypeSchemas.response_list(),
                          operation_id="product type")
     def retrieve(self, request, *args, **kwargs):
@@ -386,14 +500,57 @@ class ProductTypeAPIView(mixins.CreateModelMixin,
         return response
 
 
-class MiniNewsAPIView(mixins.CreateModelMixin,
+class MiniNewsAPIView(CachedReadMixin,
+                      AsyncReadMixin,
+                      SparseFieldsMixin,
+                      FastReadMixin,
+                      BulkMixin,
+                      mixins.CreateModelMixin,
                       mixins.DestroyModelMixin,
                       mixins.ListModelMixin,
                       mixins.RetrieveModelMixin,
                       viewsets.GenericViewSet):
     permission_classes = [permissions.DjangoModelPermissionsOrAnonReadOnly]
-    serializer_class = ProductTypeSerializer
+    serializer_class = MiniNewsSerializer
     queryset = MiniNews.objects.all()
+    pagination_class = CatalogPagination
+    cursor_ordering = 'mini_news_id'
+    cursor_ordering_fields = ('mini_news_id', 'mn_date')
+    fast_read = True
+    cache_resource = 'mini_news'
+    cache_actions = ('list', 'retrieve', 'latest')
+    # Все параметры, которые меняют ответ `latest`: `n`, фильтры дат и полнотекстовый поиск
+    cache_query_params = {'latest': ('n', 'date_after', 'date_before', 'q')}
+    # Свежесть ленты обеспечивает версия ресурса, время жизни только ограничивает хранение записей
+    cache_timeouts = {'latest': 60 * 60}
+    filter_backends = [DateRangeFilter, FullTextSearchFilter]
+    date_range_field = 'mn_date'
+    query_budgets = {'list': 2, 'retrieve': 1, 'create': 2, 'destroy': 3, 'bulk': 2, 'bulk_delete': 2,
+                     'latest': 1}
+    latest_default = 10
+    latest_max = 100
+    latest_ordering = ('-mn_date', '-mini_news_id')
+
+    def get_feed(self, request):
+        return {
+            'title': "MaDaDev mini news",
+            'link': request.build_absolute_uri("/api/v1/mini_news/"),
+            'description': "Последние мини новости MaDaDev",
+            'feed_url': request.build_absolute_uri(),
+            'language': "ru",
+        }
+
+    def get_feed_item(self, item, request):
+        link = request.build_absolute_uri(f"/api/v1/mini_news/{item['mini_news_id']}/")
+        day = datetime.date.fromisoformat(item['mn_date'])
+
+        return {
+            'title': item['mn_title'],
+            'link': link,
+            'description': item['mn_desc'],
+            'unique_id': link,
+            'pubdate': datetime.datetime.combine(day, datetime.time.min, tzinfo=datetime.timezone.utc),
+        }
 
     @swagger_auto_schema(tags=["mini_news"],
                          request_body=MiniNewsSchemas.mini_news_request(),
@@ -409,7 +566,7 @@ class MiniNewsAPIView(mixins.CreateModelMixin,
         return response
 
     @swagger_auto_schema(tags=["mini_news"],
-                         manual_parameters=MiniNewsSchemas.send_list_mini_news(),
+                         manual_parameters=MiniNewsSchemas.send_list_mini_news() + schemas.sparse_fields(),
                          responses=MiniNewsSchemas.response_list(),
                          operation_id="get list mini news")
     def list(self, request, *args, **kwargs):
@@ -421,6 +578,7 @@ class MiniNewsAPIView(mixins.CreateModelMixin,
         return response
 
     @swagger_auto_schema(tags=["mini_news"],
+                         manual_parameters=schemas.sparse_fields(),
                          responses=MiniNewsSchemas.response_list(),
                          operation_id="mini news")
     def retrieve(self, request, *args, **kwargs):
@@ -431,6 +589,32 @@ class MiniNewsAPIView(mixins.CreateModelMixin,
         response = super(MiniNewsAPIView, self).retrieve(request, *args, **kwargs)
         return response
 
+    @swagger_auto_schema(tags=["mini_news"],
+                         manual_parameters=MiniNewsSchemas.send_latest(),
+                         responses=MiniNewsSchemas.response_latest(),
+                         operation_id="latest mini news")
+    @action(detail=False, methods=['get'],
+            renderer_classes=[renderers.JSONRenderer, RSSRenderer, AtomRenderer])
+    def latest(self, request, *args, **kwargs):
+        """
+        Последние мини новости
+        ===
+        `n` самых новых новостей одним запросом по индексу дат, в JSON или лентой RSS и Atom. Ответ
+        собирается один раз после записи в мини новости и до следующей записи отдаётся из кэша.
+        """
+        try:
+            count = int(request.query_params.get('n', self.latest_default))
+        except ValueError:
+            count = 0
+        if not 0 < count <= self.latest_max:
+            return Response({"status": f"n must be an integer from 1 to {self.latest_max}"},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        compiled = compile_serializer(self.get_serializer())
+        queryset = self.filter_queryset(self.get_queryset()).order_by(*self.latest_ordering)
+
+        return Response(compiled.many(queryset.values(*compiled.columns)[:count], request))
+
     @swagger_auto_schema(tags=["mini_news"],
                          responses=MiniNewsSchemas.response_delete(),
                          security=[schemas.bearer()],
@@ -442,3 +626,21 @@ class MiniNewsAPIView(mixins.CreateModelMixin,
         """
         response = super(MiniNewsAPIView, self).list(request, *args, **kwargs)
         return response
+
+
+class MetricsAPIView(APIView):
+    """
+    Метрики процесса в текстовом формате Prometheus, только для персонала.
+    """
+    permission_classes = (permissions.IsAdminUser,)
+    swagger_schema = None
+    query_budgets = {'get': 2}
+
+    def perform_content_negotiation(self, request, force=False):
+        # Prometheus присылает `Accept: text/plain`, ответ формируется без рендереров DRF
+        return renderers.JSONRenderer(), renderers.JSONRenderer.media_type
+
+    def get(self, request, *args, **kwargs):
+        outbox.outbox_depth.set(outbox.queue_depth())
+
+        return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')